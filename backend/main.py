@@ -1,3 +1,5 @@
+import os
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 
@@ -10,29 +12,61 @@ from routes.admin_clients import router as admin_clients_router
 from routes.usage_routes import router as usage_router
 from routes.sheet_routes import router as sheet_router
 from routes.client_auth import router as client_auth_router
+from routes.blob_routes import router as blob_router
+from routes.metrics_routes import router as metrics_router
 
 # ✅ DB init
-from sqlalchemy import text
-from utils.database import Base, engine
+from utils.database import engine, async_engine
+from migrations import init_schema
 
-# Create DB tables
-Base.metadata.create_all(bind=engine)
+# ✅ Shared Gemini HTTP client
+from services.http_client import start_http_client, close_http_client
 
-# Migration: add downloaded_at to row_rationales if missing
-def _migrate_downloaded_at():
+# ✅ Batched usage writer
+from services.usage_service import start_usage_queue, stop_usage_queue
+
+# ✅ Background rationale generation workers
+from services.job_service import start_job_workers, stop_job_workers
+
+# ✅ Request body size cap
+from utils.request_limits import BodySizeLimitMiddleware
+
+# ✅ Prometheus metrics (/metrics)
+from services.metrics import MetricsMiddleware, instrument_engine, start_metrics, stop_metrics
+
+# Schema work runs at startup, not at import, so scripts that import the app
+# stay fast. Set to 0 when a release step runs `python -m migrations` instead.
+RUN_MIGRATIONS_ON_STARTUP = os.getenv("RUN_MIGRATIONS_ON_STARTUP", "1") != "0"
+
+# Statement timings for both engines (db_query_duration_seconds)
+instrument_engine(engine, "sync")
+instrument_engine(async_engine.sync_engine, "async")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    if RUN_MIGRATIONS_ON_STARTUP:
+        # Create DB tables and apply pending migrations (see migrations/__init__.py)
+        init_schema(engine)
+
+    # One pooled (keep-alive, HTTP/2) client for all Gemini calls
+    await start_http_client()
+    # Usage rows are buffered and flushed in bulk; drained on shutdown
+    start_usage_queue()
+    # Resumes generation jobs left pending (or interrupted) by the previous run
+    start_job_workers()
+    # Event-loop lag probe for /metrics
+    start_metrics()
     try:
-        with engine.connect() as conn:
-            if "sqlite" in str(engine.url):
-                r = conn.execute(text("PRAGMA table_info(row_rationales)"))
-                cols = [row[1] for row in r]
-                if "downloaded_at" not in cols:
-                    conn.execute(text("ALTER TABLE row_rationales ADD COLUMN downloaded_at DATETIME"))
-                    conn.commit()
-    except Exception:
-        pass
-_migrate_downloaded_at()
-
-app = FastAPI(title="Rationale Generator API")
+        yield
+    finally:
+        await stop_metrics()
+        # Workers first: finishing jobs still record usage
+        await stop_job_workers()
+        await stop_usage_queue()
+        await close_http_client()
+        await async_engine.dispose()
+
+app = FastAPI(title="Rationale Generator API", lifespan=lifespan)
 
 # ✅ CORS - allow localhost from any port + production origins
 app.add_middleware(
@@ -58,6 +92,12 @@ app.add_middleware(
     allow_headers=["*", "X-GEMINI-API-KEY"],
 )
 
+# ✅ Reject oversized uploads while they stream in (MAX_REQUEST_BYTES; MAX_BATCH_REQUEST_BYTES for batch generation)
+app.add_middleware(BodySizeLimitMiddleware)
+
+# ✅ Per-route request counts, latency and in-flight gauges; added last so it wraps everything
+app.add_middleware(MetricsMiddleware)
+
 # ✅ Existing Gemini routes
 app.include_router(gemini_router)
 
@@ -67,6 +107,10 @@ app.include_router(admin_clients_router)
 app.include_router(usage_router)
 app.include_router(sheet_router)
 app.include_router(client_auth_router)
+app.include_router(blob_router)
+
+# ✅ Prometheus scrape endpoint
+app.include_router(metrics_router)
 
 @app.get("/")
 def health():
@@ -0,0 +1,49 @@
+"""
+Move inline base64 chart images (row_rationales.image_preview) into the blob store.
+Uses DATABASE_URL and BLOB_DIR from env (same as the backend). Safe to re-run.
+Run: python migrate_images_to_blobs.py
+"""
+from migrations import init_schema
+from models.sheet import RowRationale
+from utils.blob_store import store_image_preview
+from utils.database import SessionLocal, engine
+
+BATCH_SIZE = 100
+
+
+def migrate_images():
+    db = SessionLocal()
+    moved = 0
+    failed = 0
+    last_id = 0
+    try:
+        while True:
+            batch = (
+                db.query(RowRationale)
+                .filter(RowRationale.id > last_id, RowRationale.image_preview.isnot(None))
+                .order_by(RowRationale.id)
+                .limit(BATCH_SIZE)
+                .all()
+            )
+            if not batch:
+                break
+
+            for r in batch:
+                last_id = r.id
+                try:
+                    r.image_hash = store_image_preview(r.image_preview)
+                    r.image_preview = None
+                    moved += 1
+                except ValueError:
+                    failed += 1
+            db.commit()
+            print(f"Moved {moved} images so far...")
+    finally:
+        db.close()
+
+    print(f"Done. Moved {moved} images, {failed} could not be decoded.")
+
+
+if __name__ == "__main__":
+    init_schema(engine)
+    migrate_images()
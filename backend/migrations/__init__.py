@@ -0,0 +1,153 @@
+"""
+Versioned schema migrations.
+
+Each migration runs once, in order, inside its own transaction and is
+recorded in the schema_migrations table. Add new migrations to the end of
+MIGRATIONS with the next version number; never edit or reorder applied ones.
+Migrations must be safe on a fresh database too, where
+Base.metadata.create_all has already created the latest schema.
+"""
+from sqlalchemy import text, inspect
+from sqlalchemy.engine import Connection, Engine
+from sqlalchemy.orm import Session
+
+
+# ===============================
+# Helpers
+# ===============================
+def _column_names(conn: Connection, table: str) -> set[str]:
+    return {c["name"] for c in inspect(conn).get_columns(table)}
+
+
+def _add_column_if_missing(conn: Connection, table: str, column: str, ddl_type: str):
+    if column not in _column_names(conn, table):
+        conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {column} {ddl_type}"))
+
+
+# ===============================
+# Migrations
+# ===============================
+def _0001_row_rationales_downloaded_at(conn: Connection):
+    _add_column_if_missing(conn, "row_rationales", "downloaded_at", "TIMESTAMP")
+
+
+def _0002_row_rationales_image_hash(conn: Connection):
+    _add_column_if_missing(conn, "row_rationales", "image_hash", "VARCHAR(64)")
+    conn.execute(text(
+        "CREATE INDEX IF NOT EXISTS ix_row_rationales_image_hash ON row_rationales (image_hash)"
+    ))
+
+
+def _0003_sheet_rows_from_rows_data(conn: Connection):
+    from services.sheet_service import migrate_legacy_rows
+    with Session(bind=conn) as db:
+        migrated = migrate_legacy_rows(db)
+    if migrated:
+        print(f"Migrated rows_data into sheet_rows for {migrated} sheets")
+
+
+def _0004_row_rationales_sheet_row_unique(conn: Connection):
+    # Keep only the newest rationale per (sheet_id, row_index) before enforcing uniqueness
+    conn.execute(text(
+        """
+        DELETE FROM row_rationales
+        WHERE id NOT IN (
+            SELECT MAX(id) FROM row_rationales GROUP BY sheet_id, row_index
+        )
+        """
+    ))
+    conn.execute(text(
+        "CREATE UNIQUE INDEX IF NOT EXISTS uq_row_rationales_sheet_row "
+        "ON row_rationales (sheet_id, row_index)"
+    ))
+
+
+def _0005_usage_rollups(conn: Connection):
+    conn.execute(text(
+        "CREATE INDEX IF NOT EXISTS ix_usage_client_id_created_at ON usage (client_id, created_at)"
+    ))
+    # Backfill usage_daily (created by create_all) from the existing usage rows
+    day = "date(created_at)" if conn.dialect.name == "sqlite" else "CAST(created_at AS DATE)"
+    conn.execute(text(
+        f"""
+        INSERT INTO usage_daily (client_id, action, day, request_count, tokens_used, last_activity)
+        SELECT client_id, COALESCE(action, ''), {day}, COUNT(*), COALESCE(SUM(tokens_used), 0), MAX(created_at)
+        FROM usage
+        WHERE client_id IS NOT NULL
+        GROUP BY client_id, COALESCE(action, ''), {day}
+        """
+    ))
+
+
+def _0006_usage_gemini_accounting(conn: Connection):
+    for column, ddl_type in (
+        ("model", "VARCHAR"),
+        ("plan_type", "VARCHAR"),
+        ("prompt_tokens", "INTEGER"),
+        ("candidate_tokens", "INTEGER"),
+        ("image_tokens", "INTEGER"),
+        ("cached_tokens", "INTEGER"),
+        ("latency_ms", "INTEGER"),
+        ("cost_usd", "FLOAT"),
+        ("stages", "JSON"),
+    ):
+        _add_column_if_missing(conn, "usage", column, ddl_type)
+    conn.execute(text("CREATE INDEX IF NOT EXISTS ix_usage_created_at ON usage (created_at)"))
+
+
+MIGRATIONS = [
+    ("0001", "row_rationales.downloaded_at", _0001_row_rationales_downloaded_at),
+    ("0002", "row_rationales.image_hash", _0002_row_rationales_image_hash),
+    ("0003", "sheet_rows from sheets.rows_data", _0003_sheet_rows_from_rows_data),
+    ("0004", "unique (sheet_id, row_index) on row_rationales", _0004_row_rationales_sheet_row_unique),
+    ("0005", "usage (client_id, created_at) index and usage_daily rollups", _0005_usage_rollups),
+    ("0006", "usage model / stage tokens / latency / cost columns", _0006_usage_gemini_accounting),
+]
+
+
+# ===============================
+# Runner
+# ===============================
+def init_schema(engine: Engine) -> list[str]:
+    """
+    Create missing tables, then apply pending migrations.
+    Run from the app lifespan (RUN_MIGRATIONS_ON_STARTUP) or `python -m migrations`.
+    """
+    # Register every model on Base.metadata before create_all
+    import models.admin  # noqa: F401
+    import models.client  # noqa: F401
+    import models.sheet  # noqa: F401
+    import models.usage  # noqa: F401
+    from utils.database import Base
+
+    Base.metadata.create_all(bind=engine)
+    return run_migrations(engine)
+
+
+def run_migrations(engine: Engine) -> list[str]:
+    """Apply pending migrations. Returns the versions applied."""
+    with engine.begin() as conn:
+        conn.execute(text(
+            """
+            CREATE TABLE IF NOT EXISTS schema_migrations (
+                version VARCHAR(32) PRIMARY KEY,
+                description VARCHAR(255),
+                applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+            """
+        ))
+        applied = {row[0] for row in conn.execute(text("SELECT version FROM schema_migrations"))}
+
+    newly_applied = []
+    for version, description, migrate in MIGRATIONS:
+        if version in applied:
+            continue
+        with engine.begin() as conn:
+            migrate(conn)
+            conn.execute(
+                text("INSERT INTO schema_migrations (version, description) VALUES (:v, :d)"),
+                {"v": version, "d": description},
+            )
+        print(f"Applied migration {version}: {description}")
+        newly_applied.append(version)
+    return newly_applied
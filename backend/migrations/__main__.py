@@ -0,0 +1,12 @@
+"""
+Create tables and apply pending migrations, then exit.
+Uses DATABASE_URL from env (same DB the backend connects to).
+Run: python -m migrations
+"""
+from migrations import init_schema
+from utils.database import engine
+
+
+if __name__ == "__main__":
+    applied = init_schema(engine)
+    print(f"Schema up to date ({len(applied)} migrations applied)")
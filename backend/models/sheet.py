@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Text, JSON
+from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Text, JSON, Index
 from sqlalchemy.sql import func
 from sqlalchemy.orm import relationship
 from utils.database import Base
@@ -10,15 +10,41 @@ class Sheet(Base):
     client_id = Column(Integer, ForeignKey("clients.id"), nullable=False)
     file_name = Column(String, nullable=False)
     upload_date = Column(String, nullable=False)  # YYYY-MM-DD format
-    rows_data = Column(JSON, nullable=False)  # Store the Excel rows as JSON
+    # Legacy JSON copy of the Excel rows; rows now live in sheet_rows (kept empty for new sheets)
+    legacy_rows_data = Column("rows_data", JSON, nullable=False, default=list)
     processed_rows = Column(JSON, default=list)  # Array of row indices that have been processed
     created_at = Column(DateTime, server_default=func.now())
     updated_at = Column(DateTime, server_default=func.now(), onupdate=func.now())
 
     # Relationship to row rationales
     row_rationales = relationship("RowRationale", back_populates="sheet", cascade="all, delete-orphan")
+    rows = relationship(
+        "SheetRow",
+        back_populates="sheet",
+        cascade="all, delete-orphan",
+        order_by="SheetRow.position",
+    )
     client = relationship("Client", back_populates="sheets")
 
+    @property
+    def rows_data(self):
+        """Excel rows as a list of dicts, in sheet order."""
+        return [row.data for row in self.rows]
+
+class SheetRow(Base):
+    __tablename__ = "sheet_rows"
+
+    id = Column(Integer, primary_key=True, index=True)  # Stable row id
+    sheet_id = Column(Integer, ForeignKey("sheets.id", ondelete="CASCADE"), nullable=False)
+    position = Column(Integer, nullable=False)  # 0-based ordering key == API row_index
+    data = Column(JSON, nullable=False)  # One Excel row as a dict
+
+    sheet = relationship("Sheet", back_populates="rows")
+
+    __table_args__ = (
+        Index("ix_sheet_rows_sheet_id_position", "sheet_id", "position"),
+    )
+
 class RowRationale(Base):
     __tablename__ = "row_rationales"
 
@@ -27,7 +53,8 @@ class RowRationale(Base):
     row_index = Column(Integer, nullable=False)  # The row index in the sheet
     rationale_text = Column(Text, nullable=False)  # The technical commentary
     rationale_result = Column(JSON)  # Full API response stored as JSON
-    image_preview = Column(Text)  # Base64 encoded image
+    image_preview = Column(Text)  # Legacy inline base64 image (new rows use image_hash)
+    image_hash = Column(String(64), nullable=True, index=True)  # SHA-256 of the chart in the blob store
     editable_rationale = Column(Text)  # Editable version of rationale
     downloaded_at = Column(DateTime, nullable=True)  # When user exported PDF for this row
     generated_date = Column(DateTime, server_default=func.now())
@@ -37,3 +64,43 @@ class RowRationale(Base):
     # Relationship to sheet
     sheet = relationship("Sheet", back_populates="row_rationales")
 
+    __table_args__ = (
+        # One rationale per row; also serves every (sheet_id, row_index) lookup
+        Index("uq_row_rationales_sheet_row", "sheet_id", "row_index", unique=True),
+    )
+
+    @property
+    def image_url(self):
+        return f"/blobs/{self.image_hash}" if self.image_hash else None
+
+
+class GenerationJob(Base):
+    """One queued rationale generation for a sheet row, run by the in-process worker pool."""
+    __tablename__ = "generation_jobs"
+
+    id = Column(Integer, primary_key=True, index=True)
+    client_id = Column(Integer, ForeignKey("clients.id"), nullable=False)
+    sheet_id = Column(Integer, ForeignKey("sheets.id", ondelete="CASCADE"), nullable=False)
+    row_id = Column(Integer, nullable=True)  # SheetRow.id; stable across row deletes that shift positions
+    status = Column(String, nullable=False, default="pending")  # pending | running | succeeded | failed | cancelled
+    plan_type = Column(String, nullable=True)
+    user_prompt = Column(Text, nullable=True)
+    image_hash = Column(String(64), nullable=False)  # Chart in the blob store
+    mime_type = Column(String, nullable=False)
+    api_key_encrypted = Column(Text, nullable=True)  # Client's Gemini key (JWE); cleared once the job is done
+    attempts = Column(Integer, nullable=False, default=0)
+    run_after = Column(DateTime, nullable=True)  # Backoff before the next attempt
+    worker_id = Column(String, nullable=True)
+    lease_expires_at = Column(DateTime, nullable=True)  # A running job whose lease lapsed is picked up again
+    error = Column(Text, nullable=True)
+    rationale_id = Column(Integer, nullable=True)
+    tokens_used = Column(Integer, nullable=True)
+    created_at = Column(DateTime, server_default=func.now())
+    started_at = Column(DateTime, nullable=True)
+    finished_at = Column(DateTime, nullable=True)
+
+    __table_args__ = (
+        Index("ix_generation_jobs_sheet_id_status", "sheet_id", "status"),
+        # Workers claim the oldest runnable job
+        Index("ix_generation_jobs_status_id", "status", "id"),
+    )
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, ForeignKey, DateTime
+from sqlalchemy import Column, Integer, String, ForeignKey, DateTime, Date, Index, Float, JSON
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
 from utils.database import Base
@@ -11,5 +11,39 @@ class Usage(Base):
     action = Column(String)
     tokens_used = Column(Integer)
     created_at = Column(DateTime, server_default=func.now())
-    
+
+    # Gemini accounting; NULL for usage recorded without call details (e.g. /usage/create)
+    model = Column(String, nullable=True)
+    plan_type = Column(String, nullable=True)
+    prompt_tokens = Column(Integer, nullable=True)
+    candidate_tokens = Column(Integer, nullable=True)
+    image_tokens = Column(Integer, nullable=True)
+    cached_tokens = Column(Integer, nullable=True)
+    latency_ms = Column(Integer, nullable=True)  # NULL for response-cache hits
+    cost_usd = Column(Float, nullable=True)  # At the prices in effect when recorded
+    stages = Column(JSON, nullable=True)  # Per Gemini call: stage, model, tokens, latency_ms, cost_usd
+
     client = relationship("Client", back_populates="usage")
+
+    __table_args__ = (
+        # Per-client, time-ranged usage listings
+        Index("ix_usage_client_id_created_at", "client_id", "created_at"),
+        # All-client time ranges (cost dashboard)
+        Index("ix_usage_created_at", "created_at"),
+    )
+
+class UsageDaily(Base):
+    """Per client, per action, per day totals; updated with every batch of usage rows written."""
+    __tablename__ = "usage_daily"
+
+    id = Column(Integer, primary_key=True)
+    client_id = Column(Integer, ForeignKey("clients.id"), nullable=False)
+    action = Column(String, nullable=False)
+    day = Column(Date, nullable=False)  # UTC day of Usage.created_at
+    request_count = Column(Integer, nullable=False, default=0)
+    tokens_used = Column(Integer, nullable=False, default=0)
+    last_activity = Column(DateTime)
+
+    __table_args__ = (
+        Index("uq_usage_daily_client_action_day", "client_id", "action", "day", unique=True),
+    )
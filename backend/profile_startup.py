@@ -0,0 +1,62 @@
+"""
+Report where backend cold-start time goes.
+Imports main in a fresh interpreter with `-X importtime`, then lists the
+slowest modules (cumulative and self time) and times the schema step.
+Run: python profile_startup.py [--top 25] [--schema]
+"""
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+
+def profile_imports(target: str = "main") -> list[tuple[str, int, int]]:
+    """Returns (module, self_us, cumulative_us) for every module imported by `target`."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {target}"],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        capture_output=True,
+        text=True,
+    )
+    if result.returncode != 0:
+        raise SystemExit(result.stderr)
+
+    rows = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, module = line[len("import time:"):].split("|")
+        rows.append((module.strip(), int(self_us), int(cumulative_us)))
+    return rows
+
+
+def profile_schema() -> float:
+    from migrations import init_schema
+    from utils.database import engine
+
+    started = time.perf_counter()
+    init_schema(engine)
+    return time.perf_counter() - started
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--top", type=int, default=25)
+    parser.add_argument("--schema", action="store_true", help="also time create_all + migrations")
+    args = parser.parse_args()
+
+    rows = profile_imports()
+    total = next((c for m, s, c in rows if m == "main"), sum(s for m, s, c in rows))
+    print(f"import main: {total / 1000:.1f} ms ({len(rows)} modules)\n")
+
+    print("Slowest by cumulative time:")
+    for module, self_us, cumulative_us in sorted(rows, key=lambda r: r[2], reverse=True)[:args.top]:
+        print(f"  {cumulative_us / 1000:9.1f} ms  {module}")
+
+    print("\nSlowest by self time:")
+    for module, self_us, cumulative_us in sorted(rows, key=lambda r: r[1], reverse=True)[:args.top]:
+        print(f"  {self_us / 1000:9.1f} ms  {module}")
+
+    if args.schema:
+        print(f"\ninit_schema: {profile_schema() * 1000:.1f} ms")
@@ -1,9 +1,11 @@
-from fastapi import APIRouter, Depends, HTTPException
+from datetime import datetime
+from typing import Optional
+from fastapi import APIRouter, Depends, HTTPException, Query
 from sqlalchemy.orm import Session
 from sqlalchemy import func
 
 from models.client import Client
-from models.usage import Usage
+from models.usage import Usage, UsageDaily
 from schemas.client import ClientCreate
 from utils.security import hash_password
 from utils.database import get_db
@@ -61,15 +63,24 @@ def get_all_clients(
     db: Session = Depends(get_db),
     _admin: dict = Depends(get_current_admin)
 ):
+    # Totals come from the daily rollups, not the raw usage table
+    totals = (
+        db.query(
+            UsageDaily.client_id,
+            func.sum(UsageDaily.request_count).label("total_requests"),
+            func.sum(UsageDaily.tokens_used).label("total_tokens")
+        )
+        .group_by(UsageDaily.client_id)
+        .subquery()
+    )
     results = (
         db.query(
             Client.id,
             Client.username,
-            func.count(Usage.id).label("total_requests"),
-            func.coalesce(func.sum(Usage.tokens_used), 0).label("total_tokens")
+            totals.c.total_requests,
+            totals.c.total_tokens
         )
-        .outerjoin(Usage, Usage.client_id == Client.id)
-        .group_by(Client.id)
+        .outerjoin(totals, totals.c.client_id == Client.id)
         .all()
     )
 
@@ -88,6 +99,9 @@ def get_all_clients(
 @router.get("/{client_id}")
 def get_client_by_id(
     client_id: int,
+    start: Optional[datetime] = Query(None, description="created_at >= start"),
+    end: Optional[datetime] = Query(None, description="created_at < end"),
+    limit: int = Query(500, ge=1, le=5000),
     db: Session = Depends(get_db),
     _admin: dict = Depends(get_current_admin)
 ):
@@ -96,16 +110,21 @@ def get_client_by_id(
     if not client:
         raise HTTPException(status_code=404, detail="Client not found")
 
-    usage = (
-        db.query(Usage.action, Usage.tokens_used, Usage.created_at)
-        .filter(Usage.client_id == client_id)
-        .all()
-    )
+    # Most recent usage first, walked via ix_usage_client_id_created_at
+    query = db.query(Usage.action, Usage.tokens_used, Usage.created_at).filter(Usage.client_id == client_id)
+    if start is not None:
+        query = query.filter(Usage.created_at >= start)
+    if end is not None:
+        query = query.filter(Usage.created_at < end)
+    usage = query.order_by(Usage.created_at.desc()).limit(limit).all()
 
     return {
         "id": client.id,
         "username": client.username,
-        "usage": usage
+        "usage": [
+            {"action": u.action, "tokens_used": u.tokens_used, "created_at": u.created_at}
+            for u in usage
+        ]
     }
 
 @router.delete("/{client_id}", status_code=204)
@@ -119,6 +138,9 @@ def delete_client(
     if not client:
         raise HTTPException(status_code=404, detail="Client not found")
 
+    # Bulk-delete usage in SQL rather than loading every row through the relationship
+    db.query(UsageDaily).filter(UsageDaily.client_id == client_id).delete(synchronize_session=False)
+    db.query(Usage).filter(Usage.client_id == client_id).delete(synchronize_session=False)
     db.delete(client)
     db.commit()
     return None
@@ -0,0 +1,35 @@
+import os
+from fastapi import APIRouter, HTTPException, Header, Response
+from fastapi.responses import FileResponse
+from typing import Optional
+from utils.blob_store import blob_path, is_valid_hash, sniff_mime_type
+
+router = APIRouter(prefix="/blobs", tags=["Blobs"])
+
+# Blobs are content-addressed, so a given URL never changes
+CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+
+@router.get("/{blob_hash}")
+def get_blob(
+    blob_hash: str,
+    if_none_match: Optional[str] = Header(None, alias="If-None-Match"),
+):
+    """Serve a stored image. Supports ETag revalidation and Range requests."""
+    if not is_valid_hash(blob_hash):
+        raise HTTPException(status_code=404, detail="Blob not found")
+
+    path = blob_path(blob_hash)
+    if not os.path.exists(path):
+        raise HTTPException(status_code=404, detail="Blob not found")
+
+    etag = f'"{blob_hash}"'
+    if if_none_match and etag in [t.strip() for t in if_none_match.split(",")]:
+        return Response(status_code=304, headers={"ETag": etag, "Cache-Control": CACHE_CONTROL})
+
+    # FileResponse handles Range / If-Range and streams the file from disk
+    return FileResponse(
+        path,
+        media_type=sniff_mime_type(path),
+        headers={"ETag": etag, "Cache-Control": CACHE_CONTROL},
+    )
@@ -43,7 +43,7 @@ def client_login(payload: ClientCreate, db: Session = Depends(get_db)):
     # Let's look at frontend App.jsx again.
     # It sets usage from data.user.usage.
     
-    from models.usage import Usage
+    from models.usage import UsageDaily
     from sqlalchemy import func
 
     # Aggregated stats
@@ -54,25 +54,24 @@ def client_login(payload: ClientCreate, db: Session = Depends(get_db)):
         "lastActivity": None
     }
 
-    # Get total uploads
-    usage_stats["totalUploads"] = db.query(Usage).filter(Usage.client_id == client.id).count()
+    # One grouped query over the daily rollups gives every count and the last activity
+    per_action = db.query(
+        UsageDaily.action,
+        func.sum(UsageDaily.request_count),
+        func.max(UsageDaily.last_activity)
+    ).filter(UsageDaily.client_id == client.id).group_by(UsageDaily.action).all()
 
-    # Get excel uploads
-    usage_stats["excelUploads"] = db.query(Usage).filter(
-        Usage.client_id == client.id, 
-        Usage.action == "excel_upload"
-    ).count()
+    for action, count, last_activity in per_action:
+        usage_stats["totalUploads"] += int(count or 0)
+        if action == "excel_upload":
+            usage_stats["excelUploads"] = int(count or 0)
+        elif action == "image_upload":
+            usage_stats["imageUploads"] = int(count or 0)
+        if last_activity and (usage_stats["lastActivity"] is None or last_activity > usage_stats["lastActivity"]):
+            usage_stats["lastActivity"] = last_activity
 
-    # Get image uploads
-    usage_stats["imageUploads"] = db.query(Usage).filter(
-        Usage.client_id == client.id, 
-        Usage.action == "image_upload"
-    ).count()
-
-    # Get last activity
-    last_usage = db.query(Usage).filter(Usage.client_id == client.id).order_by(Usage.created_at.desc()).first()
-    if last_usage:
-        usage_stats["lastActivity"] = last_usage.created_at.isoformat()
+    if usage_stats["lastActivity"]:
+        usage_stats["lastActivity"] = usage_stats["lastActivity"].isoformat()
 
     return {
         "success": True,
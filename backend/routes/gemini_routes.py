@@ -1,30 +1,28 @@
 from typing import Optional
 from fastapi import APIRouter, UploadFile, File, Form, HTTPException, Header, Depends
-from sqlalchemy.orm import Session
+from fastapi.responses import StreamingResponse
 from services.gemini_service import (
     analyze_text_and_image,
     analyze_image_only,
+    stream_text_and_image,
     get_prompt_by_plan
 )
-from utils.image import read_image_as_base64
-from utils.sheet_parser import parse_sheet_to_key_value
-from utils.database import get_db
-from models.usage import Usage
+from services.rationale_service import format_trade_data
+from services.usage_service import record_usage
+from services.response_cache import cache_stats
+from services.rate_limiter import rate_limiter_stats
+from services.gemini_retry import GeminiError, retry_stats
+from services.job_service import job_stats
+from services.gemini_context_cache import context_cache_stats
+from utils.auth import get_current_admin
+from utils.image import image_stats, prepare_image, validate_image
 from fastapi import UploadFile, File
+import asyncio
 import json
+import math
 
 router = APIRouter(prefix="/gemini", tags=["Gemini"])
 
-ALLOWED_TYPES = {"image/png", "image/jpeg", "image/webp"}
-
-
-def validate_image(image: UploadFile):
-    if image.content_type not in ALLOWED_TYPES:
-        raise HTTPException(
-            status_code=400,
-            detail="Only PNG, JPEG, WEBP images are allowed"
-        )
-
 from enum import Enum
 
 class PlanType(str, Enum):
@@ -33,13 +31,25 @@ class PlanType(str, Enum):
     OPTIONS = "Options"
     DERIVATIVES = "Derivatives"
 
-def _record_usage(db: Session, client_id: int, action: str, tokens_used: int):
-    """Record usage to DB for admin visibility. Silently skips on error."""
+
+def _parse_trade_data(trade_data: str) -> dict:
     try:
-        db.add(Usage(client_id=client_id, action=action, tokens_used=tokens_used))
-        db.commit()
+        trade_dict = json.loads(trade_data)
+        if not isinstance(trade_dict, dict):
+            raise ValueError
     except Exception:
-        db.rollback()
+        raise HTTPException(status_code=400, detail="trade_data must be valid key-value JSON")
+    return trade_dict
+
+
+def _gemini_http_error(e: GeminiError) -> HTTPException:
+    """429 / 503 / 403 ... from a classified Gemini failure, with Retry-After when known."""
+    headers = {"Retry-After": str(math.ceil(e.retry_after))} if e.retry_after else None
+    return HTTPException(status_code=e.status_code, detail=str(e), headers=headers)
+
+
+def _sse(event: str, data) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
 
 
 @router.post("/analyze-with-rationale")
@@ -50,34 +60,31 @@ async def analyze_with_rationale(
     prompt: Optional[str] = Form(None),
     x_gemini_api_key: str = Header(..., alias="X-GEMINI-API-KEY"),
     x_user_id: Optional[str] = Header(None, alias="X-User-Id"),
-    db: Session = Depends(get_db),
 ):
     validate_image(image)
+    trade_dict = _parse_trade_data(trade_data)
 
+    rationale_text = format_trade_data(trade_dict)
+    image_data, mime_type = await asyncio.to_thread(prepare_image, image)
     try:
-        trade_dict = json.loads(trade_data)
-        if not isinstance(trade_dict, dict):
-            raise ValueError
-    except Exception:
-        raise HTTPException(status_code=400, detail="trade_data must be valid key-value JSON")
-
-    rationale_text = "\n".join(f"{k}: {v}" for k, v in trade_dict.items())
-    image_base64 = read_image_as_base64(image)
-    result = await analyze_text_and_image(
-        rationale=rationale_text,
-        image_base64=image_base64,
-        mime_type=image.content_type,
-        plan_type=plan_type,
-        user_prompt=prompt,
-        api_key=x_gemini_api_key
-    )
+        result = await analyze_text_and_image(
+            rationale=rationale_text,
+            image_data=image_data,
+            mime_type=mime_type,
+            plan_type=plan_type,
+            user_prompt=prompt,
+            api_key=x_gemini_api_key
+        )
+    except GeminiError as e:
+        raise _gemini_http_error(e)
 
     # Record usage for admin table when client_id is provided
     if x_user_id:
         try:
             cid = int(x_user_id)
-            total = (result.get("usage") or {}).get("total_tokens", 0) or 0
-            _record_usage(db, cid, "analyze_with_rationale", total)
+            usage = result.get("usage") or {}
+            record_usage(cid, "analyze_with_rationale", usage.get("total_tokens", 0) or 0,
+                         usage=usage, plan_type=plan_type.value if plan_type else None)
         except (ValueError, TypeError):
             pass
 
@@ -89,6 +96,68 @@ async def analyze_with_rationale(
     }
 
 
+# 1b) TEXT + IMAGE, STREAMED (Server-Sent Events)
+@router.post("/analyze-with-rationale/stream")
+async def analyze_with_rationale_stream(
+    trade_data: str = Form(...),
+    image: UploadFile = File(...),
+    plan_type: Optional[PlanType] = Form(None),
+    prompt: Optional[str] = Form(None),
+    x_gemini_api_key: str = Header(..., alias="X-GEMINI-API-KEY"),
+    x_user_id: Optional[str] = Header(None, alias="X-User-Id"),
+):
+    """
+    Same inputs as /analyze-with-rationale, but responds with text/event-stream:
+    "analysis" events (one point each), then "key_points", "usage" and "done".
+    Failures after the stream has started are sent as an "error" event.
+    """
+    validate_image(image)
+    trade_dict = _parse_trade_data(trade_data)
+
+    rationale_text = format_trade_data(trade_dict)
+    image_data, mime_type = await asyncio.to_thread(prepare_image, image)
+
+    async def event_stream():
+        yield _sse("start", {"plan_type": plan_type or "generic", "trade_data": trade_dict})
+        try:
+            async for event, data in stream_text_and_image(
+                rationale=rationale_text,
+                image_data=image_data,
+                mime_type=mime_type,
+                plan_type=plan_type,
+                user_prompt=prompt,
+                api_key=x_gemini_api_key
+            ):
+                yield _sse(event, data)
+
+                # Record usage for admin table when client_id is provided
+                if event == "usage" and x_user_id:
+                    try:
+                        total = (data or {}).get("total_tokens", 0) or 0
+                        record_usage(int(x_user_id), "analyze_with_rationale", total,
+                                     usage=data, plan_type=plan_type.value if plan_type else None)
+                    except (ValueError, TypeError):
+                        pass
+        except GeminiError as e:
+            yield _sse("error", {"detail": str(e), "status_code": e.status_code, "retry_after": e.retry_after})
+            return
+        except Exception as e:
+            yield _sse("error", {"detail": str(e)})
+            return
+
+        yield _sse("done", {"status": "success"})
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            # Stop nginx from buffering the stream
+            "X-Accel-Buffering": "no",
+        },
+    )
+
+
 # 2)  IMAGE ONLY
 @router.post("/analyze-image-only")
 async def analyze_image(
@@ -103,17 +172,21 @@ async def analyze_image(
     print(f"📷 Image filename: {image.filename}")
     print(f"📷 Image content type: {image.content_type}")
 
-    image_base64 = read_image_as_base64(image)
-    print(f"🖼️ Image base64 length: {len(image_base64)} characters")
+    image_data, mime_type = await asyncio.to_thread(prepare_image, image)
+    print(f"🖼️ Image size: {len(image_data)} bytes")
 
     try:
         result = await analyze_image_only(
-            image_base64=image_base64,
-            mime_type=image.content_type,
+            image_data=image_data,
+            mime_type=mime_type,
             api_key=x_gemini_api_key
         )
         print(f"✅ Analysis completed successfully")
         print("=" * 50)
+    except GeminiError as e:
+        print(f"❌ Gemini error in analyze_image_only: {str(e)}")
+        print("=" * 50)
+        raise _gemini_http_error(e)
     except Exception as e:
         print(f"❌ Error in analyze_image_only: {str(e)}")
         print("=" * 50)
@@ -122,4 +195,40 @@ async def analyze_image(
     return {
         "status": "success",
         "output": result
-    }
\ No newline at end of file
+    }
+
+
+# 3)  RESPONSE CACHE STATS
+@router.get("/cache/stats")
+def get_cache_stats(_admin: dict = Depends(get_current_admin)):
+    return cache_stats()
+
+
+# 4)  PER-KEY RATE GOVERNOR STATS (queue depth, wait times)
+@router.get("/rate/stats")
+def get_rate_stats(_admin: dict = Depends(get_current_admin)):
+    return rate_limiter_stats()
+
+
+# 5)  RETRY / HEDGE / CIRCUIT BREAKER STATS
+@router.get("/retry/stats")
+def get_retry_stats(_admin: dict = Depends(get_current_admin)):
+    return retry_stats()
+
+
+# 6)  IMAGE PREPROCESSING STATS
+@router.get("/image/stats")
+def get_image_stats(_admin: dict = Depends(get_current_admin)):
+    return image_stats()
+
+
+# 7)  BACKGROUND GENERATION JOB STATS
+@router.get("/jobs/stats")
+async def get_job_stats(_admin: dict = Depends(get_current_admin)):
+    return await job_stats()
+
+
+# 8)  GEMINI CONTEXT CACHE STATS (static prompt instructions)
+@router.get("/context-cache/stats")
+def get_context_cache_stats(_admin: dict = Depends(get_current_admin)):
+    return context_cache_stats()
@@ -0,0 +1,21 @@
+import os
+from typing import Optional
+from fastapi import APIRouter, Header, HTTPException, Response
+from prometheus_client import CONTENT_TYPE_LATEST
+from dotenv import load_dotenv
+from services.metrics import render_metrics
+
+load_dotenv()
+
+router = APIRouter(tags=["Metrics"])
+
+# When set, scrapers must send "Authorization: Bearer <METRICS_TOKEN>"
+METRICS_TOKEN = os.getenv("METRICS_TOKEN")
+
+
+@router.get("/metrics", include_in_schema=False)
+async def get_metrics(authorization: Optional[str] = Header(None)):
+    """Prometheus scrape endpoint."""
+    if METRICS_TOKEN and authorization != f"Bearer {METRICS_TOKEN}":
+        raise HTTPException(status_code=401, detail="Not authenticated")
+    return Response(await render_metrics(), media_type=CONTENT_TYPE_LATEST)
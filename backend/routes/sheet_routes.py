@@ -1,23 +1,51 @@
-from fastapi import APIRouter, Depends, HTTPException, Query
-from sqlalchemy.orm import Session
-from sqlalchemy.orm.attributes import flag_modified
-from datetime import datetime
+import asyncio
+import os
+from fastapi import APIRouter, Depends, HTTPException, Query, Form, File, UploadFile, Header, Response
+from fastapi.responses import StreamingResponse
+from urllib.parse import quote
+from sqlalchemy import delete, func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import selectinload
+from datetime import datetime, date
 from typing import List, Optional
-from utils.database import get_db
-from models.sheet import Sheet, RowRationale
+from utils.database import AsyncSessionLocal, get_async_db
+from models.sheet import Sheet, SheetRow, RowRationale, GenerationJob
 from schemas.sheet import (
     SheetCreate, SheetResponse, SheetListResponse,
-    RowRationaleCreate, RowRationaleUpdate, RowRationaleResponse
+    SheetSummary, SheetSummaryListResponse,
+    SheetRowResponse, SheetRowUpdate,
+    RowRationaleCreate, RowRationaleUpdate, RowRationaleResponse,
+    SheetGenerateRowResult, SheetGenerateResponse, PdfOptions,
+    GenerationJobResponse, SheetJobsResponse
 )
 from utils.auth import get_current_user_id
+from utils.image import prepare_image, preprocess_image, validate_image
+from utils.blob_store import decode_image_preview, get_blob, put_blob
+from services.rationale_service import generate_rationales, build_rationale_text
+from services.usage_service import record_usage
+from services.job_service import enqueue_jobs, cancel_pending_jobs, get_sheet_jobs, job_queue_available
+from services.pdf_service import build_pdf_content, get_or_render_pdf, get_pdf_file_name, stream_pdf_zip
+from services.sheet_service import (
+    insert_sheet_rows, insert_sheet_rows_streaming, get_sheet_row, get_sheet_rows,
+    delete_sheet_row_at, remove_processed_row, save_row_rationale, iter_row_rationales,
+    mark_rationales_downloaded
+)
+from utils.sheet_parser import iter_sheet_rows, SUPPORTED_EXTENSIONS
 
 router = APIRouter(prefix="/sheets", tags=["sheets"])
 
+async def _get_owned_sheet(db: AsyncSession, sheet_id: int, user_id: int, with_rows: bool = False) -> Optional[Sheet]:
+    query = select(Sheet).where(Sheet.id == sheet_id, Sheet.client_id == user_id)
+    if with_rows:
+        # Sheet.rows_data reads the relationship; async sessions cannot lazy-load it
+        query = query.options(selectinload(Sheet.rows)).execution_options(populate_existing=True)
+    return await db.scalar(query)
+
 # Sheet CRUD Operations
 @router.post("", response_model=SheetResponse, status_code=201)
-def create_sheet(
+async def create_sheet(
     sheet_data: SheetCreate,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     user_id: int = Depends(get_current_user_id)
 ):
     """Create a new sheet for the current user"""
@@ -25,34 +53,81 @@ def create_sheet(
         client_id=user_id,
         file_name=sheet_data.file_name,
         upload_date=sheet_data.upload_date,
-        rows_data=sheet_data.rows_data,
+        legacy_rows_data=[],
         processed_rows=sheet_data.processed_rows or []
     )
     db.add(db_sheet)
-    db.commit()
-    db.refresh(db_sheet)
-    return db_sheet
+    await db.flush()
+    await insert_sheet_rows(db, db_sheet.id, sheet_data.rows_data)
+    await db.commit()
+    return await _get_owned_sheet(db, db_sheet.id, user_id, with_rows=True)
+
+@router.post("/upload", response_model=SheetSummary, status_code=201)
+async def upload_sheet(
+    file: UploadFile = File(...),
+    upload_date: Optional[str] = Form(None, description="YYYY-MM-DD, defaults to today"),
+    db: AsyncSession = Depends(get_async_db),
+    user_id: int = Depends(get_current_user_id)
+):
+    """Upload an .xlsx/.xls/.csv file; rows are parsed on the server one at a time
+    and written to sheet_rows in batches. Fetch GET /sheets/{id} for the rows."""
+    if not (file.filename or "").lower().endswith(SUPPORTED_EXTENSIONS):
+        raise HTTPException(status_code=400, detail="Only Excel (.xlsx, .xls) or CSV allowed")
+
+    db_sheet = Sheet(
+        client_id=user_id,
+        file_name=file.filename,
+        upload_date=upload_date or date.today().isoformat(),
+        legacy_rows_data=[],
+        processed_rows=[]
+    )
+    db.add(db_sheet)
+    await db.flush()
+
+    try:
+        row_count = await insert_sheet_rows_streaming(db, db_sheet.id, iter_sheet_rows(file.file, file.filename))
+    except ValueError as e:
+        await db.rollback()
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        await db.rollback()
+        raise HTTPException(status_code=400, detail=f"Could not read sheet: {e}")
+
+    if row_count == 0:
+        await db.rollback()
+        raise HTTPException(status_code=400, detail="Uploaded sheet is empty")
+
+    await db.commit()
+    await db.refresh(db_sheet)
+    return SheetSummary(
+        id=db_sheet.id,
+        file_name=db_sheet.file_name,
+        upload_date=db_sheet.upload_date,
+        row_count=row_count,
+        processed_count=0,
+        created_at=db_sheet.created_at
+    )
 
 @router.get("", response_model=SheetListResponse)
-def get_all_sheets(
+async def get_all_sheets(
     date_filter: Optional[str] = Query(None, description="Filter by upload date (YYYY-MM-DD)"),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     user_id: int = Depends(get_current_user_id)
 ):
     """Get all sheets for the current user, optionally filtered by date.
     processed_rows is derived from actual rationales (source of truth)."""
-    query = db.query(Sheet).filter(Sheet.client_id == user_id)
+    query = select(Sheet).options(selectinload(Sheet.rows)).where(Sheet.client_id == user_id)
     
     if date_filter:
-        query = query.filter(Sheet.upload_date == date_filter)
+        query = query.where(Sheet.upload_date == date_filter)
     
-    sheets = query.order_by(Sheet.created_at.desc()).all()
+    sheets = (await db.scalars(query.order_by(Sheet.created_at.desc()))).all()
     
     # Derive processed_rows from rationales (source of truth) for accurate counts
     sheet_ids = [s.id for s in sheets]
-    rationale_rows = db.query(RowRationale.sheet_id, RowRationale.row_index).filter(
-        RowRationale.sheet_id.in_(sheet_ids)
-    ).all()
+    rationale_rows = (await db.execute(
+        select(RowRationale.sheet_id, RowRationale.row_index).where(RowRationale.sheet_id.in_(sheet_ids))
+    )).all()
     processed_by_sheet = {}
     for sid, ridx in rationale_rows:
         processed_by_sheet.setdefault(sid, []).append(ridx)
@@ -74,17 +149,75 @@ def get_all_sheets(
     
     return SheetListResponse(sheets=result, total=len(sheets))
 
+@router.get("/summary", response_model=SheetSummaryListResponse)
+async def get_sheet_summaries(
+    date_filter: Optional[str] = Query(None, description="Filter by upload date (YYYY-MM-DD)"),
+    cursor: Optional[int] = Query(None, description="next_cursor from the previous page"),
+    limit: int = Query(50, ge=1, le=200),
+    db: AsyncSession = Depends(get_async_db),
+    user_id: int = Depends(get_current_user_id)
+):
+    """Lightweight sheet list (no rows_data), newest first, keyset-paginated by id.
+    Row and processed counts are computed in SQL."""
+    # Correlated counts, so only the sheets on this page are aggregated
+    row_count = (
+        select(func.count(SheetRow.id))
+        .where(SheetRow.sheet_id == Sheet.id)
+        .correlate(Sheet)
+        .scalar_subquery()
+    )
+    processed_count = (
+        select(func.count(RowRationale.id))
+        .where(RowRationale.sheet_id == Sheet.id)
+        .correlate(Sheet)
+        .scalar_subquery()
+    )
+
+    query = (
+        select(
+            Sheet.id,
+            Sheet.file_name,
+            Sheet.upload_date,
+            Sheet.created_at,
+            row_count.label("row_count"),
+            processed_count.label("processed_count")
+        )
+        .where(Sheet.client_id == user_id)
+    )
+
+    if date_filter:
+        query = query.where(Sheet.upload_date == date_filter)
+    if cursor is not None:
+        query = query.where(Sheet.id < cursor)
+
+    # Fetch one extra row to know whether another page exists
+    rows = (await db.execute(query.order_by(Sheet.id.desc()).limit(limit + 1))).all()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+
+    return SheetSummaryListResponse(
+        sheets=[
+            SheetSummary(
+                id=r.id,
+                file_name=r.file_name,
+                upload_date=r.upload_date,
+                row_count=int(r.row_count or 0),
+                processed_count=int(r.processed_count or 0),
+                created_at=r.created_at
+            )
+            for r in rows
+        ],
+        next_cursor=rows[-1].id if has_more else None
+    )
+
 @router.get("/{sheet_id}", response_model=SheetResponse)
-def get_sheet(
+async def get_sheet(
     sheet_id: int,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     user_id: int = Depends(get_current_user_id)
 ):
     """Get a specific sheet by ID"""
-    sheet = db.query(Sheet).filter(
-        Sheet.id == sheet_id,
-        Sheet.client_id == user_id
-    ).first()
+    sheet = await _get_owned_sheet(db, sheet_id, user_id, with_rows=True)
     
     if not sheet:
         raise HTTPException(status_code=404, detail="Sheet not found")
@@ -92,194 +225,176 @@ def get_sheet(
     return sheet
 
 @router.put("/{sheet_id}/processed-rows", response_model=SheetResponse)
-def update_processed_rows(
+async def update_processed_rows(
     sheet_id: int,
     processed_rows: List[int],
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     user_id: int = Depends(get_current_user_id)
 ):
     """Update the processed rows for a sheet"""
-    sheet = db.query(Sheet).filter(
-        Sheet.id == sheet_id,
-        Sheet.client_id == user_id
-    ).first()
+    sheet = await _get_owned_sheet(db, sheet_id, user_id)
     
     if not sheet:
         raise HTTPException(status_code=404, detail="Sheet not found")
     
     sheet.processed_rows = processed_rows
-    db.commit()
-    db.refresh(sheet)
-    return sheet
+    await db.commit()
+    return await _get_owned_sheet(db, sheet_id, user_id, with_rows=True)
 
-@router.delete("/{sheet_id}/rows/{row_index}", response_model=SheetResponse)
-def delete_sheet_row(
+@router.get("/{sheet_id}/rows/{row_index}", response_model=SheetRowResponse)
+async def get_sheet_row_data(
     sheet_id: int,
     row_index: int,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     user_id: int = Depends(get_current_user_id)
 ):
-    """Delete a specific row from a sheet. Also removes any rationale for that row."""
-    sheet = db.query(Sheet).filter(
+    """Get a single row of a sheet"""
+    row = await _get_owned_row(db, sheet_id, row_index, user_id)
+    return SheetRowResponse(id=row.id, sheet_id=row.sheet_id, row_index=row.position, data=row.data)
+
+@router.put("/{sheet_id}/rows/{row_index}", response_model=SheetRowResponse)
+async def update_sheet_row_data(
+    sheet_id: int,
+    row_index: int,
+    row_data: SheetRowUpdate,
+    db: AsyncSession = Depends(get_async_db),
+    user_id: int = Depends(get_current_user_id)
+):
+    """Replace the data of a single row of a sheet"""
+    row = await _get_owned_row(db, sheet_id, row_index, user_id)
+    row.data = row_data.data
+    await db.commit()
+    return SheetRowResponse(id=row.id, sheet_id=row.sheet_id, row_index=row.position, data=row.data)
+
+async def _get_owned_row(db: AsyncSession, sheet_id: int, row_index: int, user_id: int) -> SheetRow:
+    sheet_exists = await db.scalar(select(Sheet.id).where(
         Sheet.id == sheet_id,
         Sheet.client_id == user_id
-    ).first()
+    ))
+
+    if not sheet_exists:
+        raise HTTPException(status_code=404, detail="Sheet not found")
+
+    row = await get_sheet_row(db, sheet_id, row_index)
+    if not row:
+        raise HTTPException(status_code=404, detail="Row not found")
+    return row
+
+@router.delete("/{sheet_id}/rows/{row_index}", response_model=SheetResponse)
+async def delete_sheet_row(
+    sheet_id: int,
+    row_index: int,
+    db: AsyncSession = Depends(get_async_db),
+    user_id: int = Depends(get_current_user_id)
+):
+    """Delete a specific row from a sheet. Also removes any rationale for that row."""
+    sheet = await _get_owned_sheet(db, sheet_id, user_id)
 
     if not sheet:
         raise HTTPException(status_code=404, detail="Sheet not found")
 
-    rows = list(sheet.rows_data) if sheet.rows_data else []
-    if row_index < 0 or row_index >= len(rows):
+    # Delete the row and its rationale; later rows/rationales shift up in SQL
+    if not await delete_sheet_row_at(db, sheet_id, row_index):
         raise HTTPException(status_code=400, detail="Invalid row index")
 
-    # Delete rationale for this row
-    db.query(RowRationale).filter(
-        RowRationale.sheet_id == sheet_id,
-        RowRationale.row_index == row_index
-    ).delete()
+    # Remove row_index from processed_rows and shift later indices, in the same UPDATE
+    await remove_processed_row(db, sheet, row_index)
 
-    # Decrement row_index for rationales that were after the deleted row
-    later_rationales = db.query(RowRationale).filter(
-        RowRationale.sheet_id == sheet_id,
-        RowRationale.row_index > row_index
-    ).all()
-    for r in later_rationales:
-        r.row_index -= 1
-
-    # Remove row from rows_data
-    rows.pop(row_index)
-    sheet.rows_data = rows
-
-    # Update processed_rows: remove row_index, decrement indices > row_index
-    old_processed = list(sheet.processed_rows) if sheet.processed_rows else []
-    new_processed = []
-    for i in old_processed:
-        if i < row_index:
-            new_processed.append(i)
-        elif i > row_index:
-            new_processed.append(i - 1)
-    sheet.processed_rows = new_processed
-
-    db.commit()
-    db.refresh(sheet)
-    return sheet
+    await db.commit()
+    return await _get_owned_sheet(db, sheet_id, user_id, with_rows=True)
 
 @router.delete("/{sheet_id}", status_code=204)
-def delete_sheet(
+async def delete_sheet(
     sheet_id: int,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     user_id: int = Depends(get_current_user_id)
 ):
     """Delete a sheet and all its row rationales"""
-    sheet = db.query(Sheet).filter(
-        Sheet.id == sheet_id,
-        Sheet.client_id == user_id
-    ).first()
+    sheet = await _get_owned_sheet(db, sheet_id, user_id)
     
     if not sheet:
         raise HTTPException(status_code=404, detail="Sheet not found")
     
-    db.delete(sheet)
-    db.commit()
+    # Bulk-delete rows and rationales in SQL rather than loading them through the relationships
+    await db.execute(delete(SheetRow).where(SheetRow.sheet_id == sheet_id))
+    await db.execute(delete(RowRationale).where(RowRationale.sheet_id == sheet_id))
+    await db.execute(delete(GenerationJob).where(GenerationJob.sheet_id == sheet_id))
+    await db.delete(sheet)
+    await db.commit()
     return None
 
 # Row Rationale Operations
 @router.post("/rationales", response_model=RowRationaleResponse, status_code=201)
-def create_row_rationale(
+async def create_row_rationale(
     rationale_data: RowRationaleCreate,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     user_id: int = Depends(get_current_user_id)
 ):
     """Create or update a row rationale"""
     # Verify sheet belongs to user
-    sheet = db.query(Sheet).filter(
-        Sheet.id == rationale_data.sheet_id,
-        Sheet.client_id == user_id
-    ).first()
+    sheet = await _get_owned_sheet(db, rationale_data.sheet_id, user_id)
     
     if not sheet:
         raise HTTPException(status_code=404, detail="Sheet not found")
     
-    # Check if rationale already exists for this row
-    existing = db.query(RowRationale).filter(
-        RowRationale.sheet_id == rationale_data.sheet_id,
-        RowRationale.row_index == rationale_data.row_index
-    ).first()
-    
-    if existing:
-        # Update existing
-        existing.rationale_text = rationale_data.rationale_text
-        existing.rationale_result = rationale_data.rationale_result
-        existing.image_preview = rationale_data.image_preview
-        existing.editable_rationale = rationale_data.editable_rationale or rationale_data.rationale_text
-        db.commit()
-        db.refresh(existing)
-        return existing
-    else:
-        # Create new
-        db_rationale = RowRationale(
-            sheet_id=rationale_data.sheet_id,
-            row_index=rationale_data.row_index,
-            rationale_text=rationale_data.rationale_text,
-            rationale_result=rationale_data.rationale_result,
-            image_preview=rationale_data.image_preview,
-            editable_rationale=rationale_data.editable_rationale or rationale_data.rationale_text
-        )
-        db.add(db_rationale)
-        
-        # Update sheet's processed rows (reassign + flag_modified for SQLAlchemy JSON persistence)
-        current = list(sheet.processed_rows or [])
-        if rationale_data.row_index not in current:
-            sheet.processed_rows = current + [rationale_data.row_index]
-            flag_modified(sheet, "processed_rows")
-        
-        db.commit()
-        db.refresh(db_rationale)
-        return db_rationale
+    return await save_row_rationale(
+        db,
+        sheet,
+        row_index=rationale_data.row_index,
+        rationale_text=rationale_data.rationale_text,
+        rationale_result=rationale_data.rationale_result,
+        image_hash=await _store_image_preview(rationale_data.image_preview),
+        editable_rationale=rationale_data.editable_rationale,
+    )
+
+async def _store_image_preview(image_preview: Optional[str]) -> Optional[str]:
+    """Move an inline base64 image into the blob store; rows keep only the hash."""
+    if not image_preview:
+        return None
+    try:
+        data = decode_image_preview(image_preview)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    # Downscaling, hashing and the file write run off the event loop
+    return await asyncio.to_thread(lambda: put_blob(preprocess_image(data, None)[0]))
 
 @router.get("/rationales/sheet/{sheet_id}", response_model=List[RowRationaleResponse])
-def get_all_rationales_for_sheet(
+async def get_all_rationales_for_sheet(
     sheet_id: int,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     user_id: int = Depends(get_current_user_id)
 ):
     """Get all rationales for a specific sheet"""
     # Verify sheet belongs to user
-    sheet = db.query(Sheet).filter(
-        Sheet.id == sheet_id,
-        Sheet.client_id == user_id
-    ).first()
+    sheet = await _get_owned_sheet(db, sheet_id, user_id)
     
     if not sheet:
         raise HTTPException(status_code=404, detail="Sheet not found")
     
-    rationales = db.query(RowRationale).filter(
+    rationales = (await db.scalars(select(RowRationale).where(
         RowRationale.sheet_id == sheet_id
-    ).all()
+    ))).all()
     
     return rationales
 
 @router.get("/rationales/{sheet_id}/{row_index}", response_model=RowRationaleResponse)
-def get_row_rationale(
+async def get_row_rationale(
     sheet_id: int,
     row_index: int,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     user_id: int = Depends(get_current_user_id)
 ):
     """Get rationale for a specific row"""
     # Verify sheet belongs to user
-    sheet = db.query(Sheet).filter(
-        Sheet.id == sheet_id,
-        Sheet.client_id == user_id
-    ).first()
+    sheet = await _get_owned_sheet(db, sheet_id, user_id)
     
     if not sheet:
         raise HTTPException(status_code=404, detail="Sheet not found")
     
-    rationale = db.query(RowRationale).filter(
+    rationale = await db.scalar(select(RowRationale).where(
         RowRationale.sheet_id == sheet_id,
         RowRationale.row_index == row_index
-    ).first()
+    ))
     
     if not rationale:
         raise HTTPException(status_code=404, detail="Rationale not found for this row")
@@ -287,52 +402,151 @@ def get_row_rationale(
     return rationale
 
 @router.post("/{sheet_id}/rows/{row_index}/downloaded")
-def mark_row_downloaded(
+async def mark_row_downloaded(
     sheet_id: int,
     row_index: int,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     user_id: int = Depends(get_current_user_id)
 ):
     """Mark that the user has downloaded the PDF for this row (for Redownload button visibility)"""
-    sheet = db.query(Sheet).filter(
-        Sheet.id == sheet_id,
-        Sheet.client_id == user_id
-    ).first()
+    sheet = await _get_owned_sheet(db, sheet_id, user_id)
     
     if not sheet:
         raise HTTPException(status_code=404, detail="Sheet not found")
     
-    rationale = db.query(RowRationale).filter(
+    rationale = await db.scalar(select(RowRationale).where(
         RowRationale.sheet_id == sheet_id,
         RowRationale.row_index == row_index
-    ).first()
+    ))
     
     if not rationale:
         raise HTTPException(status_code=404, detail="Rationale not found for this row")
     
     rationale.downloaded_at = datetime.utcnow()
-    db.commit()
-    db.refresh(rationale)
+    await db.commit()
     return {"ok": True, "downloaded_at": rationale.downloaded_at.isoformat()}
 
+@router.get("/{sheet_id}/rows/{row_index}/pdf")
+async def get_row_pdf(
+    sheet_id: int,
+    row_index: int,
+    options: PdfOptions = Depends(),
+    if_none_match: Optional[str] = Header(None, alias="If-None-Match"),
+    db: AsyncSession = Depends(get_async_db),
+    user_id: int = Depends(get_current_user_id)
+):
+    """Render the rationale PDF for one row on the server (same layout as the frontend export).
+    Output is cached by a hash of its inputs and returned with that hash as the ETag."""
+    sheet = await _get_owned_sheet(db, sheet_id, user_id)
+
+    if not sheet:
+        raise HTTPException(status_code=404, detail="Sheet not found")
+
+    row = await get_sheet_row(db, sheet_id, row_index)
+    rationale = await db.scalar(select(RowRationale).where(
+        RowRationale.sheet_id == sheet_id,
+        RowRationale.row_index == row_index
+    ))
+
+    if not row or not rationale:
+        raise HTTPException(status_code=404, detail="Rationale not found for this row")
+
+    content = build_pdf_content(row.data, rationale, options.model_dump())
+    pdf, key = await asyncio.to_thread(get_or_render_pdf, content, _chart_loader(rationale))
+
+    etag = f'"{key}"'
+    if if_none_match and etag in [t.strip() for t in if_none_match.split(",")]:
+        return Response(status_code=304, headers={"ETag": etag})
+
+    file_name = get_pdf_file_name(content["trading_data"], content["header_date"])
+    return Response(
+        content=pdf,
+        media_type="application/pdf",
+        headers={
+            "Content-Disposition": f"attachment; filename*=UTF-8''{quote(file_name)}",
+            "ETag": etag,
+        },
+    )
+
+@router.get("/{sheet_id}/export")
+async def export_sheet_pdfs(
+    sheet_id: int,
+    options: PdfOptions = Depends(),
+    # Off by default: a GET can be prefetched or retried without anyone receiving the file
+    mark_downloaded: bool = Query(False, description="Set downloaded_at on every included row once the ZIP is complete; pass true from an explicit download action"),
+    db: AsyncSession = Depends(get_async_db),
+    user_id: int = Depends(get_current_user_id)
+):
+    """Stream a ZIP with the PDF of every row that has a rationale. PDFs are rendered
+    a few at a time while the ZIP is sent, so memory stays flat for large sheets."""
+    sheet = await _get_owned_sheet(db, sheet_id, user_id)
+
+    if not sheet:
+        raise HTTPException(status_code=404, detail="Sheet not found")
+
+    has_rationales = await db.scalar(select(RowRationale.id).where(RowRationale.sheet_id == sheet_id).limit(1))
+    if not has_rationales:
+        raise HTTPException(status_code=404, detail="No rationales to export for this sheet")
+
+    pdf_options = options.model_dump()
+    archive_name = f"{os.path.splitext(sheet.file_name or 'sheet')[0]}_{sheet.upload_date}.zip"
+
+    async def zip_stream():
+        # Own session: the request's session is closed once streaming starts
+        async with AsyncSessionLocal() as session:
+            included = []
+
+            async def documents():
+                async for row_data, rationale in iter_row_rationales(session, sheet_id):
+                    content = build_pdf_content(row_data, rationale, pdf_options)
+                    included.append(rationale.id)
+                    yield (
+                        get_pdf_file_name(content["trading_data"], content["header_date"]),
+                        content,
+                        _chart_loader(rationale),
+                    )
+
+            async for chunk in stream_pdf_zip(documents()):
+                yield chunk
+
+            # Only reached when the whole ZIP was sent
+            if mark_downloaded:
+                await mark_rationales_downloaded(session, included)
+
+    return StreamingResponse(
+        zip_stream(),
+        media_type="application/zip",
+        headers={"Content-Disposition": f"attachment; filename*=UTF-8''{quote(archive_name)}"},
+    )
+
+def _chart_loader(rationale: RowRationale):
+    """Reads the row's chart bytes when called (in the render thread, on a PDF cache miss)."""
+    image_hash, image_preview = rationale.image_hash, rationale.image_preview
+
+    def load() -> Optional[bytes]:
+        if image_hash:
+            return get_blob(image_hash)
+        try:
+            return decode_image_preview(image_preview) if image_preview else None
+        except ValueError:
+            return None
+    return load
+
 @router.put("/rationales/{rationale_id}", response_model=RowRationaleResponse)
-def update_row_rationale(
+async def update_row_rationale(
     rationale_id: int,
     rationale_data: RowRationaleUpdate,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     user_id: int = Depends(get_current_user_id)
 ):
     """Update a row rationale"""
-    rationale = db.query(RowRationale).filter(RowRationale.id == rationale_id).first()
+    rationale = await db.get(RowRationale, rationale_id)
     
     if not rationale:
         raise HTTPException(status_code=404, detail="Rationale not found")
     
     # Verify sheet belongs to user
-    sheet = db.query(Sheet).filter(
-        Sheet.id == rationale.sheet_id,
-        Sheet.client_id == user_id
-    ).first()
+    sheet = await _get_owned_sheet(db, rationale.sheet_id, user_id)
     
     if not sheet:
         raise HTTPException(status_code=403, detail="Access denied")
@@ -343,31 +557,29 @@ def update_row_rationale(
     if rationale_data.rationale_result is not None:
         rationale.rationale_result = rationale_data.rationale_result
     if rationale_data.image_preview is not None:
-        rationale.image_preview = rationale_data.image_preview
+        rationale.image_hash = await _store_image_preview(rationale_data.image_preview)
+        rationale.image_preview = None
     if rationale_data.editable_rationale is not None:
         rationale.editable_rationale = rationale_data.editable_rationale
     
-    db.commit()
-    db.refresh(rationale)
+    await db.commit()
+    await db.refresh(rationale)
     return rationale
 
 @router.delete("/rationales/{rationale_id}", status_code=204)
-def delete_row_rationale(
+async def delete_row_rationale(
     rationale_id: int,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     user_id: int = Depends(get_current_user_id)
 ):
     """Delete a row rationale"""
-    rationale = db.query(RowRationale).filter(RowRationale.id == rationale_id).first()
+    rationale = await db.get(RowRationale, rationale_id)
     
     if not rationale:
         raise HTTPException(status_code=404, detail="Rationale not found")
     
     # Verify sheet belongs to user
-    sheet = db.query(Sheet).filter(
-        Sheet.id == rationale.sheet_id,
-        Sheet.client_id == user_id
-    ).first()
+    sheet = await _get_owned_sheet(db, rationale.sheet_id, user_id)
     
     if not sheet:
         raise HTTPException(status_code=403, detail="Access denied")
@@ -377,7 +589,197 @@ def delete_row_rationale(
     if rationale.row_index in current:
         sheet.processed_rows = [i for i in current if i != rationale.row_index]
     
-    db.delete(rationale)
-    db.commit()
+    await db.delete(rationale)
+    await db.commit()
     return None
 
+
+# Batch Generation
+async def _read_generation_jobs(
+    db: AsyncSession, sheet_id: int, row_indices: List[int], images: List[UploadFile]
+) -> dict:
+    """Validate row_indices against images[i] and read each chart. Keyed by row_index."""
+    if len(row_indices) != len(images):
+        raise HTTPException(status_code=400, detail="row_indices and images must have the same length")
+    if len(set(row_indices)) != len(row_indices):
+        raise HTTPException(status_code=400, detail="row_indices must be unique")
+
+    rows = await get_sheet_rows(db, sheet_id, row_indices)
+    jobs = {}
+    for row_index, image in zip(row_indices, images):
+        if row_index not in rows:
+            raise HTTPException(status_code=400, detail=f"Invalid row index {row_index}")
+        validate_image(image)
+        image_data, mime_type = await asyncio.to_thread(prepare_image, image)
+        jobs[row_index] = {
+            "row_index": row_index,
+            "row_id": rows[row_index].id,
+            "row": rows[row_index].data,
+            "image_data": image_data,
+            "mime_type": mime_type,
+        }
+    return jobs
+
+@router.post("/{sheet_id}/generate", response_model=SheetGenerateResponse)
+async def generate_sheet_rationales(
+    sheet_id: int,
+    row_indices: List[int] = Form(...),
+    images: List[UploadFile] = File(...),
+    plan_type: Optional[str] = Form(None),
+    prompt: Optional[str] = Form(None),
+    x_gemini_api_key: str = Header(..., alias="X-GEMINI-API-KEY"),
+    db: AsyncSession = Depends(get_async_db),
+    user_id: int = Depends(get_current_user_id)
+):
+    """
+    Generate rationales for many rows of a sheet in one request.
+    images[i] is the chart for row_indices[i]. Rows are analyzed
+    concurrently (bounded) and each rationale is saved as soon as it completes.
+    The whole upload may be up to MAX_BATCH_REQUEST_BYTES (utils/request_limits.py).
+    """
+    sheet = await _get_owned_sheet(db, sheet_id, user_id)
+
+    if not sheet:
+        raise HTTPException(status_code=404, detail="Sheet not found")
+
+    jobs = await _read_generation_jobs(db, sheet_id, row_indices, images)
+
+    results = []
+    async for item in generate_rationales(
+        list(jobs.values()),
+        api_key=x_gemini_api_key,
+        plan_type=plan_type,
+        user_prompt=prompt,
+    ):
+        job = jobs[item["row_index"]]
+        if "error" in item:
+            results.append(SheetGenerateRowResult(
+                row_index=item["row_index"], status="error", detail=item["error"]
+            ))
+            continue
+
+        result = item["result"]
+        rationale_text = build_rationale_text(result["output"].get("analysis"))
+        image_hash = await asyncio.to_thread(put_blob, job["image_data"])
+        saved = await save_row_rationale(
+            db,
+            sheet,
+            row_index=item["row_index"],
+            rationale_text=rationale_text,
+            rationale_result=result,
+            image_hash=image_hash,
+        )
+        usage = result["output"].get("usage") or {}
+        record_usage(user_id, "analyze_with_rationale", usage.get("total_tokens", 0) or 0,
+                     usage=usage, plan_type=result["plan_type"])
+        results.append(SheetGenerateRowResult(
+            row_index=item["row_index"], status="success", rationale_id=saved.id
+        ))
+
+    succeeded = sum(1 for r in results if r.status == "success")
+    return SheetGenerateResponse(
+        sheet_id=sheet_id,
+        results=sorted(results, key=lambda r: r.row_index),
+        succeeded=succeeded,
+        failed=len(results) - succeeded,
+    )
+
+
+# Background Generation Jobs
+async def _sheet_jobs_response(db: AsyncSession, sheet_id: int) -> SheetJobsResponse:
+    jobs = [
+        GenerationJobResponse(
+            id=job.id,
+            row_index=position,
+            status=job.status,
+            attempts=job.attempts,
+            error=job.error,
+            rationale_id=job.rationale_id,
+            tokens_used=job.tokens_used,
+            created_at=job.created_at,
+            started_at=job.started_at,
+            finished_at=job.finished_at,
+        )
+        for job, position in await get_sheet_jobs(db, sheet_id)
+    ]
+    counts = {status: 0 for status in ("pending", "running", "succeeded", "failed", "cancelled")}
+    for job in jobs:
+        counts[job.status] += 1
+    finished = counts["succeeded"] + counts["failed"] + counts["cancelled"]
+    return SheetJobsResponse(
+        sheet_id=sheet_id,
+        total=len(jobs),
+        progress=round(finished / len(jobs), 4) if jobs else 1.0,
+        jobs=jobs,
+        **counts,
+    )
+
+@router.post("/{sheet_id}/jobs", response_model=SheetJobsResponse, status_code=202)
+async def queue_sheet_rationales(
+    sheet_id: int,
+    row_indices: List[int] = Form(...),
+    images: List[UploadFile] = File(...),
+    plan_type: Optional[str] = Form(None),
+    prompt: Optional[str] = Form(None),
+    x_gemini_api_key: str = Header(..., alias="X-GEMINI-API-KEY"),
+    db: AsyncSession = Depends(get_async_db),
+    user_id: int = Depends(get_current_user_id)
+):
+    """
+    Queue rationale generation for many rows and return immediately.
+    Same inputs as /generate, but the work runs in the background worker pool
+    and survives the browser (and server restarts); poll GET /{sheet_id}/jobs.
+    The whole upload may be up to MAX_BATCH_REQUEST_BYTES (utils/request_limits.py).
+    """
+    if not job_queue_available():
+        raise HTTPException(status_code=503, detail="Background generation is not configured (JOB_KEY_SECRET)")
+
+    sheet = await _get_owned_sheet(db, sheet_id, user_id)
+
+    if not sheet:
+        raise HTTPException(status_code=404, detail="Sheet not found")
+
+    jobs = await _read_generation_jobs(db, sheet_id, row_indices, images)
+    for job in jobs.values():
+        # Charts go to the blob store so a worker can load them after a restart
+        job["image_hash"] = await asyncio.to_thread(put_blob, job.pop("image_data"))
+
+    await enqueue_jobs(
+        db,
+        client_id=user_id,
+        sheet_id=sheet_id,
+        jobs=list(jobs.values()),
+        api_key=x_gemini_api_key,
+        plan_type=plan_type,
+        user_prompt=prompt,
+    )
+    return await _sheet_jobs_response(db, sheet_id)
+
+@router.get("/{sheet_id}/jobs", response_model=SheetJobsResponse)
+async def get_sheet_job_status(
+    sheet_id: int,
+    db: AsyncSession = Depends(get_async_db),
+    user_id: int = Depends(get_current_user_id)
+):
+    """Status and progress of every background generation job for a sheet"""
+    sheet = await _get_owned_sheet(db, sheet_id, user_id)
+
+    if not sheet:
+        raise HTTPException(status_code=404, detail="Sheet not found")
+
+    return await _sheet_jobs_response(db, sheet_id)
+
+@router.delete("/{sheet_id}/jobs", response_model=SheetJobsResponse)
+async def cancel_sheet_jobs(
+    sheet_id: int,
+    db: AsyncSession = Depends(get_async_db),
+    user_id: int = Depends(get_current_user_id)
+):
+    """Cancel a sheet's queued jobs; jobs already running are allowed to finish"""
+    sheet = await _get_owned_sheet(db, sheet_id, user_id)
+
+    if not sheet:
+        raise HTTPException(status_code=404, detail="Sheet not found")
+
+    await cancel_pending_jobs(db, sheet_id)
+    return await _sheet_jobs_response(db, sheet_id)
@@ -1,29 +1,76 @@
-from fastapi import APIRouter, Depends
+from datetime import datetime, timedelta
+from typing import Optional
+from fastapi import APIRouter, Depends, HTTPException, Query
+from sqlalchemy import func, select
 from sqlalchemy.orm import Session
-from models.usage import Usage
+from models.usage import Usage, UsageDaily
 from schemas.usage import UsageCreate
+from services.usage_service import record_usage, usage_queue_stats, usage_dashboard
+from utils.auth import get_current_admin
 from utils.database import get_db
 
 router = APIRouter(prefix="/usage", tags=["Usage"])
 
+# Longest range one dashboard request may aggregate
+DASHBOARD_MAX_DAYS = 92
+
 @router.post("/create")
-def create_usage(payload: UsageCreate, db: Session = Depends(get_db)):
+async def create_usage(payload: UsageCreate):
+    # Queued and written in batches by services/usage_service.py
     for item in payload.usage:
-        db.add(
-            Usage(
-                client_id=payload.client_id,
-                action=item.action,
-                tokens_used=item.tokens_used
-            )
-        )
-    db.commit()
-    db.commit()
+        record_usage(payload.client_id, item.action, item.tokens_used)
     return {"status": "usage recorded"}
 
+@router.get("/queue/stats")
+def get_usage_queue_stats(_admin: dict = Depends(get_current_admin)):
+    return usage_queue_stats()
+
+@router.get("/dashboard")
+def get_usage_dashboard(
+    start: Optional[datetime] = Query(None, description="created_at >= start (default: 7 days before end)"),
+    end: Optional[datetime] = Query(None, description="created_at < end (default: now)"),
+    client_id: Optional[int] = Query(None),
+    bucket: str = Query("day", pattern="^(hour|day)$"),
+    db: Session = Depends(get_db),
+    _admin: dict = Depends(get_current_admin)
+):
+    """Gemini cost and latency percentiles per client and plan type, per prompt stage, and over time."""
+    from models.client import Client
+    end = end or datetime.utcnow()
+    start = start or end - timedelta(days=7)
+    if end - start > timedelta(days=DASHBOARD_MAX_DAYS):
+        raise HTTPException(status_code=400, detail=f"Range is limited to {DASHBOARD_MAX_DAYS} days")
+
+    stmt = (
+        select(
+            Usage.client_id, Client.username, Usage.plan_type, Usage.created_at, Usage.tokens_used,
+            Usage.prompt_tokens, Usage.candidate_tokens, Usage.image_tokens, Usage.cached_tokens,
+            Usage.cost_usd, Usage.latency_ms, Usage.stages,
+        )
+        .join(Client, Usage.client_id == Client.id)
+        # Only rows recorded with Gemini call details
+        .where(Usage.model.isnot(None), Usage.created_at >= start, Usage.created_at < end)
+    )
+    if client_id is not None:
+        stmt = stmt.where(Usage.client_id == client_id)
+
+    # Streamed in batches; percentiles need every latency, so aggregation happens here rather than in SQL
+    rows = db.execute(stmt.execution_options(yield_per=1000))
+    return {"start": start, "end": end, **usage_dashboard(rows, bucket)}
+
 @router.get("/")
-def get_all_usage(db: Session = Depends(get_db)):
+def get_all_usage(
+    client_id: Optional[int] = Query(None),
+    start: Optional[datetime] = Query(None, description="created_at >= start"),
+    end: Optional[datetime] = Query(None, description="created_at < end"),
+    cursor: Optional[int] = Query(None, description="next_cursor from the previous page"),
+    limit: int = Query(100, ge=1, le=1000),
+    db: Session = Depends(get_db)
+):
+    """Usage rows, newest first, keyset-paginated by id and optionally
+    filtered by client and time range (served by ix_usage_client_id_created_at)."""
     from models.client import Client
-    results = (
+    query = (
         db.query(
             Usage.id,
             Usage.action,
@@ -32,31 +79,46 @@ def get_all_usage(db: Session = Depends(get_db)):
             Client.username
         )
         .join(Client, Usage.client_id == Client.id)
-        .order_by(Usage.created_at.desc())
-        .all()
     )
 
-    return [
-        {
-            "id": r.id,
-            "action": r.action,
-            "tokens_used": r.tokens_used,
-            "created_at": r.created_at,
-            "username": r.username
-        }
-        for r in results
-    ]
+    if client_id is not None:
+        query = query.filter(Usage.client_id == client_id)
+    if start is not None:
+        query = query.filter(Usage.created_at >= start)
+    if end is not None:
+        query = query.filter(Usage.created_at < end)
+    if cursor is not None:
+        query = query.filter(Usage.id < cursor)
+
+    # Fetch one extra row to know whether another page exists
+    results = query.order_by(Usage.id.desc()).limit(limit + 1).all()
+    has_more = len(results) > limit
+    results = results[:limit]
+
+    return {
+        "usage": [
+            {
+                "id": r.id,
+                "action": r.action,
+                "tokens_used": r.tokens_used,
+                "created_at": r.created_at,
+                "username": r.username
+            }
+            for r in results
+        ],
+        "next_cursor": results[-1].id if has_more else None
+    }
 
 @router.get("/user/{user_id}/usage")
 def get_user_usage(user_id: int, db: Session = Depends(get_db)):
-    from sqlalchemy import func
-    
-    # Calculate usage stats for a specific user
-    total_tokens = db.query(func.sum(Usage.tokens_used)).filter(Usage.client_id == user_id).scalar() or 0
-    total_requests = db.query(Usage).filter(Usage.client_id == user_id).count()
+    # Calculate usage stats for a specific user from the daily rollups
+    total_requests, total_tokens = db.query(
+        func.coalesce(func.sum(UsageDaily.request_count), 0),
+        func.coalesce(func.sum(UsageDaily.tokens_used), 0)
+    ).filter(UsageDaily.client_id == user_id).one()
     
     return {
         "userId": user_id,
-        "usage": total_tokens,
-        "requests": total_requests
+        "usage": int(total_tokens),
+        "requests": int(total_requests)
     }
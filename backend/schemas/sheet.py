@@ -26,6 +26,27 @@ class SheetListResponse(BaseModel):
     sheets: List[SheetResponse]
     total: int
 
+class SheetRowResponse(BaseModel):
+    id: int  # Stable row id
+    sheet_id: int
+    row_index: int
+    data: Dict[str, Any]
+
+class SheetRowUpdate(BaseModel):
+    data: Dict[str, Any]
+
+class SheetSummary(BaseModel):
+    id: int
+    file_name: str
+    upload_date: str
+    row_count: int
+    processed_count: int
+    created_at: datetime
+
+class SheetSummaryListResponse(BaseModel):
+    sheets: List[SheetSummary]
+    next_cursor: Optional[int] = None  # Pass as `cursor` to fetch the next page
+
 # Row Rationale Schemas
 class RowRationaleCreate(BaseModel):
     sheet_id: int
@@ -47,7 +68,9 @@ class RowRationaleResponse(BaseModel):
     row_index: int
     rationale_text: str
     rationale_result: Optional[Dict[str, Any]] = None
-    image_preview: Optional[str] = None
+    image_preview: Optional[str] = None  # Only set for legacy rows not yet moved to the blob store
+    image_hash: Optional[str] = None
+    image_url: Optional[str] = None
     editable_rationale: Optional[str] = None
     downloaded_at: Optional[datetime] = None
     generated_date: datetime
@@ -57,3 +80,56 @@ class RowRationaleResponse(BaseModel):
     class Config:
         from_attributes = True
 
+# Batch Generation Schemas
+class SheetGenerateRowResult(BaseModel):
+    row_index: int
+    status: str  # "success" | "error"
+    rationale_id: Optional[int] = None
+    detail: Optional[str] = None
+
+class SheetGenerateResponse(BaseModel):
+    sheet_id: int
+    results: List[SheetGenerateRowResult]
+    succeeded: int
+    failed: int
+
+# Background Job Schemas
+class GenerationJobResponse(BaseModel):
+    id: int
+    row_index: Optional[int] = None  # Current position of the row; None if the row was deleted
+    status: str  # pending | running | succeeded | failed | cancelled
+    attempts: int
+    error: Optional[str] = None
+    rationale_id: Optional[int] = None
+    tokens_used: Optional[int] = None
+    created_at: Optional[datetime] = None
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+
+class SheetJobsResponse(BaseModel):
+    sheet_id: int
+    total: int
+    pending: int
+    running: int
+    succeeded: int
+    failed: int
+    cancelled: int
+    progress: float  # Finished (succeeded + failed + cancelled) / total
+    jobs: List[GenerationJobResponse]
+
+# PDF Export Schemas
+class PdfOptions(BaseModel):
+    """Branding the analyst keeps in the browser; sent as query parameters."""
+    template: str = "classic"  # classic | blue | green
+    ra_name: str = ""
+    sebi_registration: str = ""
+    bse_enlistment: str = ""
+    header_date: str = ""  # Defaults to the row's Date column, then today
+    footer_contact: str = ""
+    footer_email: str = ""
+    footer_website: str = ""
+    footer_address: str = ""
+    footer_background_color: str = "#f5f5f5"
+    disclaimer: str = ""
+    signature: str = ""
+    signature_date: str = ""
@@ -2,10 +2,9 @@
 Seed a default Client for rationale_gen local development.
 Run: python3 seed_client.py
 """
-# Ensure all models are loaded (import main triggers model registration)
-import main  # noqa: F401
+from migrations import init_schema
 from models.client import Client
-from utils.database import SessionLocal
+from utils.database import SessionLocal, engine
 from utils.security import hash_password
 
 def seed_client():
@@ -30,4 +29,5 @@ def seed_client():
     db.close()
 
 if __name__ == "__main__":
+    init_schema(engine)
     seed_client()
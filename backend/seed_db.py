@@ -4,10 +4,10 @@ Run: python seed_db.py
 For production: DATABASE_URL=<prod-url> VIKASH_PASSWORD=India@2029 python seed_db.py
 """
 import os
-import main  # noqa: F401 - ensures models are loaded
+from migrations import init_schema
 from models.admin import Admin
 from models.client import Client
-from utils.database import SessionLocal
+from utils.database import SessionLocal, engine
 from utils.security import hash_password
 
 
@@ -43,6 +43,7 @@ def seed_client(username: str, password: str):
 
 
 if __name__ == "__main__":
+    init_schema(engine)
     vikash_pw = os.getenv("VIKASH_PASSWORD", "India@2029")
     covid_pw = os.getenv("COVID_PASSWORD", "Covid@123")
     seed_admin("vikash", vikash_pw)
@@ -0,0 +1,111 @@
+import asyncio
+import hashlib
+import os
+import time
+import httpx
+from dotenv import load_dotenv
+from services.http_client import get_http_client
+from services.rate_limiter import key_id
+
+load_dotenv()
+
+# ===============================
+# Context Cache Settings
+# ===============================
+# Explicit Gemini context caching for the static system instructions of each
+# prompt template. Gemini only caches content above a model-specific minimum
+# (1,024 tokens on 2.5 Flash); instructions below it, or any failed create,
+# fall back to an inline systemInstruction, which still benefits from
+# Gemini's implicit prefix caching. Off by default.
+CONTEXT_CACHE_ENABLED = os.getenv("GEMINI_CONTEXT_CACHE", "0") != "0"
+CONTEXT_CACHE_TTL = int(os.getenv("GEMINI_CONTEXT_CACHE_TTL", "3600"))
+# After a failed create, inline instructions are used for this long before trying again
+CONTEXT_CACHE_RETRY_AFTER = float(os.getenv("GEMINI_CONTEXT_CACHE_RETRY_AFTER", "600"))
+# Stop handing out a cache this close to its expiry, so requests never reference a dead one
+CONTEXT_CACHE_REFRESH_MARGIN = 60
+
+CACHED_CONTENTS_URL = "https://generativelanguage.googleapis.com/v1beta/cachedContents"
+
+
+class _Entry:
+    def __init__(self, name: str | None, expires_at: float):
+        self.name = name  # "cachedContents/..." or None after a failed create
+        self.expires_at = expires_at
+
+
+# Caches belong to the Google project behind an API key, so entries are per key
+_entries: dict[tuple[str, str, str], _Entry] = {}
+_locks: dict[tuple[str, str, str], asyncio.Lock] = {}
+_stats = {"created": 0, "hits": 0, "create_failures": 0, "invalidated": 0}
+
+
+def _cache_id(api_key: str, model: str, system_instruction: str) -> tuple[str, str, str]:
+    return key_id(api_key), model, hashlib.sha256(system_instruction.encode("utf-8")).hexdigest()[:16]
+
+
+async def _create(api_key: str, model: str, system_instruction: str) -> str | None:
+    client = get_http_client()
+    try:
+        res = await client.post(
+            CACHED_CONTENTS_URL,
+            headers={"Content-Type": "application/json", "X-Goog-Api-Key": api_key},
+            json={
+                "model": f"models/{model}",
+                "systemInstruction": {"parts": [{"text": system_instruction}]},
+                "ttl": f"{CONTEXT_CACHE_TTL}s",
+            },
+        )
+    except httpx.TransportError as e:
+        print("GEMINI CONTEXT CACHE CREATE FAILED:", repr(e))
+        return None
+    if not res.is_success:
+        # Typically 400 when the instructions are below the model's minimum cacheable size
+        print(f"GEMINI CONTEXT CACHE CREATE FAILED ({res.status_code}): {res.text[:200]}")
+        return None
+    return res.json().get("name")
+
+
+async def get_context_cache(api_key: str, model: str, system_instruction: str | None) -> str | None:
+    """
+    Name of a cachedContents resource holding system_instruction for this
+    key and model, creating it on first use. None means send the
+    instructions inline.
+    """
+    if not CONTEXT_CACHE_ENABLED or not system_instruction:
+        return None
+
+    cache_id = _cache_id(api_key, model, system_instruction)
+    entry = _entries.get(cache_id)
+    if entry is None or entry.expires_at - CONTEXT_CACHE_REFRESH_MARGIN <= time.monotonic():
+        # One create per key and template, however many rows are waiting on it
+        async with _locks.setdefault(cache_id, asyncio.Lock()):
+            entry = _entries.get(cache_id)
+            if entry is None or entry.expires_at - CONTEXT_CACHE_REFRESH_MARGIN <= time.monotonic():
+                name = await _create(api_key, model, system_instruction)
+                if name:
+                    _stats["created"] += 1
+                    entry = _Entry(name, time.monotonic() + CONTEXT_CACHE_TTL)
+                else:
+                    _stats["create_failures"] += 1
+                    entry = _Entry(None, time.monotonic() + CONTEXT_CACHE_RETRY_AFTER + CONTEXT_CACHE_REFRESH_MARGIN)
+                _entries[cache_id] = entry
+
+    if entry.name:
+        _stats["hits"] += 1
+    return entry.name
+
+
+def invalidate_context_cache(api_key: str, model: str, system_instruction: str):
+    """Forget a cache Gemini no longer recognises (deleted or expired early)."""
+    if _entries.pop(_cache_id(api_key, model, system_instruction), None) is not None:
+        _stats["invalidated"] += 1
+
+
+def context_cache_stats() -> dict:
+    now = time.monotonic()
+    return {
+        **_stats,
+        "enabled": CONTEXT_CACHE_ENABLED,
+        "ttl_seconds": CONTEXT_CACHE_TTL,
+        "active": sum(1 for entry in _entries.values() if entry.name and entry.expires_at > now),
+    }
@@ -0,0 +1,346 @@
+import asyncio
+import json
+import os
+import random
+import re
+import time
+from collections import deque
+from email.utils import parsedate_to_datetime
+from typing import Awaitable, Callable
+from dotenv import load_dotenv
+from services.rate_limiter import key_id, pause_key
+
+load_dotenv()
+
+# ===============================
+# Retry / Hedge / Breaker Settings
+# ===============================
+MAX_RETRIES = int(os.getenv("GEMINI_MAX_RETRIES", "3"))
+RETRY_BASE_DELAY = float(os.getenv("GEMINI_RETRY_BASE_DELAY", "1"))
+RETRY_MAX_DELAY = float(os.getenv("GEMINI_RETRY_MAX_DELAY", "30"))
+
+# Hedging sends a second identical request when the first is slower than
+# the recent p95 latency for that endpoint; off by default since it spends quota.
+HEDGE_ENABLED = os.getenv("GEMINI_HEDGE_ENABLED", "0") != "0"
+HEDGE_MIN_DELAY = float(os.getenv("GEMINI_HEDGE_MIN_DELAY", "2"))
+HEDGE_DEFAULT_DELAY = float(os.getenv("GEMINI_HEDGE_DEFAULT_DELAY", "15"))
+HEDGE_MIN_SAMPLES = 20
+LATENCY_WINDOW = 200
+
+BREAKER_THRESHOLD = int(os.getenv("GEMINI_BREAKER_THRESHOLD", "5"))
+BREAKER_COOLDOWN = float(os.getenv("GEMINI_BREAKER_COOLDOWN", "30"))
+# A half-open trial that has not reported back by then counts as failed, so the
+# key can never stay blocked behind a trial that hung or was abandoned
+BREAKER_TRIAL_TIMEOUT = float(os.getenv("GEMINI_BREAKER_TRIAL_TIMEOUT", "120"))
+
+
+# ===============================
+# Classified Errors
+# ===============================
+class GeminiError(Exception):
+    """Base for Gemini call failures. status_code is what our API should answer with."""
+    status_code = 502
+    retryable = False
+
+    def __init__(self, message: str, retry_after: float | None = None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class GeminiRateLimited(GeminiError):
+    status_code = 429
+    retryable = True
+
+
+class GeminiUnavailable(GeminiError):
+    """5xx, timeouts and connection errors."""
+    status_code = 503
+    retryable = True
+
+
+class GeminiPermissionDenied(GeminiError):
+    status_code = 403
+
+
+class GeminiRequestError(GeminiError):
+    """Other 4xx: bad request, invalid key, payload too large."""
+    status_code = 400
+
+
+class GeminiInvalidResponse(GeminiError):
+    status_code = 502
+
+
+class CircuitOpenError(GeminiError):
+    status_code = 503
+
+
+class RateLimitTimeout(GeminiError):
+    """
+    Raised by gemini_slot when a call waited longer than GEMINI_MAX_QUEUE_WAIT
+    for this key's quota. Local contention, not a Gemini failure: it never
+    counts against the breaker and is not retried in-process (that would only
+    queue again). Retryable means a caller may try again after retry_after,
+    as the job queue does.
+    """
+    status_code = 429
+    retryable = True
+
+
+def parse_retry_after(value: str | None) -> float | None:
+    """Retry-After as seconds; accepts delta-seconds or an HTTP date."""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def _retry_delay_from_body(body: str) -> float | None:
+    # Gemini 429s carry google.rpc.RetryInfo, e.g. {"retryDelay": "23s"}
+    try:
+        details = json.loads(body).get("error", {}).get("details", [])
+    except (ValueError, AttributeError):
+        return None
+    for detail in details:
+        match = re.fullmatch(r"([\d.]+)s", str(detail.get("retryDelay", "")))
+        if match:
+            return float(match.group(1))
+    return None
+
+
+def classify_error(status_code: int, headers, body: str) -> GeminiError:
+    if status_code == 403:
+        return GeminiPermissionDenied("Gemini permission denied (API / billing / project)")
+    if status_code == 429:
+        retry_after = parse_retry_after(headers.get("retry-after")) or _retry_delay_from_body(body)
+        return GeminiRateLimited(f"Gemini rate limited: {body}", retry_after=retry_after)
+    if status_code >= 500 or status_code == 408:
+        return GeminiUnavailable(f"Gemini error: {body}", retry_after=parse_retry_after(headers.get("retry-after")))
+    return GeminiRequestError(f"Gemini error: {body}")
+
+
+# ===============================
+# Circuit Breaker (per API key)
+# ===============================
+class _Breaker:
+    def __init__(self):
+        self.failures = 0
+        self.opened_at: float | None = None
+        # Token of the half-open trial call in flight, and when it started
+        self.trial: object | None = None
+        self.trial_started = 0.0
+        self.opens = 0
+
+
+_breakers: dict[str, _Breaker] = {}
+_stats = {"retries": 0, "hedges": 0, "hedge_wins": 0, "breaker_rejections": 0}
+_latencies: dict[str, deque] = {}
+
+
+def _breaker(api_key: str) -> _Breaker:
+    key = key_id(api_key)
+    if key not in _breakers:
+        _breakers[key] = _Breaker()
+    return _breakers[key]
+
+
+def check_breaker(api_key: str) -> object | None:
+    """
+    Raise CircuitOpenError while the key's breaker is open; let one trial call
+    through after the cooldown. Returns a token when this call is that trial;
+    pass it to release_trial() once the call is over, however it ended.
+    """
+    breaker = _breaker(api_key)
+    if breaker.opened_at is None:
+        return None
+    now = time.monotonic()
+    if breaker.trial is not None and now - breaker.trial_started >= BREAKER_TRIAL_TIMEOUT:
+        # The trial never reported back; count it as failed and start a new cooldown
+        print(f"GEMINI BREAKER TRIAL TIMED OUT after {BREAKER_TRIAL_TIMEOUT:g}s")
+        breaker.trial = None
+        breaker.opened_at = now
+        breaker.opens += 1
+    remaining = BREAKER_COOLDOWN - (now - breaker.opened_at)
+    if remaining > 0 or breaker.trial is not None:
+        _stats["breaker_rejections"] += 1
+        raise CircuitOpenError(
+            "Gemini is failing for this API key; pausing calls briefly",
+            retry_after=max(remaining, 1.0),
+        )
+    # Half-open: this call is the trial
+    breaker.trial = object()
+    breaker.trial_started = now
+    return breaker.trial
+
+
+def release_trial(api_key: str, trial: object | None):
+    """
+    End a trial that neither succeeded nor failed at Gemini (cancelled, or a
+    non-Gemini error). The breaker stays open and the next call becomes the trial.
+    """
+    breaker = _breaker(api_key)
+    if trial is not None and breaker.trial is trial:
+        breaker.trial = None
+
+
+def record_success(api_key: str):
+    breaker = _breaker(api_key)
+    breaker.failures = 0
+    breaker.opened_at = None
+    breaker.trial = None
+
+
+def record_failure(api_key: str, error: GeminiError):
+    # Only transient upstream failures count; a bad request or our own queue timeout
+    # says nothing about Gemini's health
+    if not error.retryable or isinstance(error, RateLimitTimeout):
+        _breaker(api_key).trial = None
+        return
+    breaker = _breaker(api_key)
+    breaker.failures += 1
+    if breaker.trial is not None or breaker.failures >= BREAKER_THRESHOLD:
+        if breaker.opened_at is None or breaker.trial is not None:
+            breaker.opens += 1
+        breaker.opened_at = time.monotonic()
+    breaker.trial = None
+
+
+# ===============================
+# Backoff / Latency Tracking
+# ===============================
+def retry_delay(attempt: int, error: GeminiError) -> float | None:
+    """
+    Seconds to wait before retry number attempt+1, or None to give up.
+    Full-jitter exponential backoff, but never sooner than Retry-After.
+    """
+    if not error.retryable or attempt >= MAX_RETRIES:
+        return None
+    if isinstance(error, RateLimitTimeout):
+        # Retrying would wait in the same queue again; hand it to the caller with Retry-After
+        return None
+    delay = random.uniform(0, min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * (2 ** attempt)))
+    if error.retry_after is not None:
+        if error.retry_after > RETRY_MAX_DELAY:
+            return None
+        delay = max(delay, error.retry_after)
+    return delay
+
+
+def record_latency(endpoint: str, seconds: float):
+    _latencies.setdefault(endpoint, deque(maxlen=LATENCY_WINDOW)).append(seconds)
+
+
+def _p95(endpoint: str) -> float | None:
+    samples = _latencies.get(endpoint)
+    if not samples or len(samples) < HEDGE_MIN_SAMPLES:
+        return None
+    ordered = sorted(samples)
+    return ordered[int(0.95 * (len(ordered) - 1))]
+
+
+def hedge_delay(endpoint: str) -> float:
+    p95 = _p95(endpoint)
+    return max(HEDGE_MIN_DELAY, p95 if p95 is not None else HEDGE_DEFAULT_DELAY)
+
+
+async def _hedged(attempt: Callable[[], Awaitable], endpoint: str):
+    first = asyncio.create_task(attempt())
+    tasks = [first]
+    try:
+        done, _ = await asyncio.wait(tasks, timeout=hedge_delay(endpoint))
+        if done:
+            return first.result()
+
+        _stats["hedges"] += 1
+        tasks.append(asyncio.create_task(attempt()))
+        pending = set(tasks)
+        error = None
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    if task is not first:
+                        _stats["hedge_wins"] += 1
+                    return task.result()
+                error = task.exception()
+        raise error
+    finally:
+        # The losing (or abandoned) request is cancelled, which also frees its rate-limiter slot
+        for task in tasks:
+            if not task.done():
+                task.cancel()
+
+
+# ===============================
+# Public API
+# ===============================
+async def backoff_before_retry(api_key: str, endpoint: str, attempt_number: int, error: GeminiError) -> bool:
+    """
+    Record a failed attempt and sleep before the next one.
+    Returns False when the caller should give up and re-raise.
+    """
+    record_failure(api_key, error)
+    delay = retry_delay(attempt_number, error)
+    if delay is None:
+        return False
+    if isinstance(error, GeminiRateLimited) and error.retry_after:
+        # Hold every queued call for this key, not just this one
+        pause_key(api_key, error.retry_after)
+    _stats["retries"] += 1
+    print(f"GEMINI RETRY {attempt_number + 1}/{MAX_RETRIES} in {delay:.1f}s ({endpoint}): {error}")
+    await asyncio.sleep(delay)
+    return True
+
+
+async def call_with_retries(api_key: str, endpoint: str, attempt: Callable[[], Awaitable], hedge: bool = True):
+    """
+    Run attempt() with the per-key circuit breaker, retrying transient
+    failures (429 / 5xx / timeouts) with backoff, and hedging slow calls
+    when GEMINI_HEDGE_ENABLED is set.
+    """
+    for attempt_number in range(MAX_RETRIES + 1):
+        trial = check_breaker(api_key)
+        try:
+            call = _hedged(attempt, endpoint) if hedge and HEDGE_ENABLED else attempt()
+            if trial is not None:
+                # A hung trial would otherwise hold every other call for this key
+                try:
+                    result = await asyncio.wait_for(call, BREAKER_TRIAL_TIMEOUT)
+                except asyncio.TimeoutError:
+                    raise GeminiUnavailable(f"Gemini trial call exceeded {BREAKER_TRIAL_TIMEOUT:g}s")
+            else:
+                result = await call
+        except GeminiError as e:
+            if not await backoff_before_retry(api_key, endpoint, attempt_number, e):
+                raise
+            continue
+        finally:
+            # Cancelled or failed with a non-Gemini error: free the trial slot
+            release_trial(api_key, trial)
+        record_success(api_key)
+        return result
+
+
+def retry_stats() -> dict:
+    now = time.monotonic()
+    return {
+        **_stats,
+        "hedge_enabled": HEDGE_ENABLED,
+        "hedge_delay_seconds": {endpoint: round(hedge_delay(endpoint), 3) for endpoint in _latencies},
+        "breakers": {
+            key: {
+                "state": "closed" if breaker.opened_at is None
+                else ("open" if now - breaker.opened_at < BREAKER_COOLDOWN else "half_open"),
+                "consecutive_failures": breaker.failures,
+                "trial_in_flight": breaker.trial is not None,
+                "opens": breaker.opens,
+            }
+            for key, breaker in _breakers.items()
+        },
+    }
@@ -255,135 +255,458 @@
 
 import os
 import re
+import json
+import time
+import uuid
+import base64
 import httpx
 from dotenv import load_dotenv
+from services.http_client import get_http_client
+from services.rate_limiter import gemini_slot, estimate_tokens
+from services.gemini_retry import (
+    GeminiError,
+    GeminiInvalidResponse,
+    GeminiRequestError,
+    GeminiUnavailable,
+    backoff_before_retry,
+    call_with_retries,
+    check_breaker,
+    classify_error,
+    record_failure,
+    record_latency,
+    record_success,
+    release_trial,
+)
+from services.response_cache import make_cache_key, cache_get, cache_put
+from services.gemini_context_cache import get_context_cache, invalidate_context_cache
+from services.metrics import record_gemini_call, record_gemini_error
 
 load_dotenv()
 
 API_KEY = os.getenv("GEMINI_API_KEY")
 MODEL = "gemini-2.5-flash"
 URL = f"https://generativelanguage.googleapis.com/v1beta/models/{MODEL}:generateContent"
+STREAM_URL = f"https://generativelanguage.googleapis.com/v1beta/models/{MODEL}:streamGenerateContent?alt=sse"
+
+# Ask for analysis + key points in one JSON response; set to 0 to force the two-call path
+SINGLE_CALL_ENABLED = os.getenv("GEMINI_SINGLE_CALL", "1") != "0"
+
+STRUCTURED_GENERATION_CONFIG = {
+    "responseMimeType": "application/json",
+    "responseSchema": {
+        "type": "OBJECT",
+        "properties": {
+            "analysis": {"type": "ARRAY", "items": {"type": "STRING"}},
+            "key_points": {"type": "ARRAY", "items": {"type": "STRING"}},
+        },
+        "required": ["analysis", "key_points"],
+    },
+}
+
+
+# Raw image bytes are base64-encoded in pieces of this size while the body is sent (multiple of 3)
+BODY_CHUNK_SIZE = 48 * 1024
 
 
-# ===============================
-# Gemini Core Caller
-# ===============================
 # ===============================
 # Gemini Core Caller
 # ===============================
 async def _call_gemini(
     prompt: str,
-    image_base64: str,
+    image_data: bytes,
+    mime_type: str,
+    api_key: str,
+    endpoint: str = "unknown",
+    generation_config: dict | None = None,
+    system_instruction: str | None = None,
+    stage: str | None = None
+):
+    started = time.monotonic()
+    stage = stage or endpoint
+    try:
+        # Static template instructions go by context-cache reference when one exists, else inline
+        cached_content = await get_context_cache(api_key, MODEL, system_instruction)
+        body = _RequestBody(prompt, image_data, mime_type, generation_config, system_instruction, cached_content)
+        headers = _build_headers(api_key, body)
+        # Quota is reserved for the instructions too, cached or not
+        estimate_text = (system_instruction or "") + prompt
+
+        async def attempt():
+            return await _post_gemini(api_key, headers, body, estimate_text, endpoint)
+
+        # Retries transient failures with backoff, hedges slow calls, trips the per-key breaker
+        try:
+            data, usage_log = await call_with_retries(api_key, endpoint, attempt)
+        except GeminiRequestError:
+            if not cached_content:
+                raise
+            # The cache was deleted or expired on Gemini's side; resend with the instructions inline
+            invalidate_context_cache(api_key, MODEL, system_instruction)
+            body = _RequestBody(prompt, image_data, mime_type, generation_config, system_instruction)
+            headers = _build_headers(api_key, body)
+            data, usage_log = await call_with_retries(api_key, endpoint, attempt)
+
+        try:
+            response_text = data["candidates"][0]["content"]["parts"][0]["text"]
+        except (KeyError, IndexError):
+            raise GeminiInvalidResponse("Invalid response from Gemini")
+
+        # Wall time for the stage, including quota waits and retries
+        usage_log.update(stage=stage, latency_ms=round((time.monotonic() - started) * 1000))
+        print("GEMINI USAGE:", usage_log)
+    except Exception as e:
+        record_gemini_error(stage, e)
+        raise
+    record_gemini_call(usage_log)
+
+    return response_text, usage_log
+
+
+async def _post_gemini(api_key: str, headers: dict, body: "_RequestBody", prompt: str, endpoint: str):
+    """One generateContent request. Raises a classified GeminiError on failure."""
+    client = get_http_client()
+    # Queue behind this key's concurrency / RPM / TPM limits instead of bursting into 429s
+    # Text-only stages (key points, the fallback text call) reserve no image tokens
+    async with gemini_slot(api_key, estimate_tokens(prompt, has_image=bool(body.image))) as slot:
+        started = time.monotonic()
+        try:
+            res = await client.post(URL, headers=headers, content=body.chunks())
+        except httpx.TransportError as e:
+            raise GeminiUnavailable(f"Gemini request failed: {e!r}") from e
+
+        if not res.is_success:
+            raise classify_error(res.status_code, res.headers, res.text)
+
+        record_latency(endpoint, time.monotonic() - started)
+        data = res.json()
+        usage_log = _usage_log(endpoint, data.get("usageMetadata", {}))
+        slot.report_tokens(usage_log["total_tokens"])
+    return data, usage_log
+
+
+async def _stream_gemini(
+    prompt: str,
+    image_data: bytes,
     mime_type: str,
     api_key: str,
-    endpoint: str = "unknown"
+    endpoint: str = "unknown",
+    system_instruction: str | None = None,
+    stage: str | None = None
 ):
-    headers = {
+    """
+    Streams a Gemini response via streamGenerateContent (SSE).
+    Yields ("text", chunk) as text arrives, then ("usage", usage_log) once.
+    """
+    started = time.monotonic()
+    stage = stage or endpoint
+    try:
+        cached_content = await get_context_cache(api_key, MODEL, system_instruction)
+        body = _RequestBody(prompt, image_data, mime_type, None, system_instruction, cached_content)
+        headers = _build_headers(api_key, body)
+        estimate_text = (system_instruction or "") + prompt
+        usage_metadata = {}
+
+        client = get_http_client()
+        # Failures are retried only until the first chunk is sent; after that the caller has partial output
+        attempt = 0
+        while True:
+            trial = check_breaker(api_key)
+            sent_text = False
+            try:
+                # The slot is held for the whole stream, so a streaming call counts as in flight until it ends
+                async with gemini_slot(api_key, estimate_tokens(estimate_text, has_image=bool(body.image))) as slot:
+                    attempt_started = time.monotonic()
+                    try:
+                        async with client.stream("POST", STREAM_URL, headers=headers, content=body.chunks()) as res:
+                            if not res.is_success:
+                                error_body = await res.aread()
+                                raise classify_error(res.status_code, res.headers, error_body.decode("utf-8", "replace"))
+
+                            async for line in res.aiter_lines():
+                                if not line.startswith("data:"):
+                                    continue
+                                try:
+                                    chunk = json.loads(line[len("data:"):].strip())
+                                except json.JSONDecodeError:
+                                    continue
+
+                                usage_metadata = chunk.get("usageMetadata") or usage_metadata
+                                for candidate in chunk.get("candidates", [])[:1]:
+                                    for part in (candidate.get("content") or {}).get("parts", []):
+                                        if part.get("text"):
+                                            sent_text = True
+                                            yield "text", part["text"]
+                    except httpx.TransportError as e:
+                        raise GeminiUnavailable(f"Gemini stream failed: {e!r}") from e
+
+                    record_latency(endpoint, time.monotonic() - attempt_started)
+                    usage_log = _usage_log(endpoint, usage_metadata)
+                    slot.report_tokens(usage_log["total_tokens"])
+            except GeminiError as e:
+                if sent_text:
+                    record_failure(api_key, e)
+                    raise
+                if cached_content and isinstance(e, GeminiRequestError):
+                    invalidate_context_cache(api_key, MODEL, system_instruction)
+                    cached_content = None
+                    body = _RequestBody(prompt, image_data, mime_type, None, system_instruction)
+                    headers = _build_headers(api_key, body)
+                    continue
+                if not await backoff_before_retry(api_key, endpoint, attempt, e):
+                    raise
+                attempt += 1
+                continue
+            finally:
+                # Client disconnected mid-stream, or a non-Gemini error: free the trial slot
+                release_trial(api_key, trial)
+            record_success(api_key)
+            break
+        usage_log.update(stage=stage, latency_ms=round((time.monotonic() - started) * 1000))
+        print("GEMINI USAGE:", usage_log)
+    except Exception as e:
+        record_gemini_error(stage, e)
+        raise
+    record_gemini_call(usage_log)
+    yield "usage", usage_log
+
+
+def _build_headers(api_key: str, body: "_RequestBody") -> dict:
+    return {
         "Content-Type": "application/json",
+        # Known up front, so the streamed body is not sent chunked
+        "Content-Length": str(len(body)),
         "X-Goog-Api-Key": api_key,
     }
 
-    payload = {
-        "contents": [
-            {
-                "role": "user",
-                "parts": [
-                    {"text": prompt},
-                    {
-                        "inline_data": {
-                            "mime_type": mime_type,
-                            "data": image_base64
-                        }
-                    }
-                ]
-            }
-        ]
-    }
 
-    async with httpx.AsyncClient(timeout=60) as client:
-        res = await client.post(URL, headers=headers, json=payload)
+class _RequestBody:
+    """
+    generateContent JSON body that base64-encodes the image piece by piece
+    as it is sent, instead of building the base64 string and the JSON
+    document in memory. chunks() can be called again for each retry.
+    """
 
-    if res.status_code == 403:
-        raise Exception("Gemini permission denied (API / billing / project)")
+    # Stands in for the image data in the serialized JSON
+    _PLACEHOLDER = f"__image_{uuid.uuid4().hex}__"
+
+    def __init__(
+        self,
+        prompt: str,
+        image_data: bytes,
+        mime_type: str,
+        generation_config: dict | None = None,
+        system_instruction: str | None = None,
+        cached_content: str | None = None
+    ):
+        parts = [{"text": prompt}]
+        if image_data:
+            parts.append({
+                "inline_data": {
+                    "mime_type": mime_type,
+                    "data": self._PLACEHOLDER
+                }
+            })
+        payload = {"contents": [{"role": "user", "parts": parts}]}
+        if cached_content:
+            payload["cachedContent"] = cached_content
+        elif system_instruction:
+            payload["systemInstruction"] = {"parts": [{"text": system_instruction}]}
+        if generation_config:
+            payload["generationConfig"] = generation_config
+
+        encoded = json.dumps(payload).encode("utf-8")
+        if image_data:
+            self.head, self.tail = encoded.split(self._PLACEHOLDER.encode("ascii"), 1)
+        else:
+            self.head, self.tail = encoded, b""
+        self.image = memoryview(image_data or b"")
 
-    if not res.is_success:
-        raise Exception(f"Gemini error: {res.text}")
+    def __len__(self) -> int:
+        # base64 is 4 output bytes per 3 input bytes, padded
+        return len(self.head) + 4 * ((len(self.image) + 2) // 3) + len(self.tail)
 
-    data = res.json()
+    async def chunks(self):
+        yield self.head
+        for start in range(0, len(self.image), BODY_CHUNK_SIZE):
+            yield base64.b64encode(self.image[start:start + BODY_CHUNK_SIZE])
+        yield self.tail
 
-    try:
-        response_text = data["candidates"][0]["content"]["parts"][0]["text"]
-    except (KeyError, IndexError):
-        raise Exception("Invalid response from Gemini")
 
-    usage_metadata = data.get("usageMetadata", {})
+# Summed across stages by _merge_usage
+USAGE_COUNTERS = (
+    "prompt_tokens", "candidate_tokens", "thoughts_tokens", "image_tokens", "cached_tokens", "total_tokens", "latency_ms"
+)
 
-    usage_log = {
+
+def _usage_log(endpoint: str, usage_metadata: dict) -> dict:
+    image_tokens = sum(
+        detail.get("tokenCount", 0)
+        for detail in usage_metadata.get("promptTokensDetails") or []
+        if detail.get("modality") == "IMAGE"
+    )
+    return {
         "endpoint": endpoint,
         "model": MODEL,
         "prompt_tokens": usage_metadata.get("promptTokenCount", 0),
         "candidate_tokens": usage_metadata.get("candidatesTokenCount", 0),
+        # Thinking tokens are billed as output but not counted in candidatesTokenCount
+        "thoughts_tokens": usage_metadata.get("thoughtsTokenCount", 0),
+        # Share of prompt_tokens that came from the chart image
+        "image_tokens": image_tokens,
+        # Prompt tokens served from a context cache (explicit or implicit), billed at a discount
+        "cached_tokens": usage_metadata.get("cachedContentTokenCount", 0),
         "total_tokens": usage_metadata.get("totalTokenCount", 0),
     }
 
-    print("GEMINI USAGE:", usage_log)
 
-    return response_text, usage_log
+def _from_cache(cached: dict) -> dict:
+    """A cache hit costs no tokens, so report zero usage for it."""
+    usage = dict(cached.get("usage") or {})
+    usage.update({counter: 0 for counter in USAGE_COUNTERS})
+    usage.update({"stages": [], "cached": True})
+    return {**cached, "usage": usage}
+
+
+def _merge_usage(usages: list[dict]) -> dict:
+    """Combine usage from several Gemini calls made for one analysis; stages keeps each call's own."""
+    first = usages[0] if usages else {}
+    return {
+        "endpoint": first.get("endpoint", ""),
+        "model": first.get("model", ""),
+        **{counter: sum(u.get(counter, 0) for u in usages) for counter in USAGE_COUNTERS},
+        "stages": usages,
+    }
 
 
 # ===============================
-# Prompt Selector
+# Prompt Templates
 # ===============================
-def get_prompt_by_plan(plan_type: str | None, rationale: str) -> str:
-    base = """
-You are a professional technical market analyst.
-Study the candlestick chart carefully and form a clear market view.
+# Everything that does not depend on the row is compiled once per plan type
+# into a system instruction (sent inline or as a Gemini context cache); each
+# request only carries the row's trade details and the optional user instruction.
+ANALYST_INTRO = """You are a professional technical market analyst.
+Study the candlestick chart carefully and form a clear market view."""
+
+PLAN_FOCUS = {
+    "generic": """Focus on price structure, trend direction, momentum,
+and important support or resistance zones.""",
+    "equity": """Focus on trend strength, swing structure, volume behavior,
+and positional continuation or reversal zones.""",
+    "commodity": """Focus on volatility behavior, momentum expansion,
+and supply–demand zones.""",
+    "options": """Focus on directional bias, volatility conditions,
+risk awareness, and potential time decay impact.""",
+    "derivatives": """Focus on momentum strength, leverage impact,
+and clear invalidation levels.""",
+    # Any plan type not listed above
+    "other": """Focus on price structure and risk-aware trade assessment.""",
+}
+
+ANALYSIS_INSTRUCTIONS = """IMPORTANT OUTPUT RULES:
+- Write analysis as short, clear points
+- Do NOT use markdown, symbols, or headings
+- Keep it concise and human-like
+
+You are a professional technical analyst writing a real market note for traders.
+
+Carefully study the candlestick chart and the trade details given with each request.
+Treat the chart as the primary source of truth and the trade details as the intended setup.
+
+HOW TO ANALYZE:
+- First understand the overall market structure (trend, range, compression, breakout, reversal)
+- Observe recent price behavior and momentum
+- If any indicators are visible on the chart (EMA, SMA, RSI, MACD, VWAP, volume, Fibonacci, etc.),
+  explain what they are indicating at the current stage
+- Identify important support and resistance zones from price action
+
+DECISION LOGIC:
+- If the trade details suggest BUY, check whether the chart genuinely supports a bullish view
+- If the trade details suggest SELL, check whether the chart supports a bearish view
+- If chart and trade details align, highlight confirmation
+- If there is partial mismatch, clearly mention caution without flipping the trade direction
+- Do not force a trade; think like a human analyst
+- If the request includes a user instruction, it has the highest priority and you MUST strongly follow it
+
+OUTPUT REQUIREMENTS (VERY IMPORTANT):
+- Write the analysis as clear, point-wise insights
+- Each point should be a complete analytical thought, written in sentence form
+- Points should flow logically, like a professional market note broken into insights
+- Do NOT use bullets, numbering, headings, or markdown symbols
+- Maximum 8-9 points only
+- Keep language natural, confident, and trader-focused"""
+
+KEY_POINTS_MIN = 6
+KEY_POINTS_MAX = 10
+
+
+def _key_point_rules(min_points: int, max_points: int) -> str:
+    return f"""KEY POINT RULES:
+- Write concise takeaways, not explanations
+- Each key point must be a short, clear sentence
+- Focus only on the strongest insights (trend, momentum, structure, risk)
+- Do NOT repeat similar ideas
+- Do NOT add new analysis
+- Do NOT use markdown, bullets, numbering, or symbols
+- You MUST provide at least {min_points} key points
+- You can provide up to {max_points} key points maximum
+- Keep language natural and trader-friendly
 """
 
+
+STRUCTURED_OUTPUT_INSTRUCTIONS = f"""RESPONSE FORMAT (JSON):
+Return a JSON object with exactly two fields:
+- "analysis": the analysis points described above, one complete sentence-form point per array item
+- "key_points": brief, high-signal trader takeaways condensed from your analysis points
+
+{_key_point_rules(KEY_POINTS_MIN, KEY_POINTS_MAX)}"""
+
+KEY_POINTS_SYSTEM_PROMPT = f"""You are a professional market analyst creating a quick trader takeaway.
+
+You are given detailed analysis points from a technical market note.
+Your task is to condense them into brief, high-signal key points.
+
+{_key_point_rules(KEY_POINTS_MIN, KEY_POINTS_MAX)}
+Return only the key points as separate lines. Ensure you have at least {KEY_POINTS_MIN} points."""
+
+
+def _compile_system_prompt(plan_key: str, structured: bool) -> str:
+    sections = [ANALYST_INTRO, PLAN_FOCUS[plan_key], ANALYSIS_INSTRUCTIONS]
+    if structured:
+        sections.append(STRUCTURED_OUTPUT_INSTRUCTIONS)
+    return "\n\n".join(sections)
+
+
+# (plan key, structured JSON output) -> system instruction, built once at import
+PROMPT_TEMPLATES = {
+    (plan_key, structured): _compile_system_prompt(plan_key, structured)
+    for plan_key in PLAN_FOCUS
+    for structured in (False, True)
+}
+
+
+def _plan_key(plan_type: str | None) -> str:
     if not plan_type:
-        focus = """
-Focus on price structure, trend direction, momentum,
-and important support or resistance zones.
-"""
-    else:
-        plan_type = plan_type.lower()
+        return "generic"
+    plan_key = plan_type.lower()
+    return plan_key if plan_key in PLAN_FOCUS else "other"
 
-        if plan_type == "equity":
-            focus = """
-Focus on trend strength, swing structure, volume behavior,
-and positional continuation or reversal zones.
-"""
-        elif plan_type == "commodity":
-            focus = """
-Focus on volatility behavior, momentum expansion,
-and supply–demand zones.
-"""
-        elif plan_type == "options":
-            focus = """
-Focus on directional bias, volatility conditions,
-risk awareness, and potential time decay impact.
-"""
-        elif plan_type == "derivatives":
-            focus = """
-Focus on momentum strength, leverage impact,
-and clear invalidation levels.
-"""
-        else:
-            focus = """
-Focus on price structure and risk-aware trade assessment.
-"""
 
-    return f"""{base}
-{focus}
+def get_system_prompt(plan_type: str | None, structured: bool = False) -> str:
+    return PROMPT_TEMPLATES[(_plan_key(plan_type), structured)]
 
-Trade Details:
-{rationale}
 
-IMPORTANT OUTPUT RULES:
-- Write analysis as short, clear points
-- Do NOT use markdown, symbols, or headings
-- Keep it concise and human-like
-"""
+def build_row_prompt(rationale: str, user_prompt: str | None = None) -> str:
+    """The per-row part of an analysis request: trade details, once, and the user instruction."""
+    sections = []
+    if user_prompt:
+        sections.append(f"IMPORTANT USER INSTRUCTION (HIGHEST PRIORITY):\n{user_prompt}")
+    sections.append(f"TRADE DETAILS (FROM SHEET DATA):\n{rationale}")
+    return "\n\n".join(sections)
+
+
+def get_prompt_by_plan(plan_type: str | None, rationale: str) -> str:
+    """Full single-string prompt (system instructions + trade details) for a plan type."""
+    return f"{get_system_prompt(plan_type)}\n\n{build_row_prompt(rationale)}"
 
 
 # ===============================
@@ -397,21 +720,14 @@ def format_analysis_points(raw_text: str, max_points: int = 10) -> list[str]:
     - Max 10 points
     """
 
-    # Remove markdown and symbols
-    cleaned = re.sub(r"[*#>`_]", "", raw_text)
-
-    lines = cleaned.split("\n")
     points = []
 
-    for line in lines:
-        line = line.strip()
+    for line in raw_text.split("\n"):
+        line = _clean_point(line)
 
         if not line:
             continue
 
-        # Remove numbering / bullets
-        line = re.sub(r"^[-•\d.\)]\s*", "", line)
-
         # Skip pure headings
         if line.isupper() and len(line) < 30:
             continue
@@ -424,148 +740,244 @@ def format_analysis_points(raw_text: str, max_points: int = 10) -> list[str]:
     return points
 
 
+def _clean_point(line: str) -> str:
+    # Remove markdown and symbols
+    line = re.sub(r"[*#>`_]", "", line).strip()
+    # Remove numbering / bullets
+    return re.sub(r"^[-•\d.\)]\s*", "", line)
+
+
+def parse_structured_analysis(raw_text: str, max_points: int = 10) -> tuple[list[str], list[str]]:
+    """
+    Parses the single-call JSON response:
+    {"analysis": [...], "key_points": [...]}
+
+    Raises ValueError if the response is not the expected shape,
+    so the caller can fall back to the two-call path.
+    """
+    text = raw_text.strip()
+    # Tolerate a ```json fence even though JSON mode should not add one
+    if text.startswith("```"):
+        text = re.sub(r"^```(?:json)?\s*|\s*```$", "", text)
+
+    try:
+        data = json.loads(text)
+    except json.JSONDecodeError as e:
+        raise ValueError(f"Structured response is not JSON: {e}")
+
+    if not isinstance(data, dict):
+        raise ValueError("Structured response is not an object")
+
+    parsed = []
+    for field in ("analysis", "key_points"):
+        items = data.get(field)
+        if not isinstance(items, list) or not all(isinstance(i, str) for i in items):
+            raise ValueError(f"Structured response field '{field}' must be a list of strings")
+        points = [p for p in (_clean_point(i) for i in items) if p]
+        parsed.append(points[:max_points])
+
+    analysis_points, key_points = parsed
+    if not analysis_points:
+        raise ValueError("Structured response has no analysis points")
+
+    return analysis_points, key_points
+
+
 # ===============================
 # TEXT + IMAGE
 # ===============================
 async def analyze_text_and_image(
     rationale: str,
-    image_base64: str,
+    image_data: bytes,
     mime_type: str,
     api_key: str,
     plan_type: str | None = None,
     user_prompt: str | None = None
 ):
-    base_prompt = get_prompt_by_plan(plan_type, rationale)
-    user_instruction = ""
-    if user_prompt:
-       user_instruction = f"""
-    IMPORTANT USER INSTRUCTION (HIGHEST PRIORITY):
-    {user_prompt}
-
-    You MUST strongly follow the above instruction while performing the analysis.
-    """
-
-    final_prompt = f"""
+    row_prompt = build_row_prompt(rationale, user_prompt)
+    system_prompt = get_system_prompt(plan_type)
+
+    cache_key = make_cache_key("analyze_with_rationale", MODEL, system_prompt, row_prompt, mime_type, image_data)
+    cached = await cache_get(cache_key)
+    if cached is not None:
+        return _from_cache(cached)
+
+    endpoint = f"analyze_with_rationale_{_plan_key(plan_type)}"
+    usages = []
+    structured = None
+
+    # 1️⃣ Single call: analysis + key points as one JSON response
+    if SINGLE_CALL_ENABLED:
+        response_text, usage = await _call_gemini(
+            prompt=row_prompt,
+            image_data=image_data,
+            mime_type=mime_type,
+            api_key=api_key,
+            endpoint=endpoint,
+            generation_config=STRUCTURED_GENERATION_CONFIG,
+            system_instruction=get_system_prompt(plan_type, structured=True),
+            stage="analysis_structured"
+        )
+        usages.append(usage)
+        try:
+            structured = parse_structured_analysis(response_text, max_points=10)
+        except ValueError as e:
+            print("GEMINI STRUCTURED PARSE FAILED, falling back to two calls:", e)
+
+    if structured:
+        analysis_points, key_points = structured
+    else:
+        # 2️⃣ Fallback: analysis call, then a second key-points call
+        response_text, usage = await _call_gemini(
+            prompt=row_prompt,
+            image_data=image_data,
+            mime_type=mime_type,
+            api_key=api_key,
+            endpoint=endpoint,
+            system_instruction=system_prompt,
+            stage="analysis"
+        )
+        usages.append(usage)
+
+        analysis_points = format_analysis_points(response_text, max_points=10)
+
+        key_points_text, usage2 = await _call_gemini(
+            prompt=build_key_points_prompt(analysis_points),
+            image_data=b"",
+            mime_type="text/plain",
+            api_key=api_key,
+            endpoint="key_points_summary",
+            system_instruction=KEY_POINTS_SYSTEM_PROMPT,
+            stage="key_points"
+        )
+        usages.append(usage2)
+
+        key_points = format_analysis_points(
+            raw_text=key_points_text,
+            max_points=10
+        )
+
+    # Combine usage from all Gemini calls
+    combined_usage = _merge_usage(usages)
     
-{user_instruction}    
-{base_prompt}
+    key_points = _pad_key_points(key_points, analysis_points, min_points=KEY_POINTS_MIN)
 
-You are a professional technical analyst writing a real market note for traders.
-
-Carefully study the candlestick chart and the provided trade details.
-Treat the chart as the primary source of truth and the trade details as the intended setup.
-
-HOW TO ANALYZE:
-- First understand the overall market structure (trend, range, compression, breakout, reversal)
-- Observe recent price behavior and momentum
-- If any indicators are visible on the chart (EMA, SMA, RSI, MACD, VWAP, volume, Fibonacci, etc.),
-  explain what they are indicating at the current stage
-- Identify important support and resistance zones from price action
-
-TRADE DETAILS (FROM SHEET DATA):
-{rationale}
-
-DECISION LOGIC:
-- If the trade details suggest BUY, check whether the chart genuinely supports a bullish view
-- If the trade details suggest SELL, check whether the chart supports a bearish view
-- If chart and trade details align, highlight confirmation
-- If there is partial mismatch, clearly mention caution without flipping the trade direction
-- Do not force a trade; think like a human analyst
-
-OUTPUT REQUIREMENTS (VERY IMPORTANT):
-- Write the analysis as clear, point-wise insights
-- Each point should be a complete analytical thought, written in sentence form
-- Points should flow logically, like a professional market note broken into insights
-- Do NOT use bullets, numbering, headings, or markdown symbols
-- Maximum 8-9 points only
-- Keep language natural, confident, and trader-focused
-"""
+    result = {
+        "analysis": analysis_points,
+        "key_points": key_points,
+        "usage": combined_usage
+    }
+    await cache_put(cache_key, result)
+    return result
 
-    response_text, usage = await _call_gemini(
-        prompt=final_prompt,
-        image_base64=image_base64,
+async def stream_text_and_image(
+    rationale: str,
+    image_data: bytes,
+    mime_type: str,
+    api_key: str,
+    plan_type: str | None = None,
+    user_prompt: str | None = None
+):
+    """
+    Streaming variant of analyze_text_and_image.
+    Yields (event, data) pairs: one "analysis" per point as Gemini produces it,
+    then "key_points" (list) and finally "usage" (dict).
+    """
+    row_prompt = build_row_prompt(rationale, user_prompt)
+    system_prompt = get_system_prompt(plan_type)
+
+    cache_key = make_cache_key("analyze_with_rationale", MODEL, system_prompt, row_prompt, mime_type, image_data)
+    cached = await cache_get(cache_key)
+    if cached is not None:
+        cached = _from_cache(cached)
+        for point in cached["analysis"]:
+            yield "analysis", point
+        yield "key_points", cached["key_points"]
+        yield "usage", cached["usage"]
+        return
+
+    analysis_points = []
+    usages = []
+    buffer = ""
+
+    def _take_points(lines: list[str]):
+        new_points = format_analysis_points("\n".join(lines), max_points=10 - len(analysis_points))
+        analysis_points.extend(new_points)
+        return new_points
+
+    # 1️⃣ Stream the analysis, emitting each completed line as a point
+    async for kind, data in _stream_gemini(
+        prompt=row_prompt,
+        image_data=image_data,
         mime_type=mime_type,
         api_key=api_key,
-        endpoint=f"analyze_with_rationale_{plan_type or 'generic'}"
-    )
+        endpoint=f"analyze_with_rationale_{_plan_key(plan_type)}",
+        system_instruction=system_prompt,
+        stage="analysis_stream"
+    ):
+        if kind == "usage":
+            usages.append(data)
+            continue
 
-    analysis_points = format_analysis_points(response_text, max_points=10)
-    
-    key_points_prompt = build_key_points_prompt(
-        analysis_points=analysis_points,
-        min_points=6,
-        max_points=10
-    )
+        buffer += data
+        *complete, buffer = buffer.split("\n")
+        if complete and len(analysis_points) < 10:
+            for point in _take_points(complete):
+                yield "analysis", point
+
+    if buffer.strip() and len(analysis_points) < 10:
+        for point in _take_points([buffer]):
+            yield "analysis", point
 
+    # 2️⃣ Key points from the finished analysis
     key_points_text, usage2 = await _call_gemini(
-        prompt=key_points_prompt,
-        image_base64="",              
+        prompt=build_key_points_prompt(analysis_points),
+        image_data=b"",
         mime_type="text/plain",
         api_key=api_key,
-        endpoint="key_points_summary"
+        endpoint="key_points_summary",
+        system_instruction=KEY_POINTS_SYSTEM_PROMPT,
+        stage="key_points"
     )
+    usages.append(usage2)
 
-    # Combine usage from both Gemini calls
-    combined_usage = {
-        "endpoint": usage.get("endpoint", ""),
-        "model": usage.get("model", ""),
-        "prompt_tokens": usage.get("prompt_tokens", 0) + usage2.get("prompt_tokens", 0),
-        "candidate_tokens": usage.get("candidate_tokens", 0) + usage2.get("candidate_tokens", 0),
-        "total_tokens": usage.get("total_tokens", 0) + usage2.get("total_tokens", 0),
-    }
-
-    key_points = format_analysis_points(
-        raw_text=key_points_text,
-        max_points=10
+    key_points = _pad_key_points(
+        format_analysis_points(key_points_text, max_points=10),
+        analysis_points,
+        min_points=KEY_POINTS_MIN
     )
-    
-    # Ensure minimum 6 key points - if less, pad with analysis points
-    if len(key_points) < 6:
-        remaining_needed = 6 - len(key_points)
-        # Get analysis points that aren't already in key_points
-        for point in analysis_points:
-            if point not in key_points and remaining_needed > 0:
-                key_points.append(point)
-                remaining_needed -= 1
-            if remaining_needed <= 0:
-                break
+    yield "key_points", key_points
 
-    return {
+    combined_usage = _merge_usage(usages)
+    yield "usage", combined_usage
+
+    await cache_put(cache_key, {
         "analysis": analysis_points,
         "key_points": key_points,
         "usage": combined_usage
-    }
+    })
 
-def build_key_points_prompt(analysis_points: list[str], min_points: int = 6, max_points: int = 10) -> str:
-    joined_analysis = "\n".join(f"- {p}" for p in analysis_points)
-
-    return f"""
-You are a professional market analyst creating a quick trader takeaway.
 
-Below are detailed analysis points from a technical market note.
-Your task is to condense them into brief, high-signal key points.
+def _pad_key_points(key_points: list[str], analysis_points: list[str], min_points: int = 6) -> list[str]:
+    """Ensure minimum key points - if less, pad with analysis points."""
+    key_points = list(key_points)
+    for point in analysis_points:
+        if len(key_points) >= min_points:
+            break
+        if point not in key_points:
+            key_points.append(point)
+    return key_points
 
-ANALYSIS POINTS:
-{joined_analysis}
 
-KEY POINT RULES:
-- Write concise takeaways, not explanations
-- Each key point must be a short, clear sentence
-- Focus only on the strongest insights (trend, momentum, structure, risk)
-- Do NOT repeat similar ideas
-- Do NOT add new analysis
-- Do NOT use markdown, bullets, numbering, or symbols
-- You MUST provide at least {min_points} key points
-- You can provide up to {max_points} key points maximum
-- Keep language natural and trader-friendly
-
-Return only the key points as separate lines. Ensure you have at least {min_points} points.
-"""
+def build_key_points_prompt(analysis_points: list[str]) -> str:
+    """Per-call part of the key-points request; the rules are KEY_POINTS_SYSTEM_PROMPT."""
+    joined_analysis = "\n".join(f"- {p}" for p in analysis_points)
+    return f"ANALYSIS POINTS:\n{joined_analysis}"
 
 # ===============================
 # IMAGE ONLY
 # ===============================
-async def analyze_image_only(image_base64: str, mime_type: str, api_key: str):
+async def analyze_image_only(image_data: bytes, mime_type: str, api_key: str):
     prompt = """
 You are a professional technical analyst.
 
@@ -574,12 +986,18 @@ Write only short, human-style points.
 Avoid formatting or symbols.
 """
 
+    cache_key = make_cache_key("analyze_image_only", MODEL, prompt, mime_type, image_data)
+    cached = await cache_get(cache_key)
+    if cached is not None:
+        return _from_cache(cached)
+
     response_text, usage = await _call_gemini(
         prompt=prompt,
-        image_base64=image_base64,
+        image_data=image_data,
         mime_type=mime_type,
         api_key=api_key,
-        endpoint="analyze_image_only"
+        endpoint="analyze_image_only",
+        stage="image_only"
     )
 
     analysis_points = format_analysis_points(response_text, max_points=10)
@@ -604,7 +1022,9 @@ Avoid formatting or symbols.
             if pad_point not in key_points:
                 key_points.append(pad_point)
 
-    return {
+    result = {
         "analysis": analysis_points,
         "usage": usage
     }
+    await cache_put(cache_key, result)
+    return result
@@ -0,0 +1,74 @@
+import os
+import httpx
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# ===============================
+# Pool / Timeout Settings
+# ===============================
+MAX_CONNECTIONS = int(os.getenv("GEMINI_HTTP_MAX_CONNECTIONS", "100"))
+MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("GEMINI_HTTP_MAX_KEEPALIVE", "20"))
+KEEPALIVE_EXPIRY = float(os.getenv("GEMINI_HTTP_KEEPALIVE_EXPIRY", "30"))
+CONNECT_TIMEOUT = float(os.getenv("GEMINI_CONNECT_TIMEOUT", "10"))
+READ_TIMEOUT = float(os.getenv("GEMINI_READ_TIMEOUT", "60"))
+POOL_TIMEOUT = float(os.getenv("GEMINI_POOL_TIMEOUT", "30"))
+HTTP2_ENABLED = os.getenv("GEMINI_HTTP2", "1") != "0"
+
+_client: httpx.AsyncClient | None = None
+
+
+def _http2_available() -> bool:
+    # httpx only speaks HTTP/2 when the optional `h2` package is installed
+    try:
+        import h2  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+def _build_client() -> httpx.AsyncClient:
+    limits = httpx.Limits(
+        max_connections=MAX_CONNECTIONS,
+        max_keepalive_connections=MAX_KEEPALIVE_CONNECTIONS,
+        keepalive_expiry=KEEPALIVE_EXPIRY,
+    )
+    timeout = httpx.Timeout(
+        connect=CONNECT_TIMEOUT,
+        read=READ_TIMEOUT,
+        write=READ_TIMEOUT,
+        pool=POOL_TIMEOUT,
+    )
+    return httpx.AsyncClient(
+        limits=limits,
+        timeout=timeout,
+        http2=HTTP2_ENABLED and _http2_available(),
+    )
+
+
+async def start_http_client() -> httpx.AsyncClient:
+    """Create the shared client. Called once from the FastAPI lifespan."""
+    global _client
+    if _client is None or _client.is_closed:
+        _client = _build_client()
+    return _client
+
+
+async def close_http_client():
+    """Close the shared client and drop pooled connections."""
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+
+def get_http_client() -> httpx.AsyncClient:
+    """
+    Return the app-lifetime client.
+    Falls back to creating it lazily so scripts that call the
+    service without the FastAPI lifespan still work.
+    """
+    global _client
+    if _client is None or _client.is_closed:
+        _client = _build_client()
+    return _client
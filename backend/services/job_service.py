@@ -0,0 +1,350 @@
+import asyncio
+import hashlib
+import os
+import socket
+import uuid
+from datetime import datetime, timedelta
+from dotenv import load_dotenv
+from jose import jwe
+from sqlalchemy import and_, func, or_, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from models.sheet import Sheet, SheetRow, GenerationJob
+from services.gemini_retry import GeminiError
+from services.rationale_service import generate_rationale, build_rationale_text
+from services.sheet_service import save_row_rationale
+from services.usage_service import record_usage
+from utils.blob_store import get_blob
+from utils.database import AsyncSessionLocal
+
+load_dotenv()
+
+# ===============================
+# Worker Pool Settings
+# ===============================
+# Generation jobs live in the generation_jobs table and are run by JOB_WORKERS
+# tasks inside the API process, so they outlive the browser request that
+# queued them. 0 disables the pool (e.g. on extra API processes).
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "4"))
+JOB_POLL_INTERVAL = float(os.getenv("JOB_POLL_INTERVAL", "5"))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+JOB_RETRY_DELAY = float(os.getenv("JOB_RETRY_DELAY", "60"))
+# A running job is renewed every third of its lease; if the process dies the
+# lease lapses and another worker (or this one after a restart) resumes it.
+JOB_LEASE_SECONDS = float(os.getenv("JOB_LEASE_SECONDS", "300"))
+
+# Gemini keys are stored encrypted so queued jobs can resume after a restart.
+# There is deliberately no default: without it jobs are refused and the pool stays off.
+JOB_KEY_SECRET = os.getenv("JOB_KEY_SECRET")
+
+FINISHED_STATUSES = ("succeeded", "failed", "cancelled")
+
+_worker_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+_workers: list[asyncio.Task] = []
+_wakeup: asyncio.Event | None = None
+_stats = {"claimed": 0, "succeeded": 0, "failed": 0, "retried": 0}
+
+
+# ===============================
+# API Key Storage
+# ===============================
+def job_queue_available() -> bool:
+    """False until JOB_KEY_SECRET is set; client API keys are never stored under a default key."""
+    return bool(JOB_KEY_SECRET)
+
+
+def _key_bytes() -> bytes:
+    return hashlib.sha256(JOB_KEY_SECRET.encode("utf-8")).digest()
+
+
+def encrypt_api_key(api_key: str) -> str:
+    return jwe.encrypt(api_key, _key_bytes(), algorithm="dir", encryption="A256GCM").decode("ascii")
+
+
+def decrypt_api_key(token: str) -> str:
+    return jwe.decrypt(token, _key_bytes()).decode("utf-8")
+
+
+# ===============================
+# Queue
+# ===============================
+async def enqueue_jobs(
+    db: AsyncSession,
+    client_id: int,
+    sheet_id: int,
+    jobs: list[dict],
+    api_key: str,
+    plan_type: str | None = None,
+    user_prompt: str | None = None,
+) -> list[GenerationJob]:
+    """
+    Queue one job per {"row_id", "image_hash", "mime_type"} and wake the workers.
+    Pending jobs already queued for the same rows are cancelled. Commits.
+    """
+    row_ids = [job["row_id"] for job in jobs]
+    await db.execute(
+        update(GenerationJob)
+        .where(
+            GenerationJob.sheet_id == sheet_id,
+            GenerationJob.row_id.in_(row_ids),
+            GenerationJob.status == "pending",
+        )
+        .values(status="cancelled", api_key_encrypted=None, finished_at=datetime.utcnow())
+    )
+
+    api_key_encrypted = encrypt_api_key(api_key)
+    created = [
+        GenerationJob(
+            client_id=client_id,
+            sheet_id=sheet_id,
+            row_id=job["row_id"],
+            status="pending",
+            plan_type=plan_type,
+            user_prompt=user_prompt,
+            image_hash=job["image_hash"],
+            mime_type=job["mime_type"],
+            api_key_encrypted=api_key_encrypted,
+            attempts=0,
+        )
+        for job in jobs
+    ]
+    db.add_all(created)
+    await db.commit()
+
+    if _wakeup is not None:
+        _wakeup.set()
+    return created
+
+
+async def cancel_pending_jobs(db: AsyncSession, sheet_id: int) -> int:
+    """Cancel a sheet's jobs that have not started. Running jobs finish. Commits."""
+    result = await db.execute(
+        update(GenerationJob)
+        .where(GenerationJob.sheet_id == sheet_id, GenerationJob.status == "pending")
+        .values(status="cancelled", api_key_encrypted=None, finished_at=datetime.utcnow())
+    )
+    await db.commit()
+    return result.rowcount
+
+
+async def get_sheet_jobs(db: AsyncSession, sheet_id: int) -> list[tuple[GenerationJob, int | None]]:
+    """(job, current row position) for every job of a sheet, oldest first."""
+    result = await db.execute(
+        select(GenerationJob, SheetRow.position)
+        .outerjoin(SheetRow, SheetRow.id == GenerationJob.row_id)
+        .where(GenerationJob.sheet_id == sheet_id)
+        .order_by(GenerationJob.id)
+    )
+    return result.all()
+
+
+# ===============================
+# Worker
+# ===============================
+def _runnable(now: datetime):
+    return or_(
+        and_(
+            GenerationJob.status == "pending",
+            or_(GenerationJob.run_after.is_(None), GenerationJob.run_after <= now),
+        ),
+        # Lease lapsed: the worker that had it died or was restarted
+        and_(GenerationJob.status == "running", GenerationJob.lease_expires_at < now),
+    )
+
+
+async def _claim_next() -> int | None:
+    """Atomically move the oldest runnable job to running under this worker's lease."""
+    async with AsyncSessionLocal() as db:
+        for _ in range(5):
+            now = datetime.utcnow()
+            job_id = await db.scalar(
+                select(GenerationJob.id).where(_runnable(now)).order_by(GenerationJob.id).limit(1)
+            )
+            if job_id is None:
+                return None
+            # Conditional UPDATE: only one worker (or process) wins a given job
+            result = await db.execute(
+                update(GenerationJob)
+                .where(GenerationJob.id == job_id, _runnable(now))
+                .values(
+                    status="running",
+                    attempts=GenerationJob.attempts + 1,
+                    worker_id=_worker_id,
+                    started_at=now,
+                    lease_expires_at=now + timedelta(seconds=JOB_LEASE_SECONDS),
+                )
+            )
+            await db.commit()
+            if result.rowcount == 1:
+                _stats["claimed"] += 1
+                return job_id
+    return None
+
+
+async def _finish(job_id: int, **values):
+    """Record a job's outcome, unless another worker has taken it over since."""
+    async with AsyncSessionLocal() as db:
+        await db.execute(
+            update(GenerationJob)
+            .where(GenerationJob.id == job_id, GenerationJob.worker_id == _worker_id, GenerationJob.status == "running")
+            .values(lease_expires_at=None, **values)
+        )
+        await db.commit()
+
+
+async def _renew_lease(job_id: int):
+    while True:
+        await asyncio.sleep(JOB_LEASE_SECONDS / 3)
+        async with AsyncSessionLocal() as db:
+            await db.execute(
+                update(GenerationJob)
+                .where(GenerationJob.id == job_id, GenerationJob.worker_id == _worker_id, GenerationJob.status == "running")
+                .values(lease_expires_at=datetime.utcnow() + timedelta(seconds=JOB_LEASE_SECONDS))
+            )
+            await db.commit()
+
+
+async def _fail(job_id: int, error: str):
+    _stats["failed"] += 1
+    print(f"GENERATION JOB {job_id} FAILED: {error}")
+    await _finish(job_id, status="failed", error=error, api_key_encrypted=None, finished_at=datetime.utcnow())
+
+
+async def _process(job_id: int):
+    # Load everything up front; no session is held open across the Gemini call
+    async with AsyncSessionLocal() as db:
+        job = await db.get(GenerationJob, job_id)
+        row = await db.get(SheetRow, job.row_id) if job.row_id is not None else None
+
+    if row is None or row.sheet_id != job.sheet_id:
+        await _fail(job_id, "Row no longer exists")
+        return
+    if job.attempts > JOB_MAX_ATTEMPTS:
+        await _fail(job_id, job.error or f"Gave up after {JOB_MAX_ATTEMPTS} attempts")
+        return
+    image_data = await asyncio.to_thread(get_blob, job.image_hash)
+    if image_data is None:
+        await _fail(job_id, "Chart image is missing from the blob store")
+        return
+
+    try:
+        result = await generate_rationale(
+            row.data, image_data, job.mime_type, decrypt_api_key(job.api_key_encrypted),
+            job.plan_type, job.user_prompt,
+        )
+    except GeminiError as e:
+        if not e.retryable or job.attempts >= JOB_MAX_ATTEMPTS:
+            await _fail(job_id, str(e))
+            return
+        delay = JOB_RETRY_DELAY * (2 ** (job.attempts - 1))
+        if e.retry_after:
+            delay = max(delay, e.retry_after)
+        _stats["retried"] += 1
+        print(f"GENERATION JOB {job_id} RETRY in {delay:.0f}s: {e}")
+        await _finish(
+            job_id, status="pending", error=str(e), worker_id=None,
+            run_after=datetime.utcnow() + timedelta(seconds=delay),
+        )
+        return
+    except Exception as e:
+        await _fail(job_id, str(e))
+        return
+
+    async with AsyncSessionLocal() as db:
+        sheet = await db.get(Sheet, job.sheet_id)
+        # Re-read the row: an earlier row may have been deleted while Gemini ran
+        row = await db.get(SheetRow, job.row_id)
+        if sheet is None or row is None:
+            await _fail(job_id, "Row no longer exists")
+            return
+        saved = await save_row_rationale(
+            db,
+            sheet,
+            row_index=row.position,
+            rationale_text=build_rationale_text(result["output"].get("analysis")),
+            rationale_result=result,
+            image_hash=job.image_hash,
+        )
+
+    usage = result["output"].get("usage") or {}
+    total = usage.get("total_tokens", 0) or 0
+    record_usage(job.client_id, "analyze_with_rationale", total, usage=usage, plan_type=result["plan_type"])
+    _stats["succeeded"] += 1
+    await _finish(
+        job_id, status="succeeded", error=None, rationale_id=saved.id, tokens_used=total,
+        api_key_encrypted=None, finished_at=datetime.utcnow(),
+    )
+
+
+async def _run():
+    while True:
+        try:
+            job_id = await _claim_next()
+        except Exception as e:
+            print("GENERATION JOB CLAIM FAILED:", e)
+            job_id = None
+
+        if job_id is None:
+            _wakeup.clear()
+            try:
+                await asyncio.wait_for(_wakeup.wait(), JOB_POLL_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            continue
+
+        lease = asyncio.create_task(_renew_lease(job_id))
+        try:
+            await _process(job_id)
+        except Exception as e:
+            print(f"GENERATION JOB {job_id} ERROR:", e)
+            try:
+                await _fail(job_id, str(e))
+            except Exception:
+                pass
+        finally:
+            lease.cancel()
+
+
+# ===============================
+# Lifecycle
+# ===============================
+def start_job_workers():
+    """Start the worker pool. Called from the FastAPI lifespan; picks up pending jobs left from before."""
+    global _wakeup
+    if JOB_WORKERS <= 0 or any(not task.done() for task in _workers):
+        return
+    if not job_queue_available():
+        print("GENERATION JOBS DISABLED: set JOB_KEY_SECRET to enable the worker pool")
+        return
+    _wakeup = asyncio.Event()
+    _workers[:] = [asyncio.create_task(_run()) for _ in range(JOB_WORKERS)]
+
+
+async def stop_job_workers():
+    """Stop the workers and hand their running jobs back to the queue for the next start."""
+    for task in _workers:
+        task.cancel()
+    await asyncio.gather(*_workers, return_exceptions=True)
+    _workers.clear()
+    try:
+        async with AsyncSessionLocal() as db:
+            await db.execute(
+                update(GenerationJob)
+                .where(GenerationJob.worker_id == _worker_id, GenerationJob.status == "running")
+                # The interrupted attempt does not count against JOB_MAX_ATTEMPTS
+                .values(status="pending", attempts=GenerationJob.attempts - 1, worker_id=None, lease_expires_at=None)
+            )
+            await db.commit()
+    except Exception as e:
+        print("GENERATION JOB REQUEUE FAILED:", e)
+
+
+async def job_stats() -> dict:
+    async with AsyncSessionLocal() as db:
+        counts = dict((await db.execute(
+            select(GenerationJob.status, func.count()).group_by(GenerationJob.status)
+        )).all())
+    return {
+        **_stats,
+        "workers": sum(1 for task in _workers if not task.done()),
+        "jobs": {status: counts.get(status, 0) for status in ("pending", "running", *FINISHED_STATUSES)},
+    }
@@ -0,0 +1,313 @@
+import asyncio
+import os
+import time
+from dotenv import load_dotenv
+from prometheus_client import (
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    PlatformCollector,
+    ProcessCollector,
+    generate_latest,
+)
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+from sqlalchemy import event
+
+load_dotenv()
+
+# ===============================
+# Metrics Settings
+# ===============================
+# Prometheus metrics for /metrics. Values are per process: with several
+# uvicorn workers, scrape each one (or run a single worker behind the scraper).
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "1") != "0"
+# How often the event loop is probed for lag
+LOOP_LAG_INTERVAL = float(os.getenv("METRICS_LOOP_LAG_INTERVAL", "0.5"))
+
+# Own registry, so only what is defined here (plus process stats) is exported
+REGISTRY = CollectorRegistry()
+# process_* (CPU, RSS, open fds; Linux only) and python_info
+ProcessCollector(registry=REGISTRY)
+PlatformCollector(registry=REGISTRY)
+
+# Gemini calls run for seconds, not milliseconds
+SLOW_BUCKETS = (0.1, 0.25, 0.5, 1, 2, 3, 5, 8, 13, 20, 30, 45, 60, 90, 120)
+DB_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+LAG_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+
+HTTP_REQUESTS = Counter(
+    "http_requests", "HTTP requests handled", ["method", "route", "status"], registry=REGISTRY
+)
+HTTP_LATENCY = Histogram(
+    "http_request_duration_seconds", "Time to send the full response", ["method", "route"],
+    buckets=SLOW_BUCKETS, registry=REGISTRY,
+)
+HTTP_IN_FLIGHT = Gauge(
+    "http_requests_in_flight", "HTTP requests being handled", ["method"], registry=REGISTRY
+)
+
+GEMINI_LATENCY = Histogram(
+    "gemini_call_duration_seconds", "Wall time of a Gemini stage, including quota waits and retries",
+    ["stage"], buckets=SLOW_BUCKETS, registry=REGISTRY,
+)
+GEMINI_CALLS = Counter(
+    "gemini_calls", "Gemini stage calls by outcome (success or error class)", ["stage", "outcome"],
+    registry=REGISTRY,
+)
+GEMINI_TOKENS = Counter(
+    "gemini_tokens", "Gemini tokens by stage and kind", ["stage", "kind"], registry=REGISTRY
+)
+
+DB_LATENCY = Histogram(
+    "db_query_duration_seconds", "SQL statement execution time", ["engine", "operation"],
+    buckets=DB_BUCKETS, registry=REGISTRY,
+)
+DB_POOL_CHECKED_OUT = Gauge(
+    "db_pool_checked_out", "Connections currently checked out of the pool", ["engine"], registry=REGISTRY
+)
+
+LOOP_LAG = Gauge(
+    "event_loop_lag_seconds", "Latest delay of a scheduled wake-up on the event loop", registry=REGISTRY
+)
+LOOP_LAG_HISTOGRAM = Histogram(
+    "event_loop_lag_distribution_seconds", "Delay of scheduled wake-ups on the event loop",
+    buckets=LAG_BUCKETS, registry=REGISTRY,
+)
+
+JOBS = Gauge("generation_jobs", "Generation jobs by status", ["status"], registry=REGISTRY)
+
+_DB_OPERATIONS = {"SELECT", "INSERT", "UPDATE", "DELETE", "PRAGMA", "BEGIN", "COMMIT", "ROLLBACK", "CREATE", "ALTER"}
+
+_loop_monitor: asyncio.Task | None = None
+
+
+# ===============================
+# HTTP
+# ===============================
+class MetricsMiddleware:
+    """
+    Counts and times every HTTP request by route template (/sheets/{sheet_id},
+    not /sheets/12), so label values stay bounded.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not METRICS_ENABLED:
+            await self.app(scope, receive, send)
+            return
+
+        method = scope["method"]
+        status = 500
+        started = time.perf_counter()
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        HTTP_IN_FLIGHT.labels(method).inc()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            HTTP_IN_FLIGHT.labels(method).dec()
+            # The router stores the matched route in the (shared) scope
+            route = getattr(scope.get("route"), "path", None) or "unmatched"
+            HTTP_REQUESTS.labels(method, route, str(status)).inc()
+            HTTP_LATENCY.labels(method, route).observe(time.perf_counter() - started)
+
+
+# ===============================
+# Gemini
+# ===============================
+def record_gemini_call(usage_log: dict):
+    """Record a successful Gemini stage from its usage log (stage, latency_ms, token counts)."""
+    stage = usage_log.get("stage") or usage_log.get("endpoint") or "unknown"
+    GEMINI_CALLS.labels(stage, "success").inc()
+    if usage_log.get("latency_ms") is not None:
+        GEMINI_LATENCY.labels(stage).observe(usage_log["latency_ms"] / 1000)
+    for kind in ("prompt_tokens", "candidate_tokens", "thoughts_tokens", "image_tokens", "cached_tokens"):
+        if usage_log.get(kind):
+            GEMINI_TOKENS.labels(stage, kind.removesuffix("_tokens")).inc(usage_log[kind])
+
+
+def record_gemini_error(stage: str, error: Exception):
+    GEMINI_CALLS.labels(stage, type(error).__name__).inc()
+
+
+# ===============================
+# Database
+# ===============================
+def _before_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("metrics_query_start", []).append(time.perf_counter())
+
+
+def _make_after_execute(engine_name: str):
+    def _after_execute(conn, cursor, statement, parameters, context, executemany):
+        starts = conn.info.get("metrics_query_start")
+        if not starts:
+            return
+        operation = statement.lstrip().split(None, 1)[0].upper() if statement.strip() else ""
+        DB_LATENCY.labels(engine_name, operation if operation in _DB_OPERATIONS else "OTHER").observe(
+            time.perf_counter() - starts.pop()
+        )
+    return _after_execute
+
+
+def instrument_engine(engine, engine_name: str):
+    """Time every statement run on a (sync) Engine; pass async_engine.sync_engine for the async one."""
+    event.listen(engine, "before_cursor_execute", _before_execute)
+    event.listen(engine, "after_cursor_execute", _make_after_execute(engine_name))
+    DB_POOL_CHECKED_OUT.labels(engine_name).set_function(
+        lambda: engine.pool.checkedout() if hasattr(engine.pool, "checkedout") else 0
+    )
+
+
+# ===============================
+# Event Loop
+# ===============================
+async def _monitor_loop():
+    while True:
+        started = time.perf_counter()
+        await asyncio.sleep(LOOP_LAG_INTERVAL)
+        # Anything past the requested sleep is time the loop spent on other (blocking) work
+        lag = max(0.0, time.perf_counter() - started - LOOP_LAG_INTERVAL)
+        LOOP_LAG.set(lag)
+        LOOP_LAG_HISTOGRAM.observe(lag)
+
+
+def start_metrics():
+    """Start the event-loop lag probe. Called from the FastAPI lifespan."""
+    global _loop_monitor
+    if METRICS_ENABLED and (_loop_monitor is None or _loop_monitor.done()):
+        _loop_monitor = asyncio.create_task(_monitor_loop())
+
+
+async def stop_metrics():
+    global _loop_monitor
+    if _loop_monitor is not None:
+        _loop_monitor.cancel()
+        await asyncio.gather(_loop_monitor, return_exceptions=True)
+        _loop_monitor = None
+
+
+# ===============================
+# Service Stats
+# ===============================
+def _service_snapshot() -> dict:
+    """
+    Copy the services' counters. Call on the event loop: the rate limiter,
+    breakers and context cache keep loop-owned state that is not safe to
+    read from a worker thread.
+    """
+    # Imported here: the services import this module for record_gemini_*
+    from services.gemini_context_cache import context_cache_stats
+    from services.gemini_retry import retry_stats
+    from services.job_service import _stats as job_counters
+    from services.pdf_service import pdf_stats
+    from services.rate_limiter import rate_limiter_stats
+    from services.usage_service import usage_queue_stats
+    from utils.image import image_stats
+
+    return {
+        "context": context_cache_stats(),
+        "pdf": pdf_stats(),
+        "image": image_stats(),
+        "keys": list(rate_limiter_stats()["keys"].values()),
+        "retry": retry_stats(),
+        "usage": usage_queue_stats(),
+        "jobs": dict(job_counters),
+    }
+
+
+class _StatsCollector:
+    """Exports the snapshot render_metrics() took of the services' own counters."""
+
+    def __init__(self):
+        self.snapshot: dict | None = None
+
+    def collect(self):
+        snapshot = self.snapshot
+        if snapshot is None:
+            return
+
+        cache = snapshot["cache"]
+        lookups = CounterMetricFamily("gemini_response_cache_lookups", "Gemini response cache lookups", labels=["result"])
+        lookups.add_metric(["hit"], cache["hits"])
+        lookups.add_metric(["miss"], cache["misses"])
+        yield lookups
+        yield GaugeMetricFamily("gemini_response_cache_hit_ratio", "Gemini response cache hit ratio", value=cache["hit_rate"])
+        if "size_bytes" in cache:
+            yield GaugeMetricFamily("gemini_response_cache_size_bytes", "Gemini response cache size", value=cache["size_bytes"])
+
+        context = snapshot["context"]
+        yield CounterMetricFamily("gemini_context_cache_hits", "Requests sent with a cached context", value=context["hits"])
+        yield CounterMetricFamily("gemini_context_cache_create_failures", "Failed context cache creates", value=context["create_failures"])
+        yield GaugeMetricFamily("gemini_context_cache_active", "Live context caches", value=context["active"])
+
+        pdf = snapshot["pdf"]
+        pdfs = CounterMetricFamily("pdf_requests", "Rationale PDFs served", labels=["result"])
+        pdfs.add_metric(["cache_hit"], pdf["cache_hits"])
+        pdfs.add_metric(["rendered"], pdf["renders"])
+        yield pdfs
+
+        image = snapshot["image"]
+        images = CounterMetricFamily("image_preprocess", "Chart images preprocessed", labels=["result"])
+        for result in ("resized", "reencoded", "kept_original", "failed"):
+            images.add_metric([result], image[result])
+        yield images
+        image_bytes = CounterMetricFamily("image_preprocess_bytes", "Chart image bytes before and after preprocessing", labels=["direction"])
+        image_bytes.add_metric(["in"], image["bytes_in"])
+        image_bytes.add_metric(["out"], image["bytes_out"])
+        yield image_bytes
+
+        keys = snapshot["keys"]
+        yield GaugeMetricFamily("gemini_queued", "Gemini calls waiting for a slot or quota", value=sum(k["queued"] for k in keys))
+        yield GaugeMetricFamily("gemini_in_flight", "Gemini calls in flight", value=sum(k["in_flight"] for k in keys))
+        yield CounterMetricFamily("gemini_rate_limit_timeouts", "Gemini calls that gave up waiting for quota", value=sum(k["timeouts"] for k in keys))
+
+        retry = snapshot["retry"]
+        for name in ("retries", "hedges", "hedge_wins", "breaker_rejections"):
+            yield CounterMetricFamily(f"gemini_{name}", f"Gemini {name.replace('_', ' ')}", value=retry[name])
+        yield GaugeMetricFamily(
+            "gemini_breakers_open", "API keys whose circuit breaker is not closed",
+            value=sum(1 for breaker in retry["breakers"].values() if breaker["state"] != "closed"),
+        )
+
+        usage = snapshot["usage"]
+        yield GaugeMetricFamily("usage_queue_depth", "Usage rows waiting to be written", value=usage["queued"])
+        usage_rows = CounterMetricFamily("usage_rows", "Usage rows by outcome", labels=["outcome"])
+        usage_rows.add_metric(["written"], usage["written"])
+        usage_rows.add_metric(["dropped"], usage["dropped"])
+        yield usage_rows
+
+        jobs = CounterMetricFamily("generation_job_attempts", "Generation job attempts by outcome", labels=["outcome"])
+        for outcome in ("succeeded", "failed", "retried"):
+            jobs.add_metric([outcome], snapshot["jobs"][outcome])
+        yield jobs
+
+
+_stats_collector = _StatsCollector()
+REGISTRY.register(_stats_collector)
+
+
+async def render_metrics() -> bytes:
+    """Prometheus text exposition of every metric above."""
+    from services.job_service import job_stats
+    from services.response_cache import cache_stats
+
+    try:
+        for status, count in (await job_stats())["jobs"].items():
+            JOBS.labels(status).set(count)
+    except Exception as e:
+        print("METRICS JOB STATS FAILED:", e)
+    # Only the response cache stats block (they read SQLite), so only they go to a thread
+    cache = await asyncio.to_thread(cache_stats)
+    snapshot = _service_snapshot()
+    snapshot["cache"] = cache
+    # No await from here on, so concurrent scrapes cannot swap the snapshot mid-render
+    _stats_collector.snapshot = snapshot
+    return generate_latest(REGISTRY)
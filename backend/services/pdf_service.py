@@ -0,0 +1,736 @@
+import hashlib
+import io
+import json
+import os
+import re
+import time
+import zipfile
+import asyncio
+from collections import deque
+from datetime import date
+from typing import AsyncIterator, Callable
+from dotenv import load_dotenv
+from utils.blob_store import BLOB_DIR, write_atomic
+
+load_dotenv()
+
+# ===============================
+# PDF Settings
+# ===============================
+# Rendered PDFs are cached on disk under a hash of everything that goes into them
+PDF_CACHE_ENABLED = os.getenv("PDF_CACHE_ENABLED", "1") != "0"
+PDF_CACHE_DIR = os.getenv("PDF_CACHE_DIR", os.path.join(BLOB_DIR, "pdf"))
+# Bump when the layout changes so cached PDFs are re-rendered
+PDF_RENDER_VERSION = 1
+# PDFs rendered ahead of the one being written into a ZIP export
+EXPORT_RENDER_CONCURRENCY = int(os.getenv("EXPORT_RENDER_CONCURRENCY", "4"))
+
+# Same templates as rationale_gen/frontend/src/App.jsx (header and footer are always first / last)
+TEMPLATES = {
+    "classic": {"component_order": ["technicalCommentary", "tradingDetails", "chart", "disclaimer"]},
+    "blue": {"component_order": ["technicalCommentary", "tradingDetails", "chart", "disclaimer"]},
+    "green": {"component_order": ["technicalCommentary", "tradingDetails", "chart", "disclaimer"]},
+}
+
+PAGE_WIDTH = 400
+MARGIN = 15
+FOOTER_HEIGHT = 56
+HEADER_HEIGHT = 28
+TRADING_DETAILS_HEIGHT = 28
+MAX_KEY_POINTS = 6
+DISCLAIMER_MARGIN = 5
+DISCLAIMER_WEBSITE = "https://chartntrade.com/research-disclaimer"
+
+_PT_PER_MM = 72 / 25.4
+# jsPDF's default line height factor
+_LINE_HEIGHT_FACTOR = 1.15
+
+_FONTS = {
+    ("helvetica", "normal"): "Helvetica",
+    ("helvetica", "bold"): "Helvetica-Bold",
+    ("helvetica", "italic"): "Helvetica-Oblique",
+    ("helvetica", "bolditalic"): "Helvetica-BoldOblique",
+    ("times", "normal"): "Times-Roman",
+    ("times", "bold"): "Times-Bold",
+    ("times", "italic"): "Times-Italic",
+    ("times", "bolditalic"): "Times-BoldItalic",
+}
+
+_INVALID_VALUES = {"", "-", "0", "0.0", "0.00", "na", "n/a", "nil", "none", "null", "undefined"}
+_MONTHS = ["JAN", "FEB", "MAR", "APR", "MAY", "JUN", "JUL", "AUG", "SEP", "OCT", "NOV", "DEC"]
+_MARKDOWN_RE = re.compile(r"\*\*(.+?)\*\*|__(.+?)__|\*([^*]+)\*")
+
+_stats = {"renders": 0, "cache_hits": 0}
+
+
+# ===============================
+# Trade Data (port of helpers.js)
+# ===============================
+def _string_value(value) -> str:
+    return "" if value is None else str(value).strip()
+
+
+def _valid_value(value) -> str:
+    text = _string_value(value)
+    return "" if text.lower() in _INVALID_VALUES else text
+
+
+def _first(row: dict, *keys):
+    # Mirrors `a || b || c` in the frontend: the first truthy value wins
+    for key in keys:
+        if row.get(key):
+            return row[key]
+    return ""
+
+
+def get_trading_data(row: dict) -> dict:
+    """Entry, targets, stoploss etc. from an uploaded sheet row, as the PDF shows them."""
+    raw_plan = _string_value(_first(row, "planType", "PlanType", "plan_type", "Segment", "segment") or "Equity")
+    plan_type = raw_plan[:1].upper() + raw_plan[1:].lower()
+    plan_lower = plan_type.lower()
+    show_strike = plan_lower == "options"
+    show_option_type = plan_lower == "options"
+    show_expiry = plan_lower in ("options", "commodity", "derivatives")
+
+    return {
+        "tradingName": _valid_value(_first(row, "TradingName", "tradingName", "Trading Name", "Script Name", "Trade Name", "script")),
+        "tradeDate": _valid_value(_first(row, "Date", "date", "Trade Date", "tradeDate", "trade_date")),
+        "cmp": _valid_value(_first(row, "CMP", "cmp", "Current Market Price", "Current Price")),
+        "entrylevel": _valid_value(_first(
+            row, "entrylevel", "EntryLevel", "entry_level", "Entry Level", "entryPrice", "EntryPrice", "entry_price", "Entry Price"
+        )),
+        "target1": _valid_value(_first(row, "target1", "Target1", "target_1", "Target 1")),
+        "target2": _valid_value(_first(row, "target2", "Target2", "target_2", "Target 2")),
+        "target3": _valid_value(_first(row, "target3", "Target3", "target_3", "Target 3")),
+        "stoploss": _valid_value(_first(row, "stoploss", "StopLoss", "stop_loss", "Stop Loss", "Stop-Loss")),
+        "recommendation": _string_value(
+            _first(row, "recommendation", "Recommendation", "Trade Type", "action", "Action") or "OUTLOOK"
+        ).upper(),
+        "planType": plan_type,
+        "strikePrice": _valid_value(_first(row, "strikePrice", "StrikePrice", "Strike Price", "strikeprice")) if show_strike else "",
+        "expiryDate": _valid_value(_first(row, "expiryDate", "ExpiryDate", "Expiry Date", "expirydate")) if show_expiry else "",
+        "optionType": _valid_value(
+            _first(row, "optionType", "OptionType", "Option Type", "Options Type", "optiontype")
+        ) if show_option_type else "",
+    }
+
+
+def extract_key_points(rationale: str) -> list[str]:
+    """Fallback key points when the rationale has none saved (same as the frontend)."""
+    points = []
+    macd = re.search(r"MACD[^•\n]*", rationale, re.IGNORECASE)
+    rsi = re.search(r"RSI[^•\n]*", rationale, re.IGNORECASE)
+    if macd:
+        points.append("MACD: " + re.sub(r"^MACD[:\s]+", "", macd.group(0), flags=re.IGNORECASE).strip())
+    if rsi:
+        points.append("RSI: " + re.sub(r"^RSI[:\s]+", "", rsi.group(0), flags=re.IGNORECASE).strip())
+    if not points:
+        points.append("MACD: Bearish crossover with histogram turning red, indicating momentum shift in favor of sellers.")
+        points.append("RSI: Gradual decline from overbought territory, showing reduced buying strength and potential for further downside.")
+    return points
+
+
+def get_pdf_file_name(trading_data: dict, header_date: str) -> str:
+    date_str = (trading_data.get("tradeDate") or header_date or date.today().isoformat())
+    date_str = str(date_str).replace("/", "-").replace(".", "-")
+    trade_name = str(trading_data.get("tradingName") or "").strip()
+    if trade_name:
+        safe_name = re.sub(r'[/\\?%*:|"<>]', "_", trade_name)
+        return f"{safe_name}_{date_str}.pdf"
+    return f"Analysis_{date_str}.pdf"
+
+
+def _disclaimer_text(disclaimer: str) -> str:
+    base = disclaimer or (
+        "Investments in Securities market are subject to market risks. Read all the related documents "
+        "carefully before investing. For complete disclaimer and disclosure, please refer to the website: "
+        + DISCLAIMER_WEBSITE
+    )
+    if "http" in base:
+        return base
+    return f"{base}\n\nFor complete disclaimer and disclosure, please refer to: {DISCLAIMER_WEBSITE}"
+
+
+def _parse_markdown(text: str) -> list[dict]:
+    """Split **bold**, __underline__ and *italic* runs (port of parseMarkdownFormat)."""
+    parts = []
+    last = 0
+    for match in _MARKDOWN_RE.finditer(text):
+        if match.start() > last:
+            parts.append({"text": text[last:match.start()], "bold": False, "italic": False, "underline": False})
+        parts.append({
+            "text": match.group(1) or match.group(2) or match.group(3),
+            "bold": match.group(1) is not None,
+            "underline": match.group(2) is not None,
+            "italic": match.group(3) is not None,
+        })
+        last = match.end()
+    if last < len(text):
+        parts.append({"text": text[last:], "bold": False, "italic": False, "underline": False})
+    if not parts:
+        parts.append({"text": text, "bold": False, "italic": False, "underline": False})
+
+    for part in parts:
+        if not (part["bold"] or part["italic"] or part["underline"]):
+            # Drop orphan markers that would otherwise print literally
+            part["text"] = re.sub(r"(?<!\*)\*(?!\*)", "", part["text"].replace("**", "").replace("__", ""))
+    return parts
+
+
+def _words(line: str) -> list[dict]:
+    words = []
+    for part in _parse_markdown(line):
+        for word in re.split(r"(\s+)", part["text"]):
+            if word:
+                words.append({**part, "text": word})
+    return words
+
+
+# ===============================
+# Drawing (jsPDF-style: mm, y grows downward)
+# ===============================
+class _Doc:
+    def __init__(self, width: float, height: float):
+        from reportlab.pdfgen import canvas
+
+        self.width = width
+        self.height = height
+        self.buffer = io.BytesIO()
+        self.canvas = canvas.Canvas(self.buffer, pagesize=(width * _PT_PER_MM, height * _PT_PER_MM))
+        self.font = "Helvetica"
+        self.size = 16
+
+    def set_font(self, family: str, style: str = "normal", size: float | None = None):
+        self.font = _FONTS[(family, style)]
+        if size is not None:
+            self.size = size
+        self.canvas.setFont(self.font, self.size)
+
+    def set_color(self, rgb: tuple):
+        self.canvas.setFillColorRGB(*(c / 255 for c in rgb))
+
+    def text_width(self, text: str) -> float:
+        from reportlab.pdfbase.pdfmetrics import stringWidth
+
+        return stringWidth(text, self.font, self.size) / _PT_PER_MM
+
+    def line_height(self) -> float:
+        return self.size * _LINE_HEIGHT_FACTOR / _PT_PER_MM
+
+    def split(self, text: str, max_width: float) -> list[str]:
+        """Word-wrap like jsPDF's splitTextToSize."""
+        from reportlab.lib.utils import simpleSplit
+
+        lines = []
+        for paragraph in text.split("\n"):
+            lines.extend(simpleSplit(paragraph, self.font, self.size, max_width * _PT_PER_MM) or [""])
+        return lines
+
+    def text(self, text, x: float, y: float, align: str = "left"):
+        lines = text if isinstance(text, list) else [text]
+        for i, line in enumerate(lines):
+            baseline = (self.height - y - i * self.line_height()) * _PT_PER_MM
+            if align == "center":
+                self.canvas.drawCentredString(x * _PT_PER_MM, baseline, line)
+            elif align == "right":
+                self.canvas.drawRightString(x * _PT_PER_MM, baseline, line)
+            else:
+                self.canvas.drawString(x * _PT_PER_MM, baseline, line)
+
+    def rect(self, x: float, y: float, w: float, h: float, rgb: tuple, radius: float = 0):
+        self.set_color(rgb)
+        bottom = (self.height - y - h) * _PT_PER_MM
+        if radius:
+            self.canvas.roundRect(x * _PT_PER_MM, bottom, w * _PT_PER_MM, h * _PT_PER_MM, radius * _PT_PER_MM, stroke=0, fill=1)
+        else:
+            self.canvas.rect(x * _PT_PER_MM, bottom, w * _PT_PER_MM, h * _PT_PER_MM, stroke=0, fill=1)
+
+    def underline(self, x: float, y: float, w: float):
+        self.canvas.setStrokeColorRGB(0, 0, 0)
+        self.canvas.setLineWidth(0.1 * _PT_PER_MM)
+        self.canvas.line(x * _PT_PER_MM, (self.height - y) * _PT_PER_MM, (x + w) * _PT_PER_MM, (self.height - y) * _PT_PER_MM)
+
+    def image(self, reader, x: float, y: float, w: float, h: float):
+        self.canvas.drawImage(reader, x * _PT_PER_MM, (self.height - y - h) * _PT_PER_MM, w * _PT_PER_MM, h * _PT_PER_MM)
+
+    def output(self) -> bytes:
+        self.canvas.showPage()
+        self.canvas.save()
+        return self.buffer.getvalue()
+
+
+def _hex_to_rgb(value: str) -> tuple:
+    match = re.fullmatch(r"#?([0-9a-f]{2})([0-9a-f]{2})([0-9a-f]{2})", value or "", re.IGNORECASE)
+    return tuple(int(g, 16) for g in match.groups()) if match else (245, 245, 245)
+
+
+def _chart_size(image_size: tuple, content_width: float) -> tuple[float, float]:
+    ratio = image_size[0] / image_size[1]
+    chart_width = content_width * 0.65
+    chart_height = chart_width / ratio
+    if chart_height > 90:
+        chart_height = 90
+        chart_width = chart_height * ratio
+    return chart_width, chart_height
+
+
+def _clean_key_point(point) -> str:
+    return re.sub(r"^\W+", "", str(point or "").strip())
+
+
+# ===============================
+# Page Height
+# ===============================
+def _commentary_height(doc: _Doc, rationale: str, max_width: float, font_size: float = 17) -> float:
+    if not rationale.strip():
+        return 0
+    doc.set_font("helvetica", "bold", font_size)
+    height = 0
+    for line in rationale.split("\n"):
+        if not line.strip():
+            height += font_size * 0.1
+            continue
+        height += len(doc.split(line.replace("**", ""), max_width - 2)) * font_size * 0.5
+    return height + 10
+
+
+def _disclaimer_height(doc: _Doc, disclaimer: str) -> float:
+    doc.set_font("times", "italic", 17)
+    lines = doc.split(_disclaimer_text(disclaimer), PAGE_WIDTH - 2 * DISCLAIMER_MARGIN)
+    return len(lines) * doc.line_height() + 15
+
+
+def _chart_height(doc: _Doc, image_size: tuple | None, key_points: list[str]) -> float:
+    if not image_size:
+        return 0
+    content_width = PAGE_WIDTH - 2 * MARGIN
+    chart_width, chart_height = _chart_size(image_size, content_width)
+    points = [p for p in key_points if p is not None and str(p).strip()]
+    if not points:
+        return chart_height + 10
+
+    doc.set_font("helvetica", "normal", 9)
+    box_height = 10
+    for point in points[:MAX_KEY_POINTS]:
+        clean = _clean_key_point(point)
+        if clean:
+            box_height += len(doc.split("• " + clean, content_width - chart_width - 10 - 8)) * 4 + 1
+    return max(chart_height, box_height + 4) + 10
+
+
+def _page_height(doc: _Doc, content: dict) -> float:
+    height = HEADER_HEIGHT
+    for component in content["component_order"]:
+        if component == "chart":
+            height += _chart_height(doc, content["image_size"], content["key_points"])
+        elif component == "tradingDetails":
+            height += TRADING_DETAILS_HEIGHT
+        elif component == "technicalCommentary":
+            height += _commentary_height(doc, content["rationale"], PAGE_WIDTH - 2 * MARGIN)
+        elif component == "disclaimer":
+            height += _disclaimer_height(doc, content["options"]["disclaimer"])
+    return max(height + FOOTER_HEIGHT + 10, 290) + 50
+
+
+# ===============================
+# Components
+# ===============================
+def _render_header(doc: _Doc, content: dict, y: float) -> float:
+    options = content["options"]
+    doc.rect(0, y, doc.width, 65, (255, 255, 255))
+
+    doc.set_font("times", "bold", 30)
+    doc.set_color((0, 0, 0))
+    doc.text(options["ra_name"] or "TRADE ANALYSIS", 5, y + 10)
+
+    doc.set_font("helvetica", "bold", 18)
+    if options["sebi_registration"].strip():
+        doc.text(f"SEBI Registered Research Analyst- {options['sebi_registration']}", doc.width - MARGIN, y + 8, "right")
+    if options["bse_enlistment"].strip():
+        doc.text(f"BSE ENLISTMENT NO- {options['bse_enlistment']}", doc.width - MARGIN, y + 18, "right")
+
+    row_y = y + 18
+
+    # Recommendation pill
+    recommendation = content["trading_data"].get("recommendation") or "BUY"
+    doc.set_font("helvetica", "bold", 16)
+    pill_width = max(20, doc.text_width(recommendation) + 8)
+    doc.rect(MARGIN, row_y - 6.5, pill_width, 9, (34, 197, 94), radius=4.5)
+    doc.set_color((255, 255, 255))
+    doc.text(recommendation, MARGIN + pill_width / 2, row_y, "center")
+
+    # Date box beside it
+    header_date = content["header_date"]
+    if header_date.strip():
+        if re.fullmatch(r"\d{4}-\d{2}-\d{2}", header_date):
+            parsed = date.fromisoformat(header_date)
+            header_date = f"{parsed.day} {_MONTHS[parsed.month - 1]} {parsed.year}"
+        date_text = f"Date: {header_date}"
+        date_x = MARGIN + pill_width + 5
+        date_width = doc.text_width(date_text) + 8
+        doc.rect(date_x, row_y - 4, date_width, 7, (255, 250, 230), radius=3)
+        doc.set_color((0, 0, 0))
+        doc.text(date_text, date_x + date_width / 2, row_y, "center")
+
+    doc.set_font("helvetica", "bold", 24)
+    doc.set_color((53, 4, 65))
+    doc.text("Technical Commentary", doc.width / 2, row_y, "center")
+    return row_y + 10
+
+
+def _render_chart(doc: _Doc, content: dict, y: float) -> float:
+    reader = content["image_reader"]
+    if reader is None:
+        return y
+    content_width = doc.width - 2 * MARGIN
+    chart_width, chart_height = _chart_size(content["image_size"], content_width)
+    doc.image(reader, MARGIN, y, chart_width, chart_height)
+
+    points = [p for p in content["key_points"] if p is not None and str(p).strip()][:MAX_KEY_POINTS]
+    if points:
+        box_x = MARGIN + chart_width + 10
+        box_width = content_width - chart_width - 10
+        max_text_width = box_width - 8
+
+        doc.set_font("helvetica", "normal", 9)
+        box_height = 10
+        for point in points:
+            clean = _clean_key_point(point)
+            if clean:
+                box_height += len(doc.split("• " + clean, max_text_width)) * 4 + 1
+        box_height += 12
+        doc.rect(box_x, y, box_width, box_height, (230, 240, 255), radius=2)
+
+        doc.set_font("helvetica", "bold", 16)
+        doc.set_color((0, 0, 0))
+        doc.text("Key Points", box_x + 4, y + 6)
+
+        doc.set_font("helvetica", "bold", 14)
+        text_y = y + 12
+        for point in points:
+            clean = _clean_key_point(point)
+            if not clean:
+                continue
+            lines = doc.split("• " + clean, max_text_width)
+            doc.text(lines, box_x + 4, text_y)
+            text_y += len(lines) * 4 + 3
+
+    return y + chart_height + 10
+
+
+def _render_trading_details(doc: _Doc, content: dict, y: float) -> float:
+    data = content["trading_data"]
+    is_options = (data.get("planType") or "").lower() == "options"
+    labels = []
+    if data["tradingName"]:
+        labels.append(f"Trade Name: {data['tradingName']}")
+    if data["planType"]:
+        labels.append(f"Segment: {data['planType']}")
+    if data["strikePrice"]:
+        strike = f"{data['strikePrice']}{data['optionType']}" if is_options and data["optionType"] else data["strikePrice"]
+        labels.append(f"Strike Price: {strike}")
+    if data["expiryDate"]:
+        labels.append(f"Expiry Date: {data['expiryDate']}")
+    if data["optionType"] and not is_options:
+        labels.append(f"Option Type: {data['optionType']}")
+    if data["entrylevel"]:
+        labels.append(f"Entry: {data['entrylevel']}")
+    targets = [t for t in (data["target1"], data["target2"], data["target3"]) if t]
+    if targets:
+        labels.append(f"Targets: {'-'.join(targets)}")
+    if data["stoploss"]:
+        labels.append(f"Stoploss: {data['stoploss']}")
+
+    doc.set_font("helvetica", "bold", 14)
+    max_x = doc.width - MARGIN
+    x = MARGIN
+    box_y = y + 2
+    for label in labels:
+        # Wrap to the next row rather than run off the page
+        if x + doc.text_width(label) + 8 > max_x and x > MARGIN:
+            x = MARGIN
+            box_y += 12
+        width = doc.text_width(label) + 8
+        available = max_x - x - 8
+        if width > max_x - x and available > 15:
+            while len(label) > 1 and doc.text_width(label) + doc.text_width("…") > available:
+                label = label[:-1]
+            label += "…"
+            width = doc.text_width(label) + 8
+        width = min(width, max_x - x)
+        doc.rect(x, box_y, width, 8, (200, 220, 255), radius=1)
+        doc.set_color((0, 0, 0))
+        doc.text(label, x + 4, box_y + 6)
+        x += width + 6
+
+    return box_y + 16
+
+
+def _render_words(doc: _Doc, line: str, family: str, plain_style: str, x: float, y: float,
+                  end_x: float, line_height: float, wrap_at_start: bool) -> float:
+    current_x = x
+    for word in _words(line):
+        if word["bold"] and word["italic"]:
+            style = "bolditalic"
+        elif word["bold"]:
+            style = "bold"
+        elif word["italic"]:
+            style = "italic"
+        else:
+            style = plain_style
+        doc.set_font(family, style)
+        width = doc.text_width(word["text"])
+        if current_x + width > end_x and (wrap_at_start or current_x > x):
+            y += line_height
+            current_x = x
+            if not word["text"].strip():
+                continue
+        doc.text(word["text"], current_x, y)
+        if word["underline"]:
+            doc.underline(current_x, y + line_height * 0.15, width)
+        current_x += width
+    return y
+
+
+def _render_commentary(doc: _Doc, content: dict, y: float) -> float:
+    rationale = content["rationale"]
+    if not rationale.strip():
+        return y
+    max_width = doc.width - 2 * MARGIN
+    available = doc.height - FOOTER_HEIGHT - y - content["disclaimer_height"] - 10
+
+    def text_height(font_size: float) -> float:
+        doc.set_font("helvetica", "bold", font_size)
+        height = 0
+        for line in rationale.split("\n"):
+            if not line.strip():
+                height += font_size * 0.2
+                continue
+            clean = "".join(p["text"] for p in _parse_markdown(line))
+            height += len(doc.split(clean, max_width)) * font_size * 0.5
+        return height
+
+    # Shrink the text (down to 14pt) so the disclaimer still fits
+    font_size = 18
+    while text_height(font_size) > available and font_size > 14:
+        font_size -= 0.5
+
+    doc.set_font("helvetica", "bold", font_size)
+    doc.set_color((0, 0, 0))
+    line_height = font_size * 0.5
+    for line in rationale.split("\n"):
+        if not line.strip():
+            y += font_size * 0.1
+            continue
+        y = _render_words(doc, line, "helvetica", "bold", MARGIN, y, MARGIN + max_width, line_height, True)
+        y += line_height
+    return y + 5
+
+
+def _render_disclaimer(doc: _Doc, content: dict, y: float) -> float:
+    y += 12
+    doc.set_font("times", "normal", 17)
+    doc.set_color((0, 0, 0))
+    line_height = doc.line_height() * 1.2
+    end_x = DISCLAIMER_MARGIN + doc.width - 2 * DISCLAIMER_MARGIN
+    for line in _disclaimer_text(content["options"]["disclaimer"]).split("\n"):
+        if not line.strip():
+            y += line_height * 0.5
+            continue
+        y = _render_words(doc, line, "times", "normal", DISCLAIMER_MARGIN, y, end_x, line_height, False)
+        y += line_height
+    return y + 5
+
+
+def _render_footer(doc: _Doc, content: dict):
+    options = content["options"]
+    footer_y = doc.height - FOOTER_HEIGHT
+    doc.rect(0, footer_y, doc.width, FOOTER_HEIGHT, _hex_to_rgb(options["footer_background_color"]))
+
+    y = footer_y + 10
+    doc.set_font("helvetica", "normal", 20)
+    doc.set_color((0, 0, 0))
+    # The frontend's icon images are not available here; use its text-label fallback
+    contact = [
+        f"{label}: {value}"
+        for label, value in (("Phone", options["footer_contact"]), ("Web", options["footer_website"]), ("Email", options["footer_email"]))
+        if value.strip()
+    ]
+    if contact:
+        doc.text(" | ".join(contact), MARGIN, y)
+        y += 18
+    if options["footer_address"].strip():
+        doc.text(doc.split(f"Address: {options['footer_address']}", doc.width * 0.6), MARGIN, y)
+
+    doc.set_font("helvetica", "bold", 22)
+    doc.text("Signature", doc.width - MARGIN, footer_y + 8, "right")
+    doc.set_font("helvetica", "bold", 12)
+    doc.text((options["signature"] or options["ra_name"] or "Signature").upper(), doc.width - MARGIN, footer_y + 16, "right")
+    if options["signature_date"].strip():
+        doc.set_font("helvetica", "normal", 10)
+        doc.text(options["signature_date"], doc.width - MARGIN, footer_y + 24, "right")
+
+
+_COMPONENTS = {
+    "chart": _render_chart,
+    "tradingDetails": _render_trading_details,
+    "technicalCommentary": _render_commentary,
+    "disclaimer": _render_disclaimer,
+}
+
+
+# ===============================
+# Public API
+# ===============================
+def build_pdf_content(row: dict, rationale, options: dict) -> dict:
+    """
+    Everything a row's PDF depends on. The rendered PDF is a pure function
+    of this dict (plus the chart bytes, identified by image_id).
+    """
+    rationale_text = rationale.editable_rationale or rationale.rationale_text or ""
+    output = (rationale.rationale_result or {}).get("output") or {}
+    key_points = output.get("key_points")
+    if not isinstance(key_points, list) or not key_points:
+        key_points = extract_key_points(rationale_text)
+
+    image_id = rationale.image_hash
+    if not image_id and rationale.image_preview:
+        # Legacy rows keep the chart inline rather than in the blob store
+        image_id = hashlib.sha256(rationale.image_preview.encode("utf-8")).hexdigest()
+
+    row_date = _string_value(_first(row, "Date", "date", "Trade Date", "tradeDate"))
+    template = TEMPLATES.get(options.get("template"), TEMPLATES["classic"])
+    return {
+        "trading_data": get_trading_data(row),
+        "rationale": rationale_text,
+        "key_points": [str(p) for p in key_points],
+        "header_date": options.get("header_date") or row_date or date.today().isoformat(),
+        "component_order": template["component_order"],
+        "image_id": image_id,
+        "options": options,
+    }
+
+
+def pdf_cache_key(content: dict) -> str:
+    payload = json.dumps(content, sort_keys=True, default=str)
+    return hashlib.sha256(f"v{PDF_RENDER_VERSION}:{payload}".encode("utf-8")).hexdigest()
+
+
+def render_pdf(content: dict, image_data: bytes | None) -> bytes:
+    """Render one rationale PDF (port of the frontend's exportToPDFWithData). CPU-bound."""
+    from reportlab.lib.utils import ImageReader
+
+    content = dict(content)
+    content["image_reader"] = None
+    content["image_size"] = None
+    if image_data:
+        try:
+            reader = ImageReader(io.BytesIO(image_data))
+            content["image_reader"] = reader
+            content["image_size"] = reader.getSize()
+        except Exception as e:
+            print("PDF CHART IMAGE UNREADABLE:", e)
+
+    measure = _Doc(PAGE_WIDTH, 800)
+    doc = _Doc(PAGE_WIDTH, _page_height(measure, content))
+    content["disclaimer_height"] = _disclaimer_height(measure, content["options"]["disclaimer"])
+
+    y = _render_header(doc, content, 0)
+    for component in content["component_order"]:
+        y = _COMPONENTS[component](doc, content, y)
+    _render_footer(doc, content)
+    _stats["renders"] += 1
+    return doc.output()
+
+
+def _cache_path(key: str) -> str:
+    return os.path.join(PDF_CACHE_DIR, key[:2], f"{key}.pdf")
+
+
+def get_or_render_pdf(content: dict, load_image: Callable[[], bytes | None]) -> tuple[bytes, str]:
+    """
+    Return (pdf_bytes, cache_key), rendering only when this exact content has
+    not been rendered before. load_image() is only called on a cache miss.
+    """
+    key = pdf_cache_key(content)
+    path = _cache_path(key)
+    if PDF_CACHE_ENABLED and os.path.exists(path):
+        with open(path, "rb") as f:
+            _stats["cache_hits"] += 1
+            return f.read(), key
+
+    pdf = render_pdf(content, load_image() if content["image_id"] else None)
+    if PDF_CACHE_ENABLED:
+        try:
+            write_atomic(path, pdf)
+        except OSError as e:
+            print("PDF CACHE WRITE FAILED:", e)
+    return pdf, key
+
+
+class _ChunkBuffer(io.RawIOBase):
+    """Write-only, non-seekable sink; zipfile then streams entries with data descriptors."""
+
+    def __init__(self):
+        self.chunks = []
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def take(self) -> bytes:
+        data = b"".join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def _unique_name(file_name: str, used: set) -> str:
+    stem, ext = os.path.splitext(file_name)
+    name, n = file_name, 1
+    while name in used:
+        n += 1
+        name = f"{stem} ({n}){ext}"
+    used.add(name)
+    return name
+
+
+async def stream_pdf_zip(documents: AsyncIterator[tuple[str, dict, Callable]]) -> AsyncIterator[bytes]:
+    """
+    Yield a ZIP of rendered PDFs piece by piece. documents yields
+    (file_name, content, load_image). Up to EXPORT_RENDER_CONCURRENCY PDFs
+    render ahead in worker threads; each is written out and dropped as soon
+    as its turn comes, so memory is bounded regardless of sheet size.
+    """
+    buffer = _ChunkBuffer()
+    # PDFs are already compressed; storing them keeps the export fast
+    archive = zipfile.ZipFile(buffer, mode="w", compression=zipfile.ZIP_STORED)
+    pending = deque()
+    used_names = set()
+
+    def write(name: str, pdf: bytes) -> bytes:
+        info = zipfile.ZipInfo(_unique_name(name, used_names), date_time=time.localtime()[:6])
+        archive.writestr(info, pdf)
+        return buffer.take()
+
+    try:
+        async for file_name, content, load_image in documents:
+            pending.append((file_name, asyncio.create_task(asyncio.to_thread(get_or_render_pdf, content, load_image))))
+            if len(pending) >= max(1, EXPORT_RENDER_CONCURRENCY):
+                name, task = pending.popleft()
+                yield write(name, (await task)[0])
+        while pending:
+            name, task = pending.popleft()
+            yield write(name, (await task)[0])
+        archive.close()
+        yield buffer.take()
+    finally:
+        # Client went away mid-export
+        for _, task in pending:
+            task.cancel()
+
+
+def pdf_stats() -> dict:
+    return {**_stats, "cache_enabled": PDF_CACHE_ENABLED}
@@ -0,0 +1,213 @@
+import asyncio
+import hashlib
+import os
+import time
+from contextlib import asynccontextmanager
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# ===============================
+# Per-Key Quota Settings
+# ===============================
+# Each client brings their own X-GEMINI-API-KEY, so limits apply per key.
+# 0 disables the RPM / TPM bucket.
+MAX_CONCURRENCY_PER_KEY = int(os.getenv("GEMINI_MAX_CONCURRENCY_PER_KEY", "8"))
+RPM_LIMIT = int(os.getenv("GEMINI_RPM_LIMIT", "0"))
+TPM_LIMIT = int(os.getenv("GEMINI_TPM_LIMIT", "0"))
+# Calls waiting longer than this for a slot fail instead of queueing forever
+MAX_QUEUE_WAIT = float(os.getenv("GEMINI_MAX_QUEUE_WAIT", "120"))
+
+# Gemini bills an inline image at a flat 258 tokens (up to 384px per side; larger images are tiled)
+IMAGE_TOKEN_ESTIMATE = 258
+
+
+class _Bucket:
+    """Token bucket refilled continuously at capacity-per-minute."""
+
+    def __init__(self, per_minute: int):
+        self.capacity = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.level = float(per_minute)
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount: float) -> float:
+        """Seconds until `amount` is available (0 if it is available now)."""
+        self._refill()
+        # A single request bigger than the whole bucket only waits for a full bucket
+        needed = min(amount, self.capacity) - self.level
+        return max(0.0, needed / self.rate)
+
+    def take(self, amount: float):
+        self._refill()
+        self.level -= amount
+
+    def give_back(self, amount: float):
+        self._refill()
+        self.level = min(self.capacity, self.level + amount)
+
+    def available(self) -> float:
+        """Current level, refilled on paper only; stats reads never change the bucket."""
+        elapsed = time.monotonic() - self.updated
+        return round(min(self.capacity, self.level + elapsed * self.rate), 2)
+
+
+class _KeyState:
+    def __init__(self):
+        self.semaphore = asyncio.Semaphore(max(1, MAX_CONCURRENCY_PER_KEY))
+        # asyncio.Lock wakes waiters in FIFO order, so queued calls are served in arrival order
+        self.lock = asyncio.Lock()
+        self.requests = _Bucket(RPM_LIMIT) if RPM_LIMIT > 0 else None
+        self.tokens = _Bucket(TPM_LIMIT) if TPM_LIMIT > 0 else None
+        # Set from a 429's Retry-After; nothing goes out for this key before it
+        self.paused_until = 0.0
+        self.queued = 0
+        self.in_flight = 0
+        self.calls = 0
+        self.timeouts = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+
+_states: dict[str, _KeyState] = {}
+
+
+def key_id(api_key: str) -> str:
+    # Never keep raw API keys around (they show up in stats)
+    return hashlib.sha256((api_key or "").encode("utf-8")).hexdigest()[:12]
+
+
+def _state(api_key: str) -> _KeyState:
+    key = key_id(api_key)
+    if key not in _states:
+        _states[key] = _KeyState()
+    return _states[key]
+
+
+def pause_key(api_key: str, seconds: float):
+    """Hold all calls for this key for `seconds` (e.g. after a 429 with Retry-After)."""
+    state = _state(api_key)
+    state.paused_until = max(state.paused_until, time.monotonic() + seconds)
+
+
+def estimate_tokens(prompt: str, has_image: bool = True) -> int:
+    """Rough prompt-token estimate (~4 chars per token) used to reserve TPM before a call."""
+    return len(prompt or "") // 4 + (IMAGE_TOKEN_ESTIMATE if has_image else 0)
+
+
+async def _wait_for_quota(state: _KeyState, estimated_tokens: int):
+    async with state.lock:
+        while True:
+            delay = state.paused_until - time.monotonic()
+            if state.requests is not None:
+                delay = max(delay, state.requests.wait_time(1))
+            if state.tokens is not None:
+                delay = max(delay, state.tokens.wait_time(estimated_tokens))
+            if delay <= 0:
+                break
+            await asyncio.sleep(delay)
+
+        if state.requests is not None:
+            state.requests.take(1)
+        if state.tokens is not None:
+            state.tokens.take(estimated_tokens)
+
+
+def _quota_eta(state: _KeyState, estimated_tokens: int) -> float:
+    """Rough seconds until this key has quota again, for Retry-After."""
+    delay = state.paused_until - time.monotonic()
+    if state.requests is not None:
+        delay = max(delay, state.requests.wait_time(1))
+    if state.tokens is not None:
+        delay = max(delay, state.tokens.wait_time(estimated_tokens))
+    return max(1.0, delay)
+
+
+class GeminiSlot:
+    """Handed to the caller inside gemini_slot(); report actual usage when known."""
+
+    def __init__(self, state: _KeyState, estimated_tokens: int):
+        self._state = state
+        self._estimated = estimated_tokens
+        self.wait_seconds = 0.0
+
+    def report_tokens(self, total_tokens: int):
+        """Settle the TPM reservation against the real token count."""
+        if self._state.tokens is None or not total_tokens:
+            return
+        difference = total_tokens - self._estimated
+        if difference > 0:
+            self._state.tokens.take(difference)
+        else:
+            self._state.tokens.give_back(-difference)
+        self._estimated = total_tokens
+
+
+@asynccontextmanager
+async def gemini_slot(api_key: str, estimated_tokens: int = 0):
+    """
+    Wait for a concurrency slot and RPM/TPM quota for this API key, then run
+    the body. Calls beyond the per-key limits queue here instead of going out
+    and coming back as 429s.
+    """
+    state = _state(api_key)
+    started = time.monotonic()
+    state.queued += 1
+    try:
+        await asyncio.wait_for(state.semaphore.acquire(), MAX_QUEUE_WAIT)
+        try:
+            remaining = MAX_QUEUE_WAIT - (time.monotonic() - started)
+            await asyncio.wait_for(_wait_for_quota(state, estimated_tokens), max(remaining, 0.001))
+        except BaseException:
+            state.semaphore.release()
+            raise
+    except asyncio.TimeoutError:
+        # Imported here: gemini_retry imports this module
+        from services.gemini_retry import RateLimitTimeout
+
+        state.timeouts += 1
+        raise RateLimitTimeout(
+            f"Gemini quota wait exceeded {MAX_QUEUE_WAIT:g}s for this API key",
+            retry_after=_quota_eta(state, estimated_tokens),
+        )
+    finally:
+        state.queued -= 1
+
+    slot = GeminiSlot(state, estimated_tokens)
+    slot.wait_seconds = time.monotonic() - started
+    state.calls += 1
+    state.total_wait += slot.wait_seconds
+    state.max_wait = max(state.max_wait, slot.wait_seconds)
+    state.in_flight += 1
+    try:
+        yield slot
+    finally:
+        state.in_flight -= 1
+        state.semaphore.release()
+
+
+def rate_limiter_stats() -> dict:
+    return {
+        "max_concurrency_per_key": MAX_CONCURRENCY_PER_KEY,
+        "rpm_limit": RPM_LIMIT,
+        "tpm_limit": TPM_LIMIT,
+        "keys": {
+            key: {
+                "queued": state.queued,
+                "in_flight": state.in_flight,
+                "paused_seconds": round(max(0.0, state.paused_until - time.monotonic()), 2),
+                "calls": state.calls,
+                "timeouts": state.timeouts,
+                "avg_wait_seconds": round(state.total_wait / state.calls, 4) if state.calls else 0.0,
+                "max_wait_seconds": round(state.max_wait, 4),
+                "rpm_available": state.requests.available() if state.requests else None,
+                "tpm_available": state.tokens.available() if state.tokens else None,
+            }
+            for key, state in _states.items()
+        },
+    }
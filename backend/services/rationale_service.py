@@ -0,0 +1,113 @@
+import asyncio
+import json
+import os
+from typing import AsyncIterator
+from services.gemini_service import analyze_text_and_image
+
+# Max concurrent Gemini analyses per batch request
+GENERATE_CONCURRENCY = int(os.getenv("GENERATE_CONCURRENCY", "5"))
+
+
+# ===============================
+# Trade Data Helpers
+# ===============================
+def row_to_trade_data(row: dict) -> dict:
+    """
+    Mirrors the frontend's row → trade_data conversion:
+    drop empty values, join lists, stringify everything else.
+    """
+    trade_data = {}
+    for key, value in (row or {}).items():
+        if value is None or value == "":
+            continue
+        if isinstance(value, list):
+            trade_data[key] = ", ".join(str(v) for v in value)
+        elif isinstance(value, dict):
+            trade_data[key] = json.dumps(value)
+        else:
+            trade_data[key] = str(value)
+    return trade_data
+
+
+def format_trade_data(trade_data: dict) -> str:
+    return "\n".join(f"{k}: {v}" for k, v in trade_data.items())
+
+
+def build_rationale_text(analysis) -> str:
+    """Bullet-joined technical commentary, same shape the frontend saves."""
+    if isinstance(analysis, list):
+        lines = analysis
+    else:
+        lines = str(analysis or "").split("\n")
+    return "\n".join(f"• {line.strip()}" for line in lines if line and line.strip())
+
+
+# ===============================
+# Generation
+# ===============================
+async def generate_rationale(
+    row: dict,
+    image_data: bytes,
+    mime_type: str,
+    api_key: str,
+    plan_type: str | None = None,
+    user_prompt: str | None = None,
+) -> dict:
+    """
+    Analyze one sheet row with its chart. Returns the result dict that is
+    stored as rationale_result; Gemini errors propagate to the caller.
+    """
+    trade_data = row_to_trade_data(row)
+    row_plan = plan_type or trade_data.get("Segment")
+    output = await analyze_text_and_image(
+        rationale=format_trade_data(trade_data),
+        image_data=image_data,
+        mime_type=mime_type,
+        api_key=api_key,
+        plan_type=row_plan,
+        user_prompt=user_prompt,
+    )
+    return {
+        "status": "success",
+        "plan_type": row_plan or "generic",
+        "trade_data": trade_data,
+        "output": output,
+    }
+
+
+# ===============================
+# Batch Generation
+# ===============================
+async def generate_rationales(
+    jobs: list[dict],
+    api_key: str,
+    plan_type: str | None = None,
+    user_prompt: str | None = None,
+    concurrency: int = GENERATE_CONCURRENCY,
+) -> AsyncIterator[dict]:
+    """
+    Run analyze_text_and_image for many rows with bounded concurrency.
+
+    Each job is {"row_index", "row", "image_data", "mime_type"}.
+    Yields one result dict per job in completion order so callers can
+    persist rows as soon as they finish.
+    """
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+
+    async def _run(job: dict) -> dict:
+        async with semaphore:
+            try:
+                result = await generate_rationale(
+                    job["row"], job["image_data"], job["mime_type"], api_key, plan_type, user_prompt
+                )
+            except Exception as e:
+                return {"row_index": job["row_index"], "error": str(e)}
+        return {"row_index": job["row_index"], "result": result}
+
+    tasks = [asyncio.create_task(_run(job)) for job in jobs]
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            yield await next_done
+    finally:
+        for task in tasks:
+            task.cancel()
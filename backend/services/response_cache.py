@@ -0,0 +1,155 @@
+import asyncio
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# ===============================
+# Cache Settings
+# ===============================
+CACHE_ENABLED = os.getenv("GEMINI_CACHE_ENABLED", "1") != "0"
+CACHE_PATH = os.getenv("GEMINI_CACHE_PATH", "./gemini_cache.db")
+CACHE_TTL_SECONDS = int(os.getenv("GEMINI_CACHE_TTL", str(7 * 24 * 3600)))
+CACHE_MAX_BYTES = int(os.getenv("GEMINI_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+
+_lock = threading.Lock()
+_conn: sqlite3.Connection | None = None
+_stats = {"hits": 0, "misses": 0, "expired": 0, "evictions": 0, "writes": 0}
+
+
+def _get_conn() -> sqlite3.Connection:
+    global _conn
+    if _conn is None:
+        _conn = sqlite3.connect(CACHE_PATH, check_same_thread=False)
+        _conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS gemini_cache (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                last_access REAL NOT NULL
+            )
+            """
+        )
+        _conn.execute(
+            "CREATE INDEX IF NOT EXISTS ix_gemini_cache_last_access ON gemini_cache (last_access)"
+        )
+        _conn.commit()
+    return _conn
+
+
+def make_cache_key(*parts: str | bytes) -> str:
+    """SHA-256 over the prompt text, model, image bytes etc. that define a request."""
+    digest = hashlib.sha256()
+    for part in parts:
+        data = part if isinstance(part, (bytes, bytearray, memoryview)) else (part or "").encode("utf-8")
+        # Length prefix so ("ab", "c") and ("a", "bc") never collide
+        digest.update(len(data).to_bytes(8, "big"))
+        digest.update(data)
+    return digest.hexdigest()
+
+
+# ===============================
+# Sync Store (runs in a worker thread)
+# ===============================
+def _get(key: str):
+    now = time.time()
+    with _lock:
+        conn = _get_conn()
+        row = conn.execute(
+            "SELECT value, created_at FROM gemini_cache WHERE key = ?", (key,)
+        ).fetchone()
+
+        if row is None:
+            _stats["misses"] += 1
+            return None
+
+        value, created_at = row
+        if now - created_at > CACHE_TTL_SECONDS:
+            conn.execute("DELETE FROM gemini_cache WHERE key = ?", (key,))
+            conn.commit()
+            _stats["expired"] += 1
+            _stats["misses"] += 1
+            return None
+
+        conn.execute("UPDATE gemini_cache SET last_access = ? WHERE key = ?", (now, key))
+        conn.commit()
+        _stats["hits"] += 1
+        return json.loads(value)
+
+
+def _put(key: str, value: dict):
+    now = time.time()
+    payload = json.dumps(value)
+    size = len(payload.encode("utf-8"))
+    if size > CACHE_MAX_BYTES:
+        return
+
+    with _lock:
+        conn = _get_conn()
+        conn.execute(
+            """
+            INSERT OR REPLACE INTO gemini_cache (key, value, size, created_at, last_access)
+            VALUES (?, ?, ?, ?, ?)
+            """,
+            (key, payload, size, now, now),
+        )
+        _stats["writes"] += 1
+
+        # Drop expired rows, then least-recently-used rows until under the size bound
+        conn.execute("DELETE FROM gemini_cache WHERE created_at < ?", (now - CACHE_TTL_SECONDS,))
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM gemini_cache").fetchone()[0]
+        if total > CACHE_MAX_BYTES:
+            for old_key, old_size in conn.execute(
+                "SELECT key, size FROM gemini_cache ORDER BY last_access ASC"
+            ).fetchall():
+                if total <= CACHE_MAX_BYTES:
+                    break
+                conn.execute("DELETE FROM gemini_cache WHERE key = ?", (old_key,))
+                total -= old_size
+                _stats["evictions"] += 1
+        conn.commit()
+
+
+# ===============================
+# Public API
+# ===============================
+async def cache_get(key: str):
+    if not CACHE_ENABLED:
+        return None
+    try:
+        return await asyncio.to_thread(_get, key)
+    except Exception as e:
+        print("GEMINI CACHE READ FAILED:", e)
+        return None
+
+
+async def cache_put(key: str, value: dict):
+    if not CACHE_ENABLED:
+        return
+    try:
+        await asyncio.to_thread(_put, key, value)
+    except Exception as e:
+        print("GEMINI CACHE WRITE FAILED:", e)
+
+
+def cache_stats() -> dict:
+    lookups = _stats["hits"] + _stats["misses"]
+    stats = dict(_stats)
+    stats["hit_rate"] = round(_stats["hits"] / lookups, 4) if lookups else 0.0
+    stats["enabled"] = CACHE_ENABLED
+    if CACHE_ENABLED:
+        with _lock:
+            entries, size = _get_conn().execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM gemini_cache"
+            ).fetchone()
+        stats["entries"] = entries
+        stats["size_bytes"] = size
+        stats["max_bytes"] = CACHE_MAX_BYTES
+    return stats
@@ -0,0 +1,274 @@
+import asyncio
+import os
+from datetime import datetime
+from itertools import islice
+from typing import AsyncIterator, Iterator
+from sqlalchemy import delete, insert, func, select, text, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+from sqlalchemy.orm.attributes import set_committed_value
+from models.sheet import Sheet, SheetRow, RowRationale
+
+# Rows per INSERT statement when writing a sheet's rows
+ROW_INSERT_BATCH = 500
+
+# Rationales loaded per query when walking a whole sheet (exports)
+RATIONALE_READ_BATCH = 100
+
+# Upper bound on rows accepted from a single uploaded file
+MAX_UPLOAD_ROWS = int(os.getenv("MAX_UPLOAD_ROWS", "50000"))
+
+
+def _row_values(sheet_id: int, rows: list[dict], start_position: int) -> list[dict]:
+    return [
+        {"sheet_id": sheet_id, "position": start_position + i, "data": row}
+        for i, row in enumerate(rows)
+    ]
+
+
+async def insert_sheet_rows(db: AsyncSession, sheet_id: int, rows: list[dict], start_position: int = 0) -> int:
+    """Bulk-insert rows for a sheet starting at start_position. Returns rows written."""
+    for offset in range(0, len(rows), ROW_INSERT_BATCH):
+        batch = rows[offset:offset + ROW_INSERT_BATCH]
+        await db.execute(insert(SheetRow), _row_values(sheet_id, batch, start_position + offset))
+    return len(rows)
+
+
+async def insert_sheet_rows_streaming(db: AsyncSession, sheet_id: int, rows: Iterator[dict], max_rows: int = MAX_UPLOAD_ROWS) -> int:
+    """
+    Insert rows from an iterator in ROW_INSERT_BATCH chunks, so only one
+    batch is held in memory. The iterator (file parsing) is advanced in a
+    worker thread so it never blocks the event loop.
+    Raises ValueError past max_rows. Does not commit.
+    """
+    written = 0
+    while True:
+        batch = await asyncio.to_thread(lambda: list(islice(rows, ROW_INSERT_BATCH)))
+        if not batch:
+            return written
+        if written + len(batch) > max_rows:
+            raise ValueError(f"Sheet has more than {max_rows} rows")
+        written += await insert_sheet_rows(db, sheet_id, batch, start_position=written)
+
+
+async def get_sheet_row(db: AsyncSession, sheet_id: int, row_index: int) -> SheetRow | None:
+    return await db.scalar(select(SheetRow).where(
+        SheetRow.sheet_id == sheet_id,
+        SheetRow.position == row_index
+    ))
+
+
+async def get_sheet_rows(db: AsyncSession, sheet_id: int, row_indices: list[int]) -> dict[int, SheetRow]:
+    rows = await db.scalars(select(SheetRow).where(
+        SheetRow.sheet_id == sheet_id,
+        SheetRow.position.in_(row_indices)
+    ))
+    return {row.position: row for row in rows}
+
+
+async def count_sheet_rows(db: AsyncSession, sheet_id: int) -> int:
+    return await db.scalar(select(func.count(SheetRow.id)).where(SheetRow.sheet_id == sheet_id)) or 0
+
+
+async def delete_sheet_row_at(db: AsyncSession, sheet_id: int, row_index: int) -> bool:
+    """
+    Delete the row at row_index and its rationale, then shift later rows
+    (and their rationales) up by one with set-based UPDATEs.
+    Does not commit. Returns False if there is no such row.
+
+    row_index is a dense 0-based position across the API: clients address
+    rows, rationales and processed_rows by array index and renumber their own
+    copy after a delete. Positions are therefore kept gap-free, which costs
+    one indexed UPDATE over the later rows, all inside the database.
+    """
+    deleted = await db.execute(delete(SheetRow).where(
+        SheetRow.sheet_id == sheet_id,
+        SheetRow.position == row_index
+    ))
+    if not deleted.rowcount:
+        return False
+
+    await db.execute(delete(RowRationale).where(
+        RowRationale.sheet_id == sheet_id,
+        RowRationale.row_index == row_index
+    ))
+
+    await db.execute(update(SheetRow).where(
+        SheetRow.sheet_id == sheet_id,
+        SheetRow.position > row_index
+    ).values(position=SheetRow.position - 1))
+
+    # (sheet_id, row_index) is unique, so shift in two steps: move later rows to
+    # negative indices first, then back to index - 1. A single "row_index - 1"
+    # UPDATE can collide with the next row depending on the order rows are visited.
+    await db.execute(update(RowRationale).where(
+        RowRationale.sheet_id == sheet_id,
+        RowRationale.row_index > row_index
+    ).values(row_index=-RowRationale.row_index))
+
+    await db.execute(update(RowRationale).where(
+        RowRationale.sheet_id == sheet_id,
+        RowRationale.row_index < 0
+    ).values(row_index=-RowRationale.row_index - 1))
+
+    return True
+
+
+async def upsert_row_rationale(db: AsyncSession, sheet_id: int, row_index: int, **fields):
+    """INSERT ... ON CONFLICT (sheet_id, row_index) DO UPDATE. Does not commit."""
+    dialect_insert = postgresql.insert if db.bind.dialect.name == "postgresql" else sqlite.insert
+    stmt = dialect_insert(RowRationale).values(sheet_id=sheet_id, row_index=row_index, **fields)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[RowRationale.sheet_id, RowRationale.row_index],
+        set_={**fields, "updated_at": func.now()},
+    )
+    await db.execute(stmt)
+
+
+# Appends row_index to sheets.processed_rows inside the UPDATE, so concurrent
+# saves (other requests, job workers in other processes) cannot drop each other's rows
+_APPEND_PROCESSED_ROW = {
+    "sqlite": text(
+        "UPDATE sheets SET processed_rows = json_insert("
+        "COALESCE(NULLIF(processed_rows, 'null'), '[]'), '$[#]', :row_index) "
+        "WHERE id = :sheet_id AND NOT EXISTS ("
+        "SELECT 1 FROM json_each(COALESCE(NULLIF(sheets.processed_rows, 'null'), '[]')) WHERE value = :row_index)"
+    ),
+    "postgresql": text(
+        "UPDATE sheets SET processed_rows = ("
+        "COALESCE(NULLIF(processed_rows::jsonb, 'null'::jsonb), '[]'::jsonb) || to_jsonb(CAST(:row_index AS integer)))::json "
+        "WHERE id = :sheet_id AND NOT COALESCE(NULLIF(processed_rows::jsonb, 'null'::jsonb), '[]'::jsonb) "
+        "@> jsonb_build_array(CAST(:row_index AS integer))"
+    ),
+}
+
+
+async def append_processed_row(db: AsyncSession, sheet: Sheet, row_index: int):
+    """Add row_index to the sheet's processed_rows if missing. Does not commit."""
+    await db.execute(
+        _APPEND_PROCESSED_ROW.get(db.bind.dialect.name, _APPEND_PROCESSED_ROW["sqlite"]),
+        {"sheet_id": sheet.id, "row_index": row_index},
+    )
+    # Keep the loaded object in step without marking it dirty (a flush would overwrite the SQL update)
+    current = list(sheet.processed_rows or [])
+    if row_index not in current:
+        set_committed_value(sheet, "processed_rows", current + [row_index])
+
+
+# Drops row_index from sheets.processed_rows and shifts later indices down by one, in SQL
+_REMOVE_PROCESSED_ROW = {
+    "sqlite": text(
+        "UPDATE sheets SET processed_rows = ("
+        "SELECT json_group_array(CASE WHEN value > :row_index THEN value - 1 ELSE value END) "
+        "FROM json_each(COALESCE(NULLIF(sheets.processed_rows, 'null'), '[]')) WHERE value != :row_index) "
+        "WHERE id = :sheet_id"
+    ),
+    "postgresql": text(
+        "UPDATE sheets SET processed_rows = ("
+        "SELECT COALESCE(json_agg(CASE WHEN e.value::int > :row_index THEN e.value::int - 1 ELSE e.value::int END "
+        "ORDER BY e.ord), '[]'::json) "
+        "FROM jsonb_array_elements_text(COALESCE(NULLIF(sheets.processed_rows::jsonb, 'null'::jsonb), '[]'::jsonb)) "
+        "WITH ORDINALITY AS e(value, ord) WHERE e.value::int != :row_index) "
+        "WHERE id = :sheet_id"
+    ),
+}
+
+
+async def remove_processed_row(db: AsyncSession, sheet: Sheet, row_index: int):
+    """processed_rows after deleting row_index: drop it, shift later indices down. Does not commit."""
+    await db.execute(
+        _REMOVE_PROCESSED_ROW.get(db.bind.dialect.name, _REMOVE_PROCESSED_ROW["sqlite"]),
+        {"sheet_id": sheet.id, "row_index": row_index},
+    )
+    set_committed_value(sheet, "processed_rows", [
+        i - 1 if i > row_index else i for i in (sheet.processed_rows or []) if i != row_index
+    ])
+
+
+async def save_row_rationale(
+    db: AsyncSession,
+    sheet: Sheet,
+    row_index: int,
+    rationale_text: str,
+    rationale_result: dict | None,
+    image_hash: str | None,
+    editable_rationale: str | None = None,
+) -> RowRationale:
+    """Create or update the rationale for one row and mark the row processed.
+    Uses a single INSERT ... ON CONFLICT so concurrent saves cannot create duplicates."""
+    await upsert_row_rationale(
+        db,
+        sheet_id=sheet.id,
+        row_index=row_index,
+        rationale_text=rationale_text,
+        rationale_result=rationale_result,
+        image_hash=image_hash,
+        image_preview=None,
+        editable_rationale=editable_rationale or rationale_text
+    )
+
+    await append_processed_row(db, sheet, row_index)
+    await db.commit()
+    return (await db.scalars(
+        select(RowRationale).where(
+            RowRationale.sheet_id == sheet.id,
+            RowRationale.row_index == row_index
+        ).execution_options(populate_existing=True)
+    )).one()
+
+
+async def iter_row_rationales(
+    db: AsyncSession, sheet_id: int, batch_size: int = RATIONALE_READ_BATCH
+) -> AsyncIterator[tuple[dict, RowRationale]]:
+    """
+    Yield (row data, rationale) for every row of a sheet that has a rationale,
+    in row order. Reads batch_size rows per query (keyset on row_index) and
+    drops each batch from the session, so memory stays flat for large sheets.
+    """
+    last_index = -1
+    while True:
+        result = await db.execute(
+            select(RowRationale, SheetRow.data)
+            .join(SheetRow, (SheetRow.sheet_id == RowRationale.sheet_id) & (SheetRow.position == RowRationale.row_index))
+            .where(RowRationale.sheet_id == sheet_id, RowRationale.row_index > last_index)
+            .order_by(RowRationale.row_index)
+            .limit(batch_size)
+        )
+        batch = result.all()
+        if not batch:
+            return
+        for rationale, data in batch:
+            yield data, rationale
+        last_index = batch[-1][0].row_index
+        db.expunge_all()
+
+
+async def mark_rationales_downloaded(db: AsyncSession, rationale_ids: list[int]) -> datetime:
+    """One UPDATE setting downloaded_at on all given rationales. Commits."""
+    now = datetime.utcnow()
+    if rationale_ids:
+        await db.execute(update(RowRationale).where(RowRationale.id.in_(rationale_ids)).values(downloaded_at=now))
+        await db.commit()
+    return now
+
+
+def migrate_legacy_rows(db: Session) -> int:
+    """
+    Copy sheets.rows_data JSON into sheet_rows for sheets not yet migrated. Returns sheets migrated.
+    Sync, since it runs inside the migrations runner.
+    """
+    sheet_ids = [
+        sid for (sid,) in db.query(Sheet.id).filter(
+            func.json_array_length(Sheet.legacy_rows_data) > 0,
+            ~Sheet.rows.any()
+        ).all()
+    ]
+    for sid in sheet_ids:
+        sheet = db.get(Sheet, sid)
+        rows = list(sheet.legacy_rows_data or [])
+        for offset in range(0, len(rows), ROW_INSERT_BATCH):
+            db.execute(insert(SheetRow), _row_values(sid, rows[offset:offset + ROW_INSERT_BATCH], offset))
+        sheet.legacy_rows_data = []
+        db.commit()
+    return len(sheet_ids)
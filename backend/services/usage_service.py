@@ -0,0 +1,360 @@
+import asyncio
+import json
+import math
+import os
+from datetime import datetime
+from typing import Iterable
+from sqlalchemy import case, insert
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.ext.asyncio import AsyncSession
+from models.usage import Usage, UsageDaily
+from utils.database import AsyncSessionLocal
+
+# ===============================
+# Queue Settings
+# ===============================
+# Usage rows are buffered in memory and written in one INSERT per batch,
+# when USAGE_FLUSH_SIZE rows are waiting or USAGE_FLUSH_INTERVAL seconds pass.
+USAGE_FLUSH_SIZE = int(os.getenv("USAGE_FLUSH_SIZE", "100"))
+USAGE_FLUSH_INTERVAL = float(os.getenv("USAGE_FLUSH_INTERVAL", "2"))
+USAGE_QUEUE_MAX = int(os.getenv("USAGE_QUEUE_MAX", "10000"))
+USAGE_DRAIN_TIMEOUT = float(os.getenv("USAGE_DRAIN_TIMEOUT", "10"))
+
+_queue: asyncio.Queue | None = None
+_worker: asyncio.Task | None = None
+_accepting = False
+_stats = {"enqueued": 0, "written": 0, "dropped": 0, "flushes": 0, "failed_flushes": 0}
+
+# Tells the worker to flush what it has and exit
+_STOP = object()
+
+# ===============================
+# Pricing
+# ===============================
+# USD per million tokens; GEMINI_PRICES (JSON of the same shape) overrides or adds models.
+# Thinking tokens are billed as output; cached prompt tokens at the cached-input rate.
+MODEL_PRICES = {
+    "gemini-2.5-flash": {"input": 0.30, "output": 2.50, "cached_input": 0.03},
+}
+MODEL_PRICES.update(json.loads(os.getenv("GEMINI_PRICES", "{}")))
+
+STAGE_FIELDS = (
+    "stage", "model", "prompt_tokens", "candidate_tokens", "thoughts_tokens",
+    "image_tokens", "cached_tokens", "total_tokens", "latency_ms",
+)
+
+
+# ===============================
+# Writer
+# ===============================
+def _rollup(batch: list[dict]) -> list[dict]:
+    """Collapse a batch of usage rows into per (client, action, day) increments."""
+    totals = {}
+    for row in batch:
+        if row["client_id"] is None:
+            continue
+        key = (row["client_id"], row["action"] or "", row["created_at"].date())
+        total = totals.get(key)
+        if total is None:
+            total = totals[key] = {
+                "client_id": key[0],
+                "action": key[1],
+                "day": key[2],
+                "request_count": 0,
+                "tokens_used": 0,
+                "last_activity": row["created_at"],
+            }
+        total["request_count"] += 1
+        total["tokens_used"] += row["tokens_used"] or 0
+        total["last_activity"] = max(total["last_activity"], row["created_at"])
+    return list(totals.values())
+
+
+async def _upsert_rollups(db: AsyncSession, rollups: list[dict]):
+    """Add increments to usage_daily with INSERT ... ON CONFLICT DO UPDATE. Does not commit."""
+    if not rollups:
+        return
+    dialect_insert = postgresql.insert if db.bind.dialect.name == "postgresql" else sqlite.insert
+    stmt = dialect_insert(UsageDaily)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[UsageDaily.client_id, UsageDaily.action, UsageDaily.day],
+        set_={
+            "request_count": UsageDaily.request_count + stmt.excluded.request_count,
+            "tokens_used": UsageDaily.tokens_used + stmt.excluded.tokens_used,
+            "last_activity": case(
+                (stmt.excluded.last_activity > UsageDaily.last_activity, stmt.excluded.last_activity),
+                else_=UsageDaily.last_activity,
+            ),
+        },
+    )
+    await db.execute(stmt, rollups)
+
+
+async def _flush(batch: list[dict]):
+    if not batch:
+        return
+    try:
+        async with AsyncSessionLocal() as db:
+            # Raw rows and their rollups commit together
+            await db.execute(insert(Usage), batch)
+            await _upsert_rollups(db, _rollup(batch))
+            await db.commit()
+        _stats["written"] += len(batch)
+        _stats["flushes"] += 1
+    except Exception as e:
+        _stats["failed_flushes"] += 1
+        _stats["dropped"] += len(batch)
+        print("USAGE FLUSH FAILED:", e)
+
+
+async def _run():
+    loop = asyncio.get_running_loop()
+    while True:
+        item = await _queue.get()
+        if item is _STOP:
+            break
+
+        # Collect more rows until the batch is full or the interval runs out
+        batch = [item]
+        deadline = loop.time() + USAGE_FLUSH_INTERVAL
+        stopping = False
+        while len(batch) < USAGE_FLUSH_SIZE:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                item = await asyncio.wait_for(_queue.get(), timeout)
+            except asyncio.TimeoutError:
+                break
+            if item is _STOP:
+                stopping = True
+                break
+            batch.append(item)
+
+        await _flush(batch)
+        if stopping:
+            break
+
+    # Drain anything queued after the stop marker
+    batch = []
+    while not _queue.empty():
+        item = _queue.get_nowait()
+        if item is not _STOP:
+            batch.append(item)
+        if len(batch) >= USAGE_FLUSH_SIZE:
+            await _flush(batch)
+            batch = []
+    await _flush(batch)
+
+
+# ===============================
+# Lifecycle
+# ===============================
+def start_usage_queue():
+    """Start the background writer. Called from the FastAPI lifespan."""
+    global _queue, _worker, _accepting
+    if _worker is None or _worker.done():
+        _queue = asyncio.Queue(maxsize=USAGE_QUEUE_MAX)
+        _worker = asyncio.create_task(_run())
+    _accepting = True
+
+
+async def stop_usage_queue():
+    """Stop accepting events and write everything still buffered."""
+    global _worker, _accepting
+    _accepting = False
+    if _worker is None or _worker.done():
+        _worker = None
+        return
+    await _queue.put(_STOP)
+    try:
+        await asyncio.wait_for(_worker, USAGE_DRAIN_TIMEOUT)
+    except asyncio.TimeoutError:
+        _stats["dropped"] += _queue.qsize()
+        print(f"USAGE DRAIN TIMED OUT, dropped {_queue.qsize()} events")
+    _worker = None
+
+
+# ===============================
+# Gemini Accounting
+# ===============================
+def usage_cost(usage: dict) -> float | None:
+    """USD cost of one Gemini call's usage log; None for a model without prices."""
+    prices = MODEL_PRICES.get(usage.get("model"))
+    if prices is None:
+        return None
+    cached = usage.get("cached_tokens") or 0
+    uncached = max(0, (usage.get("prompt_tokens") or 0) - cached)
+    output = (usage.get("candidate_tokens") or 0) + (usage.get("thoughts_tokens") or 0)
+    cost = uncached * prices["input"] + cached * prices["cached_input"] + output * prices["output"]
+    return round(cost / 1_000_000, 8)
+
+
+def _usage_details(usage: dict | None, plan_type: str | None) -> dict:
+    """Usage columns for one request from the usage dict gemini_service returns."""
+    details = {
+        "model": None, "plan_type": None, "prompt_tokens": None, "candidate_tokens": None,
+        "image_tokens": None, "cached_tokens": None, "latency_ms": None, "cost_usd": None, "stages": None,
+    }
+    if not usage:
+        return details
+
+    if usage.get("cached"):
+        # Served from the response cache: no Gemini call was made
+        calls = []
+    else:
+        # Multi-call analyses carry "stages"; a single call's usage log is its own stage
+        calls = usage.get("stages") or [usage]
+    stages = [{**{field: call.get(field) for field in STAGE_FIELDS}, "cost_usd": usage_cost(call)} for call in calls]
+    costs = [stage["cost_usd"] for stage in stages]
+
+    details.update(
+        model=usage.get("model") or None,
+        plan_type=(plan_type or "generic").lower(),
+        prompt_tokens=sum(stage["prompt_tokens"] or 0 for stage in stages),
+        candidate_tokens=sum(stage["candidate_tokens"] or 0 for stage in stages),
+        image_tokens=sum(stage["image_tokens"] or 0 for stage in stages),
+        cached_tokens=sum(stage["cached_tokens"] or 0 for stage in stages),
+        latency_ms=sum(stage["latency_ms"] or 0 for stage in stages) if stages else None,
+        cost_usd=None if None in costs else round(sum(costs), 8),
+        stages=stages,
+    )
+    return details
+
+
+# ===============================
+# Public API
+# ===============================
+def record_usage(
+    client_id: int,
+    action: str,
+    tokens_used: int,
+    usage: dict | None = None,
+    plan_type: str | None = None,
+) -> bool:
+    """
+    Queue a usage row for admin visibility. Pass the Gemini usage dict to
+    record the per-stage token / latency / cost breakdown with it.
+    Never blocks and never raises; returns False (and counts a dropped
+    event) if the queue is full or stopped.
+    """
+    if _queue is None:
+        # Running without the app lifespan (scripts); start the writer lazily
+        try:
+            asyncio.get_running_loop()
+            start_usage_queue()
+        except RuntimeError:
+            pass
+
+    if not _accepting:
+        _stats["dropped"] += 1
+        return False
+
+    try:
+        _queue.put_nowait({
+            "client_id": client_id,
+            "action": action,
+            "tokens_used": tokens_used,
+            "created_at": datetime.utcnow(),
+            **_usage_details(usage, plan_type),
+        })
+    except asyncio.QueueFull:
+        _stats["dropped"] += 1
+        return False
+    _stats["enqueued"] += 1
+    return True
+
+
+def usage_queue_stats() -> dict:
+    stats = dict(_stats)
+    stats["queued"] = _queue.qsize() if _queue is not None else 0
+    stats["accepting"] = _accepting
+    return stats
+
+
+# ===============================
+# Cost / Latency Dashboard
+# ===============================
+def _percentiles(values: list) -> dict | None:
+    """Nearest-rank p50 / p90 / p95 / p99."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    return {f"p{q}": ordered[max(0, math.ceil(q / 100 * len(ordered)) - 1)] for q in (50, 90, 95, 99)}
+
+
+class _Totals:
+    def __init__(self):
+        self.count = 0
+        self.cache_hits = 0
+        self.tokens = {"prompt_tokens": 0, "candidate_tokens": 0, "image_tokens": 0, "cached_tokens": 0, "total_tokens": 0}
+        self.cost_usd = 0.0
+        self.latencies = []
+
+    def add(self, tokens: dict, cost_usd: float | None, latency_ms: int | None):
+        self.count += 1
+        for field in self.tokens:
+            self.tokens[field] += tokens.get(field) or 0
+        self.cost_usd += cost_usd or 0.0
+        if latency_ms is None:
+            self.cache_hits += 1
+        else:
+            self.latencies.append(latency_ms)
+
+    def as_dict(self, count_name: str) -> dict:
+        return {
+            count_name: self.count,
+            "response_cache_hits": self.cache_hits,
+            **self.tokens,
+            "cost_usd": round(self.cost_usd, 6),
+            "latency_ms": _percentiles(self.latencies),
+        }
+
+
+def usage_dashboard(rows: Iterable, bucket: str = "day") -> dict:
+    """
+    Aggregate Usage rows into cost and latency per (client, plan type), per
+    stage, and per (time bucket, client, plan type).
+    rows: (client_id, username, plan_type, created_at, tokens_used,
+    prompt_tokens, candidate_tokens, image_tokens, cached_tokens, cost_usd,
+    latency_ms, stages).
+    """
+    bucket_format = "%Y-%m-%dT%H:00" if bucket == "hour" else "%Y-%m-%d"
+    overall = _Totals()
+    by_client_plan: dict[tuple, _Totals] = {}
+    by_stage: dict[tuple, _Totals] = {}
+    timeseries: dict[tuple, _Totals] = {}
+    usernames = {}
+
+    for (client_id, username, plan_type, created_at, tokens_used, prompt_tokens, candidate_tokens,
+         image_tokens, cached_tokens, cost_usd, latency_ms, stages) in rows:
+        usernames[client_id] = username
+        tokens = {
+            "prompt_tokens": prompt_tokens, "candidate_tokens": candidate_tokens,
+            "image_tokens": image_tokens, "cached_tokens": cached_tokens, "total_tokens": tokens_used,
+        }
+        overall.add(tokens, cost_usd, latency_ms)
+        by_client_plan.setdefault((client_id, plan_type), _Totals()).add(tokens, cost_usd, latency_ms)
+        period = created_at.strftime(bucket_format)
+        timeseries.setdefault((period, client_id, plan_type), _Totals()).add(tokens, cost_usd, latency_ms)
+        for stage in stages or []:
+            by_stage.setdefault((stage.get("stage"), stage.get("model")), _Totals()).add(
+                stage, stage.get("cost_usd"), stage.get("latency_ms") or 0
+            )
+
+    return {
+        "bucket": bucket,
+        "totals": overall.as_dict("requests"),
+        "by_client_plan": [
+            {"client_id": client_id, "username": usernames.get(client_id), "plan_type": plan_type, **totals.as_dict("requests")}
+            for (client_id, plan_type), totals in sorted(by_client_plan.items(), key=lambda item: -item[1].cost_usd)
+        ],
+        "by_stage": [
+            {"stage": stage, "model": model, **totals.as_dict("calls")}
+            for (stage, model), totals in sorted(by_stage.items(), key=lambda item: -item[1].cost_usd)
+        ],
+        "timeseries": [
+            {"period": period, "client_id": client_id, "plan_type": plan_type, **totals.as_dict("requests")}
+            for (period, client_id, plan_type), totals in sorted(timeseries.items(), key=lambda item: item[0][:2])
+        ],
+    }
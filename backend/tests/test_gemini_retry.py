@@ -0,0 +1,84 @@
+import asyncio
+import pytest
+from services import gemini_retry
+from services.gemini_retry import (
+    CircuitOpenError,
+    GeminiUnavailable,
+    call_with_retries,
+    check_breaker,
+    record_failure,
+)
+
+
+def _open_breaker(api_key: str, monkeypatch):
+    monkeypatch.setattr(gemini_retry, "MAX_RETRIES", 0)
+    monkeypatch.setattr(gemini_retry, "BREAKER_COOLDOWN", 0)
+    for _ in range(gemini_retry.BREAKER_THRESHOLD):
+        record_failure(api_key, GeminiUnavailable("down"))
+
+
+def test_cancelled_trial_releases_breaker(monkeypatch):
+    api_key = "test-cancelled-trial"
+    _open_breaker(api_key, monkeypatch)
+
+    async def scenario():
+        started = asyncio.Event()
+
+        async def hanging():
+            started.set()
+            await asyncio.sleep(3600)
+
+        trial = asyncio.create_task(call_with_retries(api_key, "test", hanging))
+        await started.wait()
+        trial.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await trial
+
+        async def ok():
+            return "ok"
+
+        # The next call becomes the new trial instead of being rejected forever
+        return await call_with_retries(api_key, "test", ok)
+
+    assert asyncio.run(scenario()) == "ok"
+    assert check_breaker(api_key) is None
+
+
+def test_non_gemini_error_releases_trial(monkeypatch):
+    api_key = "test-non-gemini-trial"
+    _open_breaker(api_key, monkeypatch)
+
+    async def broken():
+        raise RuntimeError("bug")
+
+    with pytest.raises(RuntimeError):
+        asyncio.run(call_with_retries(api_key, "test", broken))
+    assert check_breaker(api_key) is not None
+
+
+def test_stale_trial_times_out(monkeypatch):
+    api_key = "test-stale-trial"
+    _open_breaker(api_key, monkeypatch)
+    assert check_breaker(api_key) is not None
+    with pytest.raises(CircuitOpenError):
+        check_breaker(api_key)
+
+    # A trial that never reports back stops blocking the key after BREAKER_TRIAL_TIMEOUT
+    monkeypatch.setattr(gemini_retry, "BREAKER_TRIAL_TIMEOUT", 0)
+    assert check_breaker(api_key) is not None
+
+
+def test_queue_timeout_is_not_retried_or_counted(monkeypatch):
+    api_key = "test-queue-timeout"
+    calls = []
+
+    async def queued_out():
+        calls.append(1)
+        raise gemini_retry.RateLimitTimeout("quota wait exceeded", retry_after=7)
+
+    for _ in range(gemini_retry.BREAKER_THRESHOLD + 1):
+        with pytest.raises(gemini_retry.RateLimitTimeout):
+            asyncio.run(call_with_retries(api_key, "test", queued_out))
+    # One attempt per call, and the breaker stays closed
+    assert len(calls) == gemini_retry.BREAKER_THRESHOLD + 1
+    assert check_breaker(api_key) is None
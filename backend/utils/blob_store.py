@@ -0,0 +1,91 @@
+import base64
+import binascii
+import hashlib
+import os
+import re
+import tempfile
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Content-addressed image storage: <BLOB_DIR>/<sha[:2]>/<sha>
+BLOB_DIR = os.getenv("BLOB_DIR", "./blobs")
+
+_HASH_RE = re.compile(r"^[0-9a-f]{64}$")
+_DATA_URL_RE = re.compile(r"^data:([^;,]+)?(;base64)?,", re.IGNORECASE)
+
+
+def is_valid_hash(blob_hash: str) -> bool:
+    return bool(blob_hash) and bool(_HASH_RE.match(blob_hash))
+
+
+def blob_path(blob_hash: str) -> str:
+    if not is_valid_hash(blob_hash):
+        raise ValueError("Invalid blob hash")
+    return os.path.join(BLOB_DIR, blob_hash[:2], blob_hash)
+
+
+def write_atomic(path: str, data: bytes):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # Write to a temp file then rename, so readers never see a partial file
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def put_blob(data: bytes) -> str:
+    """Store bytes once (deduplicated by SHA-256) and return the hash."""
+    blob_hash = hashlib.sha256(data).hexdigest()
+    path = blob_path(blob_hash)
+    if not os.path.exists(path):
+        write_atomic(path, data)
+    return blob_hash
+
+
+def get_blob(blob_hash: str) -> bytes | None:
+    path = blob_path(blob_hash)
+    if not os.path.exists(path):
+        return None
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def decode_image_preview(value: str) -> bytes:
+    """Accepts a data URL (data:image/png;base64,...) or bare base64."""
+    match = _DATA_URL_RE.match(value)
+    if match:
+        value = value[match.end():]
+    try:
+        data = base64.b64decode("".join(value.split()), validate=True)
+    except (binascii.Error, ValueError):
+        raise ValueError("image_preview is not valid base64")
+    if not data:
+        raise ValueError("image_preview is empty")
+    return data
+
+
+def store_image_preview(value: str | None) -> str | None:
+    """Move an inline image_preview into the blob store, returning its hash."""
+    if not value:
+        return None
+    return put_blob(decode_image_preview(value))
+
+
+def sniff_mime_type(path: str) -> str:
+    with open(path, "rb") as f:
+        head = f.read(12)
+    if head.startswith(b"\x89PNG\r\n\x1a\n"):
+        return "image/png"
+    if head.startswith(b"\xff\xd8\xff"):
+        return "image/jpeg"
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "image/webp"
+    if head[:6] in (b"GIF87a", b"GIF89a"):
+        return "image/gif"
+    return "application/octet-stream"
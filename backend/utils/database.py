@@ -1,5 +1,6 @@
 import os
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.orm import sessionmaker, declarative_base
 from dotenv import load_dotenv
 
@@ -7,7 +8,61 @@ load_dotenv()
 
 DATABASE_URL = os.getenv("DATABASE_URL") or "sqlite:///./app.db"
 
-engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False} if DATABASE_URL.startswith("sqlite") else {})
+# ===============================
+# Pool / SQLite Settings
+# ===============================
+POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))  # seconds; -1 disables
+POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "1") != "0"
+
+# WAL + synchronous=NORMAL lets readers run alongside a writer and makes commits cheap
+SQLITE_TUNED = os.getenv("SQLITE_TUNED", "1") != "0"
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+SQLITE_MMAP_SIZE = int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024)))
+SQLITE_CACHE_SIZE_KB = int(os.getenv("SQLITE_CACHE_SIZE_KB", str(64 * 1024)))
+
+
+def _is_sqlite(url: str) -> bool:
+    return url.startswith("sqlite")
+
+
+def _is_sqlite_memory(url: str) -> bool:
+    return _is_sqlite(url) and (url.split("://", 1)[-1] in ("", "/", "/:memory:") or "mode=memory" in url)
+
+
+def _engine_kwargs(url: str) -> dict:
+    kwargs = {"pool_pre_ping": POOL_PRE_PING}
+    if _is_sqlite(url):
+        kwargs["connect_args"] = {"check_same_thread": False}
+    if not _is_sqlite_memory(url):
+        # In-memory SQLite uses a single shared connection, so sizing does not apply
+        kwargs.update(
+            pool_size=POOL_SIZE,
+            max_overflow=MAX_OVERFLOW,
+            pool_timeout=POOL_TIMEOUT,
+            pool_recycle=POOL_RECYCLE,
+        )
+    return kwargs
+
+
+def _set_sqlite_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    cursor.execute(f"PRAGMA busy_timeout = {SQLITE_BUSY_TIMEOUT_MS}")
+    if SQLITE_TUNED:
+        cursor.execute("PRAGMA journal_mode = WAL")
+        cursor.execute("PRAGMA synchronous = NORMAL")
+        cursor.execute(f"PRAGMA mmap_size = {SQLITE_MMAP_SIZE}")
+        # Negative cache_size is in KiB rather than pages
+        cursor.execute(f"PRAGMA cache_size = -{SQLITE_CACHE_SIZE_KB}")
+    cursor.close()
+
+
+engine = create_engine(DATABASE_URL, **_engine_kwargs(DATABASE_URL))
+
+if _is_sqlite(DATABASE_URL):
+    event.listen(engine, "connect", _set_sqlite_pragmas)
 
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
@@ -19,3 +74,34 @@ def get_db():
         yield db
     finally:
         db.close()
+
+
+# ===============================
+# Async engine (aiosqlite / asyncpg)
+# ===============================
+def to_async_url(url: str) -> str:
+    """Same database as DATABASE_URL, through its asyncio driver."""
+    if url.startswith("sqlite:"):
+        return "sqlite+aiosqlite:" + url[len("sqlite:"):]
+    if url.startswith("postgres://"):
+        url = "postgresql://" + url[len("postgres://"):]
+    for prefix in ("postgresql+psycopg2://", "postgresql://"):
+        if url.startswith(prefix):
+            # asyncpg takes ssl=..., not libpq's sslmode=...
+            return "postgresql+asyncpg://" + url[len(prefix):].replace("sslmode=", "ssl=")
+    return url
+
+ASYNC_DATABASE_URL = os.getenv("ASYNC_DATABASE_URL") or to_async_url(DATABASE_URL)
+
+async_engine = create_async_engine(ASYNC_DATABASE_URL, **_engine_kwargs(ASYNC_DATABASE_URL))
+
+if _is_sqlite(ASYNC_DATABASE_URL):
+    # Connect events fire on the sync engine; aiosqlite's adapter accepts the same cursor calls
+    event.listen(async_engine.sync_engine, "connect", _set_sqlite_pragmas)
+
+# expire_on_commit=False: attributes stay readable after commit without an implicit (blocking) reload
+AsyncSessionLocal = async_sessionmaker(async_engine, class_=AsyncSession, autoflush=False, expire_on_commit=False)
+
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
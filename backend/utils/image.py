@@ -1,5 +1,156 @@
-import base64
+import io
+import os
+from dotenv import load_dotenv
+from fastapi import UploadFile, HTTPException
 
-def read_image_as_base64(upload_file):
-    content = upload_file.file.read()
-    return base64.b64encode(content).decode("utf-8")
+load_dotenv()
+
+ALLOWED_TYPES = {"image/png", "image/jpeg", "image/webp"}
+
+# ===============================
+# Preprocessing Settings
+# ===============================
+# Chart screenshots are downscaled so the longest side is at most
+# IMAGE_MAX_SIDE and re-encoded before they go to Gemini or the blob store.
+IMAGE_PREPROCESS = os.getenv("IMAGE_PREPROCESS", "1") != "0"
+IMAGE_MAX_SIDE = int(os.getenv("IMAGE_MAX_SIDE", "1536"))
+IMAGE_FORMAT = os.getenv("IMAGE_FORMAT", "webp").lower()  # webp | jpeg
+IMAGE_QUALITY = int(os.getenv("IMAGE_QUALITY", "85"))
+
+# Uploads larger than this are rejected while they are being read
+MAX_IMAGE_BYTES = int(os.getenv("MAX_IMAGE_BYTES", str(10 * 1024 * 1024)))
+UPLOAD_READ_CHUNK = 64 * 1024
+
+_FORMATS = {"webp": ("WEBP", "image/webp"), "jpeg": ("JPEG", "image/jpeg"), "jpg": ("JPEG", "image/jpeg")}
+
+_stats = {"images": 0, "resized": 0, "reencoded": 0, "kept_original": 0, "failed": 0, "bytes_in": 0, "bytes_out": 0}
+
+
+def validate_image(image: UploadFile):
+    if image.content_type not in ALLOWED_TYPES:
+        raise HTTPException(
+            status_code=400,
+            detail="Only PNG, JPEG, WEBP images are allowed"
+        )
+
+
+def _too_large(max_bytes: int) -> HTTPException:
+    return HTTPException(
+        status_code=413,
+        detail=f"Image is larger than the {max_bytes / (1024 * 1024):g} MB limit"
+    )
+
+
+def read_upload(upload_file: UploadFile, max_bytes: int = MAX_IMAGE_BYTES) -> bytearray:
+    """
+    Read an upload in chunks, failing with 413 as soon as it passes max_bytes.
+    Chunks are appended in place, so the upload is held once, not as chunks plus a joined copy.
+    """
+    if upload_file.size is not None and upload_file.size > max_bytes:
+        raise _too_large(max_bytes)
+
+    data = bytearray()
+    while True:
+        chunk = upload_file.file.read(UPLOAD_READ_CHUNK)
+        if not chunk:
+            break
+        if len(data) + len(chunk) > max_bytes:
+            raise _too_large(max_bytes)
+        data += chunk
+    return data
+
+
+def _output_format() -> tuple[str, str]:
+    from PIL import features
+
+    pil_format, mime_type = _FORMATS.get(IMAGE_FORMAT, _FORMATS["webp"])
+    if pil_format == "WEBP" and not features.check("webp"):
+        # Pillow built without libwebp
+        return _FORMATS["jpeg"]
+    return pil_format, mime_type
+
+
+def _encode(data: bytes) -> tuple[bytes, str, bool]:
+    """Re-encode (downscaling if needed); returns (bytes, mime_type, resized)."""
+    from PIL import Image, ImageOps
+
+    with Image.open(io.BytesIO(data)) as img:
+        img = ImageOps.exif_transpose(img)
+        resized = max(img.size) > IMAGE_MAX_SIDE
+        if resized:
+            img.thumbnail((IMAGE_MAX_SIDE, IMAGE_MAX_SIDE), Image.Resampling.LANCZOS)
+
+        pil_format, mime_type = _output_format()
+        if img.mode not in ("RGB", "RGBA"):
+            img = img.convert("RGBA" if img.has_transparency_data else "RGB")
+        if pil_format == "JPEG" and img.mode == "RGBA":
+            # JPEG has no alpha; flatten onto white like the chart background
+            background = Image.new("RGB", img.size, (255, 255, 255))
+            background.paste(img, mask=img.getchannel("A"))
+            img = background
+
+        out = io.BytesIO()
+        if pil_format == "WEBP":
+            img.save(out, format="WEBP", quality=IMAGE_QUALITY, method=4)
+        else:
+            img.save(out, format="JPEG", quality=IMAGE_QUALITY, optimize=True)
+        encoded = out.getvalue()
+
+        if resized and len(encoded) >= len(data):
+            # Flat, few-colour charts can compress better losslessly; still ship the smaller pixels
+            lossless = io.BytesIO()
+            img.save(lossless, format="PNG")
+            if len(lossless.getvalue()) < len(encoded):
+                return lossless.getvalue(), "image/png", resized
+        return encoded, mime_type, resized
+
+
+def preprocess_image(data: bytes, mime_type: str) -> tuple[bytes, str]:
+    """
+    Downscale and re-encode a chart image. Returns (bytes, mime_type);
+    the original is kept when it is already small enough or cannot be decoded.
+    CPU-bound - call it off the event loop.
+    """
+    _stats["images"] += 1
+    _stats["bytes_in"] += len(data)
+    if not IMAGE_PREPROCESS:
+        _stats["kept_original"] += 1
+        _stats["bytes_out"] += len(data)
+        return data, mime_type
+
+    try:
+        encoded, new_mime_type, resized = _encode(data)
+    except Exception as e:
+        # Not decodable by Pillow (or Pillow missing); Gemini gets the upload as-is
+        print("IMAGE PREPROCESS FAILED:", e)
+        _stats["failed"] += 1
+        _stats["bytes_out"] += len(data)
+        return data, mime_type
+
+    if not resized and len(encoded) >= len(data):
+        _stats["kept_original"] += 1
+        _stats["bytes_out"] += len(data)
+        return data, mime_type
+
+    _stats["resized" if resized else "reencoded"] += 1
+    _stats["bytes_out"] += len(encoded)
+    return encoded, new_mime_type
+
+
+def prepare_image(upload_file: UploadFile) -> tuple[bytes, str]:
+    """
+    Read an upload (size-capped), preprocess it and return (bytes, mime_type).
+    The bytes stay raw; they are base64-encoded only as the Gemini request is sent.
+    """
+    return preprocess_image(read_upload(upload_file), upload_file.content_type)
+
+
+def image_stats() -> dict:
+    stats = dict(_stats)
+    stats["bytes_saved"] = _stats["bytes_in"] - _stats["bytes_out"]
+    stats["size_ratio"] = round(_stats["bytes_out"] / _stats["bytes_in"], 4) if _stats["bytes_in"] else 1.0
+    stats["enabled"] = IMAGE_PREPROCESS
+    stats["max_side"] = IMAGE_MAX_SIDE
+    stats["format"] = IMAGE_FORMAT
+    stats["quality"] = IMAGE_QUALITY
+    return stats
@@ -0,0 +1,59 @@
+import os
+import re
+from fastapi import HTTPException
+from fastapi.responses import JSONResponse
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Whole-request cap (an image, a spreadsheet, JSON); 0 disables it
+MAX_REQUEST_BYTES = int(os.getenv("MAX_REQUEST_BYTES", str(50 * 1024 * 1024)))
+
+# Batch generation uploads carry one chart per row: a 200-row batch of ~2 MB
+# screenshots is ~400 MB. Multipart parts spool to disk, so this bounds disk, not memory.
+MAX_BATCH_REQUEST_BYTES = int(os.getenv("MAX_BATCH_REQUEST_BYTES", str(512 * 1024 * 1024)))
+# POST /sheets/{id}/generate and POST /sheets/{id}/jobs
+BATCH_UPLOAD_PATH = re.compile(r"^/sheets/\d+/(generate|jobs)/?$")
+
+
+class BodySizeLimitMiddleware:
+    """
+    Rejects request bodies over max_bytes with 413 while they are being
+    received, before multipart parsing spools the rest of the upload.
+    """
+
+    def __init__(self, app, max_bytes: int = MAX_REQUEST_BYTES, batch_max_bytes: int = MAX_BATCH_REQUEST_BYTES):
+        self.app = app
+        self.max_bytes = max_bytes
+        self.batch_max_bytes = batch_max_bytes
+
+    def _limit(self, scope) -> int:
+        if scope["method"] == "POST" and BATCH_UPLOAD_PATH.match(scope["path"]):
+            return self.batch_max_bytes
+        return self.max_bytes
+
+    async def __call__(self, scope, receive, send):
+        max_bytes = self._limit(scope) if scope["type"] == "http" else 0
+        if max_bytes <= 0:
+            await self.app(scope, receive, send)
+            return
+
+        detail = f"Request body is larger than the {max_bytes // (1024 * 1024)} MB limit"
+        for name, value in scope.get("headers", []):
+            if name == b"content-length" and value.isdigit() and int(value) > max_bytes:
+                await JSONResponse({"detail": detail}, status_code=413)(scope, receive, send)
+                return
+
+        # Chunked uploads have no Content-Length, so count bytes as they arrive
+        received = 0
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > max_bytes:
+                    raise HTTPException(status_code=413, detail=detail)
+            return message
+
+        await self.app(scope, limited_receive, send)
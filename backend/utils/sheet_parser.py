@@ -1,4 +1,8 @@
-import pandas as pd
+import codecs
+import csv
+import io
+from datetime import date, datetime, time
+from typing import BinaryIO, Iterator
 from fastapi import UploadFile
 
 
@@ -7,6 +11,9 @@ def parse_sheet_to_key_value(file: UploadFile) -> dict:
     Reads Excel/CSV and converts:
     Column name → first row value
     """
+    # pandas is heavy to import; only pay for it when this helper is used
+    import pandas as pd
+
     if file.filename.endswith(".xlsx"):
         df = pd.read_excel(file.file)
     elif file.filename.endswith(".csv"):
@@ -31,3 +38,129 @@ def parse_sheet_to_key_value(file: UploadFile) -> dict:
         data[col] = str(value)
 
     return data
+
+
+# ===============================
+# Streaming row parser (no pandas)
+# ===============================
+SUPPORTED_EXTENSIONS = (".xlsx", ".xls", ".csv")
+
+# First bytes of an OLE2 compound file (binary BIFF .xls)
+_OLE2_MAGIC = b"\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1"
+
+
+def iter_sheet_rows(file: BinaryIO, filename: str) -> Iterator[dict]:
+    """
+    Yields the first worksheet's rows one at a time as {column: string value},
+    matching what the frontend's XLSX.sheet_to_json(defval: '', raw: false) produced.
+
+    - .xlsx is read with openpyxl in read-only (streaming) mode
+    - .xls is read with xlrd when it is a real BIFF workbook; exports that are
+      really tab/comma separated text (e.g. Trade_List_Report_*.xls) are read as text
+    - .csv is read line by line
+    """
+    name = (filename or "").lower()
+    if not name.endswith(SUPPORTED_EXTENSIONS):
+        raise ValueError("Only Excel (.xlsx, .xls) or CSV allowed")
+
+    if name.endswith(".xlsx"):
+        raw_rows = _iter_xlsx(file)
+    elif name.endswith(".xls") and file.read(8) == _OLE2_MAGIC:
+        file.seek(0)
+        raw_rows = _iter_xls(file)
+    else:
+        file.seek(0)
+        raw_rows = _iter_delimited(file)
+
+    header = None
+    for values in raw_rows:
+        values = [_format_cell(v) for v in values]
+        if header is None:
+            if any(values):
+                header = _normalize_header(values)
+            continue
+        if not any(values):
+            continue  # Skip blank rows
+        row = {}
+        for i, key in enumerate(header):
+            row[key] = values[i] if i < len(values) else ""
+        yield row
+
+
+def _iter_xlsx(file: BinaryIO) -> Iterator[tuple]:
+    from openpyxl import load_workbook
+
+    workbook = load_workbook(file, read_only=True, data_only=True)
+    try:
+        worksheet = workbook.worksheets[0]
+        for values in worksheet.iter_rows(values_only=True):
+            yield values
+    finally:
+        workbook.close()
+
+
+def _iter_xls(file: BinaryIO) -> Iterator[list]:
+    try:
+        import xlrd
+    except ImportError:
+        raise ValueError("Reading binary .xls files requires the xlrd package")
+
+    workbook = xlrd.open_workbook(file_contents=file.read(), on_demand=True)
+    try:
+        worksheet = workbook.sheet_by_index(0)
+        for r in range(worksheet.nrows):
+            values = []
+            for cell in worksheet.row(r):
+                if cell.ctype == xlrd.XL_CELL_DATE:
+                    values.append(xlrd.xldate.xldate_as_datetime(cell.value, workbook.datemode))
+                else:
+                    values.append(cell.value)
+            yield values
+    finally:
+        workbook.release_resources()
+
+
+def _iter_delimited(file: BinaryIO) -> Iterator[list]:
+    sample = file.read(4096)
+    file.seek(0)
+    encoding = "utf-8-sig" if sample.startswith(codecs.BOM_UTF8) else "utf-8"
+    text = io.TextIOWrapper(file, encoding=encoding, errors="replace", newline="")
+    try:
+        first_line = sample.decode(encoding, errors="replace").splitlines()[0] if sample else ""
+        delimiter = "\t" if first_line.count("\t") > first_line.count(",") else ","
+        for values in csv.reader(text, delimiter=delimiter):
+            yield values
+    finally:
+        # Leave the underlying upload file open for its owner
+        text.detach()
+
+
+def _format_cell(value) -> str:
+    if value is None:
+        return ""
+    if isinstance(value, datetime):
+        if value.time() == time(0, 0):
+            return value.strftime("%d-%m-%Y")
+        return value.strftime("%d-%m-%Y %I:%M %p")
+    if isinstance(value, date):
+        return value.strftime("%d-%m-%Y")
+    if isinstance(value, time):
+        return value.strftime("%I:%M %p").lstrip("0")
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value).strip()
+
+
+def _normalize_header(values: list[str]) -> list[str]:
+    """Trim names, strip BOMs and name blank/duplicate columns like SheetJS (__EMPTY, Name_1)."""
+    header = []
+    seen = {}
+    for value in values:
+        key = value.replace("\ufeff", "").strip() or "__EMPTY"
+        if key in seen:
+            seen[key] += 1
+            key = f"{key}_{seen[key]}"
+        else:
+            seen[key] = 0
+        header.append(key)
+    return header
@@ -21,7 +21,6 @@ import {
   FiPlus,
   FiMinus
 } from 'react-icons/fi'
-import * as XLSX from 'xlsx'
 import jsPDF from 'jspdf'
 import './App.css'
 import {
@@ -649,45 +648,32 @@ function App() {
     setExcelRows([])
 
     try {
-      const data = await file.arrayBuffer()
-      const workbook = XLSX.read(data, { type: 'array', cellDates: false, raw: false })
-      const sheetName = workbook.SheetNames[0]
-      const worksheet = workbook.Sheets[sheetName]
-
-      // Convert to JSON - headers inferred
-      // Use raw: false to get formatted strings (dates will be in their original format)
-      const json = XLSX.utils.sheet_to_json(worksheet, {
-        defval: '',
-        raw: false  // Get formatted values to preserve date/time formats as strings
-      })
-
-      // Normalize keys: trim & remove BOM etc
-      const normalized = json.map((row) => {
-        const out = {}
-        Object.keys(row).forEach((k) => {
-          const key = k.toString().trim()
-          let value = row[k]
-
-          // Keep all values as strings - no date conversion
-          // Dates will be preserved in their original format from Excel (e.g., DD-MM-YYYY)
-          out[key] = value
-        })
-        return out
-      })
-
-      // Save sheet to backend
+      // Save sheet to backend - the file is parsed on the server and rows stored there
       const uploadDate = new Date().toISOString().split('T')[0] // YYYY-MM-DD format
 
       try {
-        const response = await fetch(`${API_BASE_URL}/sheets`, {
+        const formData = new FormData()
+        formData.append('file', file)
+        formData.append('upload_date', uploadDate)
+
+        // Let the browser set the multipart Content-Type (with boundary)
+        const uploadHeaders = getAuthHeaders()
+        delete uploadHeaders['Content-Type']
+
+        const uploadResponse = await fetch(`${API_BASE_URL}/sheets/upload`, {
           method: 'POST',
-          headers: getAuthHeaders(),
-          body: JSON.stringify({
-            file_name: file.name,
-            upload_date: uploadDate,
-            rows_data: normalized,
-            processed_rows: []
-          })
+          headers: uploadHeaders,
+          body: formData
+        })
+        if (!uploadResponse.ok) {
+          const errData = await uploadResponse.json().catch(() => ({}))
+          throw new Error(errData.detail || 'Failed to save sheet to backend')
+        }
+        const uploaded = await uploadResponse.json()
+
+        // Fetch the parsed rows back from the backend
+        const response = await fetch(`${API_BASE_URL}/sheets/${uploaded.id}`, {
+          headers: getAuthHeaders()
         })
 
         if (response.ok) {
@@ -708,7 +694,7 @@ function App() {
 
           // Set as currently selected sheet
           setSelectedSheetId(sheetId)
-          setExcelRows(normalized)
+          setExcelRows(savedSheet.rows_data)
           setFileInfo({
             name: file.name,
             type: 'excel',
@@ -770,6 +756,21 @@ function App() {
     }
   }
 
+  // Chart images are served from the backend blob store; convert to data URLs for preview/PDF export
+  const fetchImageAsDataUrl = async (imageUrl) => {
+    const res = await fetch(`${API_BASE_URL}${imageUrl}`)
+    if (!res.ok) {
+      throw new Error(`HTTP error! status: ${res.status}`)
+    }
+    const blob = await res.blob()
+    return new Promise((resolve, reject) => {
+      const reader = new FileReader()
+      reader.onloadend = () => resolve(reader.result)
+      reader.onerror = reject
+      reader.readAsDataURL(blob)
+    })
+  }
+
   // Load a sheet from allSheets and fetch rationales from backend
   const loadSheet = async (sheetId) => {
     const sheet = allSheets.find(s => s.id === sheetId)
@@ -804,7 +805,8 @@ function App() {
               next[key] = {
                 rationale: r.rationale_text,
                 rationaleResult: r.rationale_result,
-                imagePreview: r.image_preview,
+                imagePreview: r.image_preview || next[key]?.imagePreview || null,
+                imageUrl: r.image_url || null,
                 editableRationale: r.editable_rationale || r.rationale_text,
                 editableKeyPoints: (r.rationale_result?.output?.key_points && Array.isArray(r.rationale_result.output.key_points))
                   ? r.rationale_result.output.key_points
@@ -815,6 +817,20 @@ function App() {
             })
             return next
           })
+          // Load chart images for rows that only carry a blob URL
+          rationales
+            .filter(r => !r.image_preview && r.image_url)
+            .forEach(async (r) => {
+              const key = `${r.sheet_id}_${r.row_index}`
+              try {
+                const dataUrl = await fetchImageAsDataUrl(r.image_url)
+                setRowRationaleData(prev => prev[key]
+                  ? { ...prev, [key]: { ...prev[key], imagePreview: dataUrl } }
+                  : prev)
+              } catch (e) {
+                console.error('Failed to load chart image for row:', e)
+              }
+            })
           // Sync processed count in allSheets (rationales are source of truth)
           setAllSheets(prev => prev.map(s => s.id === String(sheetId)
             ? { ...s, processedRows: processedIndices }